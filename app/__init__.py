@@ -8,15 +8,110 @@ from flask_cors import CORS
 
 from .routes.ideas import ideas
 from .routes.users import users
+from .routes.debug import debug
 
-from .db import init_driver, get_driver
+from .cache import TTLCache, VersionedCache
+from .db import connect_driver, get_driver
+from .hashing import PasswordHasher
+from .queries import verify_queries
 from .seed import reset_db, set_db_properties, dump_db, import_dev_data
+from .commands import (
+    refresh_similarity_command,
+    rebuild_rating_stats_command,
+    rebuild_idea_counters_command,
+    prune_events_command,
+    load_data_command,
+    export_snapshot_command,
+    restore_snapshot_command,
+    migrate_command,
+    check_queries_command,
+)
+from .models.similarity import update_stale_similarities
 
 
 def create_app():
     """Initialize the application"""
 
     app = Flask(__name__, instance_relative_config=False)
+    configure(app)
+
+    # Each worker starts its own pool of hashing processes when it first hashes
+    app.hasher = PasswordHasher(
+        workers=app.config.get("HASH_WORKERS"),
+        queue_depth=app.config.get("HASH_QUEUE_DEPTH"),
+    )
+
+    app.rankings = TTLCache(ttl=app.config.get("RANKING_TTL"))
+    app.seen_sets = TTLCache(
+        maxsize=app.config.get("SEEN_CACHE_SIZE"), ttl=app.config.get("SEEN_CACHE_TTL")
+    )
+    app.profiles = TTLCache(
+        maxsize=app.config.get("PROFILE_CACHE_SIZE"),
+        ttl=app.config.get("PROFILE_CACHE_TTL"),
+    )
+    app.idea_responses = VersionedCache(
+        maxsize=app.config.get("IDEA_CACHE_SIZE"),
+        ttl=app.config.get("IDEA_CACHE_TTL"),
+        version_ttl=app.config.get("IDEA_VERSION_TTL"),
+    )
+
+    with app.app_context():
+        # Under gunicorn this driver is closed before forking, and each
+        # worker opens its own in post_fork (see gunicorn.config.py)
+        driver = connect_driver()
+        set_db_properties(driver)
+        if app.config.get("FLASK_DEBUG"):
+            reset_db(driver)
+            update_stale_similarities(
+                driver,
+                k=app.config.get("SIMILARITY_NEIGHBOURS"),
+                min_overlap=app.config.get("SIMILARITY_MIN_OVERLAP"),
+            )
+            # dump_db(driver)
+            # import_dev_data(driver)
+
+        # Plans every registered query, so the first requests skip planning
+        verify_queries(driver, app.config.get("QUERY_PLAN_CHECK"), app.logger)
+
+    jwt = JWTManager(app)
+
+    CORS(app)
+
+    app.register_blueprint(ideas)
+    app.register_blueprint(users)
+    if app.config.get("DEBUG_ENDPOINTS"):
+        app.register_blueprint(debug)
+
+    app.cli.add_command(refresh_similarity_command)
+    app.cli.add_command(rebuild_rating_stats_command)
+    app.cli.add_command(rebuild_idea_counters_command)
+    app.cli.add_command(prune_events_command)
+    app.cli.add_command(load_data_command)
+    app.cli.add_command(export_snapshot_command)
+    app.cli.add_command(restore_snapshot_command)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(check_queries_command)
+
+    return app
+
+
+def create_minimal_app():
+    """
+    Initialize only the config and database driver, for processes that serve
+    no requests. Nothing is reset, seeded or planned.
+    """
+
+    app = Flask(__name__, instance_relative_config=False)
+    configure(app)
+
+    with app.app_context():
+        connect_driver()
+
+    return app
+
+
+def configure(app):
+    """Load the config from the environment"""
 
     app.config.from_mapping(
         SECRET_KEY=os.getenv("FLASK_SECRET", "secret"),
@@ -24,6 +119,43 @@ def create_app():
         JWT_AUTH_HEADER_PREFIX="Bearer",
         JWT_VERIFY_CLAIMS="signature",
         JWT_EXPIRATION_DELTA=timedelta(360),
+        SIMILARITY_NEIGHBOURS=int(os.getenv("SIMILARITY_NEIGHBOURS", 50)),
+        SIMILARITY_MIN_OVERLAP=int(os.getenv("SIMILARITY_MIN_OVERLAP", 1)),
+        SIMILARITY_MAX_AGE=int(os.getenv("SIMILARITY_MAX_AGE", 3600)),
+        RECOMMENDER_BACKEND=os.getenv("RECOMMENDER_BACKEND", "cypher"),
+        REACTION_EVENT_RETENTION=int(os.getenv("REACTION_EVENT_RETENTION", 86400)),
+        REACTION_BATCH_LIMIT=int(os.getenv("REACTION_BATCH_LIMIT", 100)),
+        RANKING_DEPTH=int(os.getenv("RANKING_DEPTH", 100)),
+        RANKING_TTL=int(os.getenv("RANKING_TTL", 300)),
+        TRENDING_HALF_LIFE=int(os.getenv("TRENDING_HALF_LIFE", 86400)),
+        SEEN_CACHE_SIZE=int(os.getenv("SEEN_CACHE_SIZE", 10000)),
+        SEEN_CACHE_TTL=int(os.getenv("SEEN_CACHE_TTL", 3600)),
+        NEO4J_MAX_POOL_SIZE=int(os.getenv("NEO4J_MAX_POOL_SIZE", 100)),
+        NEO4J_ACQUISITION_TIMEOUT=float(os.getenv("NEO4J_ACQUISITION_TIMEOUT", 60)),
+        NEO4J_MAX_CONNECTION_LIFETIME=float(
+            os.getenv("NEO4J_MAX_CONNECTION_LIFETIME", 3600)
+        ),
+        NEO4J_CONNECTION_TIMEOUT=float(os.getenv("NEO4J_CONNECTION_TIMEOUT", 30)),
+        ASYNC_FALLBACK_THREADS=int(os.getenv("ASYNC_FALLBACK_THREADS", 10)),
+        PROFILE_CACHE_SIZE=int(os.getenv("PROFILE_CACHE_SIZE", 10000)),
+        PROFILE_CACHE_TTL=int(os.getenv("PROFILE_CACHE_TTL", 300)),
+        IDEA_CACHE_SIZE=int(os.getenv("IDEA_CACHE_SIZE", 10000)),
+        IDEA_CACHE_TTL=int(os.getenv("IDEA_CACHE_TTL", 60)),
+        IDEA_VERSION_TTL=float(os.getenv("IDEA_VERSION_TTL", 5)),
+        BCRYPT_ROUNDS=int(os.getenv("SALT_ROUNDS", 12)),
+        HASH_WORKERS=int(os.getenv("HASH_WORKERS", 2)),
+        HASH_QUEUE_DEPTH=int(os.getenv("HASH_QUEUE_DEPTH", 8)),
+        DEBUG_ENDPOINTS=os.getenv("DEBUG_ENDPOINTS", "false") == "true",
+        QUERY_METRICS=os.getenv("QUERY_METRICS", "true") == "true",
+        QUERY_PROFILE_RATE=float(os.getenv("QUERY_PROFILE_RATE", 0)),
+        QUERY_METRICS_DIR=os.getenv("QUERY_METRICS_DIR", "query-metrics"),
+        QUERY_PLAN_CHECK=os.getenv("QUERY_PLAN_CHECK", "warn"),
+        REACTION_BUFFER=os.getenv("REACTION_BUFFER", "false") == "true",
+        REACTION_BUFFER_DIR=os.getenv("REACTION_BUFFER_DIR", "reaction-buffer"),
+        REACTION_BUFFER_SIZE=int(os.getenv("REACTION_BUFFER_SIZE", 500)),
+        REACTION_BUFFER_INTERVAL=float(os.getenv("REACTION_BUFFER_INTERVAL", 1)),
+        SEED_SNAPSHOT=os.getenv("SEED_SNAPSHOT", None),
+        SCHEMA_AWAIT_SECONDS=int(os.getenv("SCHEMA_AWAIT_SECONDS", 300)),
     )
 
     if os.getenv("FLASK_DEBUG") == "false":
@@ -42,23 +174,9 @@ def create_app():
             NEO4J_PASSWORD="test",
         ),
 
-    with app.app_context():
-        driver = init_driver(
-            app.config.get("NEO4J_URI"),
-            app.config.get("NEO4J_USERNAME"),
-            app.config.get("NEO4J_PASSWORD"),
+    # bcrypt only takes costs from 4 to 31, so catch a bad SALT_ROUNDS here
+    # rather than on every login
+    if not 4 <= app.config.get("BCRYPT_ROUNDS") <= 31:
+        raise ValueError(
+            f"SALT_ROUNDS must be between 4 and 31, not {app.config['BCRYPT_ROUNDS']}"
         )
-        set_db_properties(driver)
-        if app.config.get("FLASK_DEBUG"):
-            reset_db(driver)
-            # dump_db(driver)
-            # import_dev_data(driver)
-
-    jwt = JWTManager(app)
-
-    CORS(app)
-
-    app.register_blueprint(ideas)
-    app.register_blueprint(users)
-
-    return app
@@ -0,0 +1,87 @@
+"""
+Async serving mode
+An ASGI app that answers the busiest read-only idea routes with the async
+Neo4j driver, so that one event loop can keep many requests waiting on the
+database at once. Every other route, writes and logins included, is handed
+to the Flask app, which runs in a thread pool of ASYNC_FALLBACK_THREADS, so
+the whole API is served either way but only those reads scale past it.
+"""
+
+from a2wsgi import WSGIMiddleware
+from flask import Flask
+
+from app import create_app
+from app.aio.db import connect_async_driver, close_async_driver
+from app.aio.routes import Request, Unauthorized, routes
+
+
+class AsyncApp:
+    """ASGI app serving the async routes, falling back to a Flask app"""
+
+    def __init__(self, flask_app: Flask):
+        self.flask_app = flask_app
+        self.fallback = WSGIMiddleware(
+            flask_app, workers=flask_app.config.get("ASYNC_FALLBACK_THREADS")
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+
+        handler = None
+        if scope["type"] == "http":
+            handler = routes.get((scope["method"], scope["path"]))
+
+        if handler is None:
+            return await self.fallback(scope, receive, send)
+
+        with self.flask_app.app_context():
+            try:
+                answer = await handler(Request(scope))
+            except Unauthorized as error:
+                answer = {"msg": error.msg}, error.status
+            if answer is not None:
+                body, status = answer
+                response = self.flask_app.json.response(body)
+
+        if answer is None:
+            # Streams and the numpy recommender are left to the Flask app
+            return await self.fallback(scope, receive, send)
+
+        data = response.get_data()
+        headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in response.headers.items()
+        ]
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": headers + [(b"access-control-allow-origin", b"*")],
+            }
+        )
+        await send({"type": "http.response.body", "body": data})
+
+    async def lifespan(self, receive, send):
+        """Open the async driver in the server's event loop and close it on shutdown"""
+
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                with self.flask_app.app_context():
+                    await connect_async_driver()
+                await send({"type": "lifespan.startup.complete"})
+
+            elif message["type"] == "lifespan.shutdown":
+                with self.flask_app.app_context():
+                    await close_async_driver()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app() -> AsyncApp:
+    """Initialize the application for an ASGI server"""
+
+    return AsyncApp(create_app())
@@ -0,0 +1,42 @@
+"""Functions for connecting to Neo4j with the async driver"""
+
+from flask import current_app
+
+from neo4j import AsyncGraphDatabase
+
+from app.metrics import AsyncInstrumentedDriver
+
+
+async def connect_async_driver():
+    """
+    Initialize the async db driver from the app config. With QUERY_METRICS
+    on, it records its transaction functions with the sync driver's metrics.
+    """
+    config = current_app.config
+    driver = AsyncGraphDatabase.driver(
+        config.get("NEO4J_URI"),
+        auth=(config.get("NEO4J_USERNAME"), config.get("NEO4J_PASSWORD")),
+        max_connection_pool_size=config.get("NEO4J_MAX_POOL_SIZE"),
+        connection_acquisition_timeout=config.get("NEO4J_ACQUISITION_TIMEOUT"),
+        max_connection_lifetime=config.get("NEO4J_MAX_CONNECTION_LIFETIME"),
+        connection_timeout=config.get("NEO4J_CONNECTION_TIMEOUT"),
+    )
+    await driver.verify_connectivity()
+
+    if config.get("QUERY_METRICS"):
+        driver = AsyncInstrumentedDriver(driver, current_app.query_metrics)
+
+    current_app.async_driver = driver
+    return current_app.async_driver
+
+
+def get_async_driver():
+    """Get the instance of the async Neo4j driver"""
+    return current_app.async_driver
+
+
+async def close_async_driver():
+    """Close the async db driver and all sessions"""
+    if getattr(current_app, "async_driver", None) is not None:
+        await current_app.async_driver.close()
+        current_app.async_driver = None
@@ -0,0 +1,260 @@
+"""
+Async counterparts of the read-only idea model functions.
+They run the same queries as app.models.idea.
+"""
+
+import random
+
+from app.aio.seen import get_seen
+from app.models.idea import (
+    IDEA_RANKINGS,
+    IDEAS_BY_ID,
+    LISTINGS,
+    ORDERED,
+    PENDING_REACTED_IDEAS,
+    RANDOM_IDEA,
+    RANDOM_SAMPLE,
+    REACTED_IDEAS,
+    SEEN_IDEAS,
+    UNSEEN_SCAN,
+    listing_cursor,
+    listing_position,
+    page_cursor,
+    page_start,
+)
+from app.models.reaction import reaction_histogram, with_pending_reaction
+from app.types import (
+    Idea,
+    IdeaWithHistogram,
+    IdeaWithScore,
+    RankedIdea,
+    ReactionRequest,
+)
+
+
+##############################################################################
+# Transaction functions
+#
+
+
+async def get_ideas(
+    tx, sort: str, order: str, limit: int, after: dict | None
+) -> list[Idea]:
+    """
+    Transaction function for getting a page of ideas in a listing order,
+    starting after the idea at position after, or from the top if it is None
+    """
+
+    first, rest = LISTINGS[(sort, order)]
+
+    if after is None:
+        result = await tx.run(first, limit=limit)
+    else:
+        result = await tx.run(rest, limit=limit, key=after["key"], id=after["id"])
+
+    return [row["idea"] async for row in result]
+
+
+async def ideas_by_id(tx, idea_ids: list[str]) -> list[tuple[int, Idea]]:
+    """Transaction function for getting ideas by id with their ordinals, in order"""
+    result = await tx.run(IDEAS_BY_ID, idea_ids=idea_ids)
+    ideas = {row["idea_id"]: (row["ordinal"], row["idea"]) async for row in result}
+    return [ideas[idea_id] for idea_id in idea_ids if idea_id in ideas]
+
+
+##############################################################################
+# Main functions
+#
+
+
+async def all_ideas(
+    driver, sort="createdAt", order="desc", limit=20, cursor: str | None = None
+) -> tuple[list[Idea], str | None]:
+    """Get a page of all ideas, like app.models.idea.all_ideas"""
+
+    position = listing_position(sort, order, cursor)
+
+    async with driver.session() as session:
+        ideas = await session.execute_read(get_ideas, sort, order, limit, position)
+
+    return ideas, listing_cursor(sort, order, limit, ideas)
+
+
+async def random_idea(driver) -> Idea:
+    """Get a completely random idea"""
+
+    async def sample(tx):
+        for start in (random.random(), 0.0):
+            result = await (await tx.run(RANDOM_IDEA, start=start)).single()
+            # Nothing after the random point, so wrap around to the start
+            if result is not None:
+                return result
+
+    async with driver.session() as session:
+        return (await session.execute_read(sample))["i"]
+
+
+async def random_unseen_idea(
+    driver, user_id: str, batch_size=20, attempts=3, exclude=()
+) -> Idea | None:
+    """Get a random idea not seen by the user, sampling like the sync version"""
+
+    async def sample(tx, start: float):
+        result = await tx.run(RANDOM_SAMPLE, start=start, batch_size=batch_size)
+        return [(row["ordinal"], row["idea"]) async for row in result]
+
+    async def scan(tx, seen: list[int]):
+        result = await tx.run(UNSEEN_SCAN, seen=seen, exclude=list(exclude))
+        row = await result.single()
+        return row["idea"] if row else None
+
+    seen = await get_seen(driver, user_id)
+
+    async with driver.session() as session:
+        for _ in range(attempts):
+            for ordinal, idea in await session.execute_read(sample, random.random()):
+                if ordinal not in seen and idea["ideaId"] not in exclude:
+                    return idea
+
+        return await session.execute_read(scan, list(seen))
+
+
+async def popular_unseen_idea(
+    driver, user_id: str, batch_size=20, exclude=()
+) -> IdeaWithScore | None:
+    """Get the most liked idea that the user has not yet rated"""
+
+    return await first_unseen(driver, user_id, "likeCount", batch_size, exclude)
+
+
+async def trending_unseen_idea(
+    driver, user_id: str, batch_size=20, exclude=()
+) -> IdeaWithScore | None:
+    """Get the idea with the most recent likes that the user has not yet rated"""
+
+    return await first_unseen(driver, user_id, "trending", batch_size, exclude)
+
+
+async def find_ideas(driver, idea_ids: list[str]) -> list[Idea]:
+    """Get ideas by id, in the order given, skipping any that do not exist"""
+
+    async with driver.session() as session:
+        return [idea for _, idea in await session.execute_read(ideas_by_id, idea_ids)]
+
+
+async def get_idea_rankings(
+    driver, user_id: str, depth=100
+) -> dict[str, list[RankedIdea]]:
+    """Score the ideas liked by similar users, like app.models.idea.get_idea_rankings"""
+
+    seen = await get_seen(driver, user_id)
+
+    async def rankings(tx):
+        result = await tx.run(
+            IDEA_RANKINGS, user_id=user_id, depth=depth, seen=list(seen)
+        )
+        return (await result.single()).data()
+
+    async with driver.session() as session:
+        return await session.execute_read(rankings)
+
+
+async def get_seen_ideas(
+    driver, user_id: str, limit=None, cursor=None
+) -> tuple[list[Idea], str | None]:
+    """Get a page of the ideas a user has a direct connection with, newest first"""
+
+    query = SEEN_IDEAS[limit is not None]
+
+    async def user_seen(tx, before):
+        result = await tx.run(query, user_id=user_id, before=before, limit=limit)
+        return [(row["ordinal"], row["idea"]) async for row in result]
+
+    async with driver.session() as session:
+        rows = await session.execute_read(user_seen, page_start(cursor))
+
+    return [idea for _, idea in rows], page_cursor(rows, limit)
+
+
+async def get_all_seen_ideas_with_user_and_aggregate_reactions(
+    driver, user_id: str, limit=None, cursor=None, raw=False
+) -> tuple[list[IdeaWithHistogram], str | None]:
+    """Get a page of the ideas a user has reacted to, with histograms"""
+
+    query = REACTED_IDEAS[("seen_with_reactions", raw, limit is not None)]
+
+    async def reacted(tx, before):
+        result = await tx.run(query, user_id=user_id, before=before, limit=limit)
+        return [(row["ordinal"], row["idea"]) async for row in result]
+
+    async with driver.session() as session:
+        rows = await session.execute_read(reacted, page_start(cursor))
+
+    ideas = [idea for _, idea in rows]
+    for idea in ideas:
+        idea["histogram"] = reaction_histogram(idea)
+
+    return ideas, page_cursor(rows, limit)
+
+
+async def pending_reacted_ideas(
+    driver, kind: str, user_id: str, pending: dict[str, ReactionRequest], raw=False
+) -> list[IdeaWithHistogram]:
+    """Get the ideas a user has buffered reactions to, as reacted_ideas will give them"""
+
+    query = PENDING_REACTED_IDEAS[(kind, raw)]
+
+    async def reacted(tx):
+        result = await tx.run(
+            query, user_id=user_id, idea_ids=list(pending), before=None
+        )
+        return [row["idea"] async for row in result]
+
+    async with driver.session() as session:
+        ideas = await session.execute_read(reacted)
+
+    ideas = [with_pending_reaction(idea, pending[idea["ideaId"]]) for idea in ideas]
+    for idea in ideas:
+        idea["histogram"] = reaction_histogram(idea)
+
+    return ideas
+
+
+##############################################################################
+# Helper functions
+#
+
+
+async def first_unseen(
+    driver, user_id: str, order: str, batch_size: int, exclude=()
+) -> IdeaWithScore | None:
+    """Get the first idea the user has not seen in likeCount or trending order"""
+
+    if order not in ORDERED:
+        raise ValueError(f"Cannot order ideas by {order}")
+
+    first, rest = ORDERED[order]
+
+    async def ordered(tx, after: tuple | None):
+        if after is None:
+            result = await tx.run(first, batch_size=batch_size)
+        else:
+            key, ordinal = after
+            result = await tx.run(rest, batch_size=batch_size, key=key, ordinal=ordinal)
+        return [(row["key"], row["ordinal"], row["idea"]) async for row in result]
+
+    seen = await get_seen(driver, user_id)
+    after = None
+
+    async with driver.session() as session:
+        while True:
+            batch = await session.execute_read(ordered, after)
+
+            for _, ordinal, idea in batch:
+                if ordinal not in seen and idea["ideaId"] not in exclude:
+                    return idea
+
+            if len(batch) < batch_size:
+                return None
+
+            after = batch[-1][:2]
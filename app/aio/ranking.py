@@ -0,0 +1,48 @@
+"""Async counterparts of app.ranking, sharing its per-worker cache of rankings"""
+
+from flask import current_app
+
+from app.aio.idea import get_idea_rankings
+from app.aio.seen import get_seen
+from app.ranking import cache_rankings, page_ranking, ranking_offset
+from app.types import IdeaWithScore
+
+
+async def get_rankings(driver, user_id: str) -> dict:
+    """Get the cached rankings for a user, computing them if needed"""
+
+    rankings = current_app.rankings.get(user_id)
+    if rankings is not None:
+        return rankings
+
+    ranked = await get_idea_rankings(
+        driver, user_id, current_app.config.get("RANKING_DEPTH")
+    )
+    return cache_rankings(user_id, ranked)
+
+
+async def ranked_page(
+    driver, user_id: str, polarity: str, limit: int, cursor: str | None = None
+) -> tuple[list[IdeaWithScore], str | None]:
+    """Get a page of a user's ranking for one polarity, as for app.ranking"""
+
+    offset = ranking_offset(polarity, limit, cursor)
+    rankings = await get_rankings(driver, user_id)
+    seen = await get_seen(driver, user_id)
+    return page_ranking(rankings, seen, polarity, limit, offset)
+
+
+async def top_idea(driver, user_id: str, agreeable: bool) -> IdeaWithScore | None:
+    """Get the best unseen idea for a user from their ranking"""
+
+    polarity = "agreeable" if agreeable else "disagreeable"
+    cached = current_app.rankings.get(user_id) is not None
+
+    page, _ = await ranked_page(driver, user_id, polarity, 1)
+
+    if not page and cached:
+        # The cached ranking may be used up while deeper ideas remain
+        current_app.rankings.delete(user_id)
+        page, _ = await ranked_page(driver, user_id, polarity, 1)
+
+    return page[0] if page else None
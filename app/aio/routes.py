@@ -0,0 +1,306 @@
+"""
+Async versions of the read-only idea routes.
+Each handler takes a Request and returns the JSON body and status code,
+matching the Flask route it stands in for, or None to leave the request to
+the Flask route.
+"""
+
+from urllib.parse import parse_qsl
+
+from flask import current_app
+
+from flask_jwt_extended import decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import InvalidTokenError
+
+from app.aio.db import get_async_driver
+from app.buffer import pending_reactions
+from app.aio.idea import (
+    all_ideas,
+    random_idea,
+    random_unseen_idea,
+    popular_unseen_idea,
+    trending_unseen_idea,
+    find_ideas,
+    get_seen_ideas,
+    get_all_seen_ideas_with_user_and_aggregate_reactions,
+    pending_reacted_ideas,
+)
+from app.aio.ranking import ranked_page, top_idea
+from app.models.idea import LISTINGS
+from app.ranking import POLARITIES
+
+
+class Request:
+    """The parts of an ASGI request scope the routes read"""
+
+    def __init__(self, scope: dict):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = dict(parse_qsl(scope["query_string"].decode("latin-1")))
+        self.headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+
+
+class Unauthorized(Exception):
+    """The request has no valid access token"""
+
+    def __init__(self, msg: str, status: int):
+        super().__init__(msg)
+        self.msg = msg
+        self.status = status
+
+
+def user_id_from(request: Request) -> str:
+    """Get the userId claim of a request's access token, like get_jwt()"""
+
+    header = request.headers.get("authorization", "")
+    if not header.startswith("Bearer "):
+        raise Unauthorized("Missing Authorization Header", 401)
+
+    try:
+        claims = decode_token(header[len("Bearer ") :])
+    except (InvalidTokenError, JWTExtendedException) as error:
+        raise Unauthorized(str(error), 422)
+
+    return claims.get("userId", None)
+
+
+async def list_ideas(request: Request) -> tuple[dict, int]:
+    """Get a page of all ideas, sorted by createdAt, likeCount or trending"""
+
+    sort = request.args.get("sort", "createdAt")
+    order = request.args.get("order", "desc")
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        limit = 20
+
+    if (sort, order) not in LISTINGS:
+        return {"msg": f"Ideas cannot be sorted by {sort} {order}."}, 400
+
+    if limit < 1:
+        return {"msg": "The limit must be at least 1."}, 400
+
+    try:
+        ideas, cursor = await all_ideas(
+            get_async_driver(),
+            sort,
+            order,
+            min(limit, 100),
+            request.args.get("cursor", None),
+        )
+    except ValueError as err:
+        return {"msg": f"{err}."}, 400
+
+    return {"ideas": ideas, "cursor": cursor}, 200
+
+
+async def get_idea(request: Request) -> tuple[dict, int]:
+    """Get an idea from the database"""
+
+    idea = await random_idea(get_async_driver())
+
+    return {"idea": idea}, 200
+
+
+async def get_random_unseen_idea(request: Request) -> tuple[dict, int]:
+    """Get a random idea that the user has not yet seen"""
+
+    user_id = user_id_from(request)
+
+    idea = await random_unseen_idea(
+        get_async_driver(), user_id, exclude=pending_reactions(user_id).keys()
+    )
+
+    if idea is None:
+        return {"msg": "We are all out of ideas you haven't seen before."}, 404
+
+    return {"idea": idea}, 200
+
+
+async def get_popular_idea(request: Request) -> tuple[dict, int]:
+    """Get the most liked idea that the user has not yet seen"""
+
+    user_id = user_id_from(request)
+
+    idea = await popular_unseen_idea(
+        get_async_driver(), user_id, exclude=pending_reactions(user_id).keys()
+    )
+
+    if idea is None:
+        return {"msg": "We are all out of idea you haven't seen before."}, 404
+
+    return {"idea": idea}, 200
+
+
+async def get_trending_idea(request: Request) -> tuple[dict, int]:
+    """Get the most liked idea of late that the user has not yet seen"""
+
+    user_id = user_id_from(request)
+
+    idea = await trending_unseen_idea(
+        get_async_driver(), user_id, exclude=pending_reactions(user_id).keys()
+    )
+
+    if idea is None:
+        return {"msg": "We are all out of idea you haven't seen before."}, 404
+
+    return {"idea": idea}, 200
+
+
+async def get_disagreeable_idea(request: Request) -> tuple[dict, int] | None:
+    """Get an idea that the user should be interested in but disagree with"""
+
+    if not async_rankings():
+        return None
+
+    user_id = user_id_from(request)
+
+    idea = await top_idea(get_async_driver(), user_id, agreeable=False)
+
+    if idea is None:
+        return {"msg": "We are all out of ideas for you to disagree with."}, 404
+
+    return {"idea": idea}, 200
+
+
+async def get_agreeable_idea(request: Request) -> tuple[dict, int] | None:
+    """Get an idea that the user should be interested in and agree with"""
+
+    if not async_rankings():
+        return None
+
+    user_id = user_id_from(request)
+
+    idea = await top_idea(get_async_driver(), user_id, agreeable=True)
+
+    if idea is None:
+        return {"msg": "We are all out of nice ideas."}, 404
+
+    return {"idea": idea}, 200
+
+
+async def get_recommendations(request: Request) -> tuple[dict, int] | None:
+    """Get a page of the most agreeable and the most disagreeable ideas"""
+
+    if not async_rankings():
+        return None
+
+    user_id = user_id_from(request)
+
+    try:
+        limit = min(int(request.args.get("limit", 10)), 50)
+    except ValueError:
+        limit = 10
+
+    pages = {}
+    for polarity in POLARITIES:
+        try:
+            ideas, cursor = await ranked_page(
+                get_async_driver(),
+                user_id,
+                polarity,
+                limit,
+                request.args.get(f"{polarity}Cursor", None),
+            )
+        except ValueError as err:
+            return {"msg": f"{err}."}, 400
+        pages[polarity] = {"ideas": ideas, "cursor": cursor}
+
+    return pages, 200
+
+
+async def get_viewed_ideas(request: Request) -> tuple[dict, int] | None:
+    """Get a page of the ideas the user posted or reacted to, newest first"""
+
+    if request.args.get("stream", None) == "true":
+        return None
+
+    user_id = user_id_from(request)
+
+    try:
+        limit, cursor = page_args(request)
+        ideas, cursor = await get_seen_ideas(get_async_driver(), user_id, limit, cursor)
+    except ValueError as err:
+        return {"msg": f"{err}."}, 400
+
+    # Reactions still in the write-behind buffer come first
+    pending = list(pending_reactions(user_id))
+    ideas = [idea for idea in ideas if idea["ideaId"] not in pending]
+    if pending and request.args.get("cursor", None) is None:
+        ideas = await find_ideas(get_async_driver(), pending) + ideas
+
+    return {"ideas": ideas, "cursor": cursor}, 200
+
+
+async def get_viewed_with_relationships(request: Request) -> tuple[dict, int] | None:
+    """Get a page of the ideas the user reacted to, with histograms"""
+
+    if request.args.get("stream", None) == "true":
+        return None
+
+    user_id = user_id_from(request)
+    raw = request.args.get("raw-reactions", None) == "true"
+
+    try:
+        limit, cursor = page_args(request)
+        ideas, cursor = await get_all_seen_ideas_with_user_and_aggregate_reactions(
+            get_async_driver(), user_id, limit, cursor, raw
+        )
+    except ValueError as err:
+        return {"msg": f"{err}."}, 400
+
+    # Reactions still in the write-behind buffer come first
+    pending = pending_reactions(user_id)
+    ideas = [idea for idea in ideas if idea["ideaId"] not in pending]
+    if pending and request.args.get("cursor", None) is None:
+        ideas = (
+            await pending_reacted_ideas(
+                get_async_driver(), "seen_with_reactions", user_id, pending, raw
+            )
+            + ideas
+        )
+
+    return {"ideas": ideas, "cursor": cursor}, 200
+
+
+def page_args(request: Request) -> tuple[int | None, str | None]:
+    """
+    The limit and cursor asked for a list of the user's ideas, as for the
+    Flask routes. Raises ValueError if the limit is below 1.
+    """
+
+    try:
+        limit = int(request.args["limit"])
+    except (KeyError, ValueError):
+        limit = None
+
+    if limit is not None and limit < 1:
+        raise ValueError("The limit must be at least 1")
+
+    return (
+        min(limit, 100) if limit is not None else None,
+        request.args.get("cursor", None),
+    )
+
+
+def async_rankings() -> bool:
+    """Whether rankings come from a query the async driver can run"""
+    return current_app.config.get("RECOMMENDER_BACKEND") != "numpy"
+
+
+routes = {
+    ("GET", "/api/ideas/"): list_ideas,
+    ("GET", "/api/ideas/random"): get_idea,
+    ("GET", "/api/ideas/random-unseen"): get_random_unseen_idea,
+    ("GET", "/api/ideas/popular"): get_popular_idea,
+    ("GET", "/api/ideas/trending"): get_trending_idea,
+    ("GET", "/api/ideas/agreeable"): get_agreeable_idea,
+    ("GET", "/api/ideas/disagreeable"): get_disagreeable_idea,
+    ("GET", "/api/ideas/recommendations"): get_recommendations,
+    ("GET", "/api/ideas/viewed"): get_viewed_ideas,
+    ("GET", "/api/ideas/viewed-with-relationships"): get_viewed_with_relationships,
+}
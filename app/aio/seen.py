@@ -0,0 +1,49 @@
+"""Async counterparts of app.seen, sharing its per-worker cache"""
+
+from flask import current_app
+
+from app.seen import BitMap, SEEN_ORDINALS, SEEN_VERSION
+
+
+##############################################################################
+# Transaction functions
+#
+
+
+async def seen_ordinals(tx, user_id: str) -> tuple[int, list[int]]:
+    """Transaction function for getting a user's seen version and seen idea ordinals"""
+    result = await (await tx.run(SEEN_ORDINALS, user_id=user_id)).single()
+
+    if result is None:
+        return 0, []
+
+    return result["version"], result["ordinals"]
+
+
+async def seen_version(tx, user_id: str) -> int:
+    """Transaction function for getting a user's seen version"""
+    result = await (await tx.run(SEEN_VERSION, user_id=user_id)).single()
+    return result["version"] if result else 0
+
+
+##############################################################################
+# Main functions
+#
+
+
+async def get_seen(driver, user_id: str) -> BitMap:
+    """Get the ordinals of every idea a user has seen"""
+
+    cached = current_app.seen_sets.get(user_id)
+
+    async with driver.session() as session:
+        if cached is not None:
+            version, seen = cached
+            if await session.execute_read(seen_version, user_id) == version:
+                return seen
+
+        version, ordinals = await session.execute_read(seen_ordinals, user_id)
+
+    seen = BitMap(ordinals)
+    current_app.seen_sets.set(user_id, (version, seen))
+    return seen
@@ -0,0 +1,344 @@
+"""
+Write-behind reaction buffer
+When REACTION_BUFFER is on, reactions posted to the API are acknowledged as
+soon as they are appended to a local log, and a background thread writes
+them to the database in batches. Repeated reactions by a user to the same
+idea are coalesced, so only the last one is written.
+
+Every buffered reaction is fsynced to the worker's append log before it is
+acknowledged. The log is only discarded once its reactions are committed, and
+a worker that starts up claims the logs of workers that are no longer
+running, so a crash loses nothing that was acknowledged. A reaction that
+keeps failing to write for a reason other than the database being unavailable
+is moved to a dead-letter log, so it cannot hold up the rest.
+
+Buffered reactions live in the memory of the worker that took them, so a
+user reads their own buffered reactions only from that worker.
+"""
+
+import atexit
+import json
+import os
+import re
+import threading
+
+from flask import current_app
+from neo4j.exceptions import DriverError, TransientError
+
+from app.models.idea import react_to_ideas
+from app.types import ReactionRequest
+
+LOG_NAME = re.compile(r"^(?:claimed-(\d+)-)?(reactions-(\d+)\.(flushing|log))$")
+
+# Flushes a user's reactions may fail before they are written one at a time
+MAX_FLUSH_ATTEMPTS = 3
+
+
+class ReactionBuffer:
+    """Buffers one worker's reactions and flushes them on a size or time trigger"""
+
+    def __init__(self, app, directory: str, max_pending=500, interval=1.0):
+        self.app = app
+        self.directory = directory
+        self.max_pending = max_pending
+        self.interval = interval
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.pending: dict[str, dict[str, ReactionRequest]] = {}
+        self.flushing: dict[str, dict[str, ReactionRequest]] = {}
+        self.attempts: dict[str, int] = {}
+        self.count = 0
+        self.log_path = os.path.join(directory, f"reactions-{self.pid}.log")
+        self.flushing_path = os.path.join(
+            directory, f"reactions-{self.pid}.flushing"
+        )
+        self.dead_letter_path = os.path.join(directory, f"dead-letter-{self.pid}.log")
+        self.log = None
+        self.thread = None
+
+    def start(self) -> None:
+        """Recover orphaned logs, then start flushing in the background"""
+
+        os.makedirs(self.directory, exist_ok=True)
+        claimed = self.claim_orphans()
+        self.log = open(self.log_path, "a", encoding="utf8")
+
+        for path in claimed:
+            with open(path, encoding="utf8") as log:
+                for entry in read_log(log):
+                    self.append(entry)
+            os.remove(path)
+
+        self.thread = threading.Thread(
+            target=self.run, name="reaction-buffer", daemon=True
+        )
+        self.thread.start()
+
+    def add(self, user_id: str, reaction: ReactionRequest) -> None:
+        """Durably buffer a reaction"""
+
+        self.append({"userId": user_id, **reaction})
+
+        if self.count >= self.max_pending:
+            self.wake.set()
+
+    def pending_for(self, user_id: str) -> dict[str, ReactionRequest]:
+        """A user's reactions that are not yet committed, by ideaId"""
+
+        with self.lock:
+            return {
+                **self.flushing.get(user_id, {}),
+                **self.pending.get(user_id, {}),
+            }
+
+    def flush(self) -> int:
+        """Write everything buffered so far. Returns the number of reactions written."""
+
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return 0
+                batch, self.pending, self.count = self.pending, {}, 0
+                self.flushing = batch
+                self.log.close()
+                os.replace(self.log_path, self.flushing_path)
+                self.log = open(self.log_path, "a", encoding="utf8")
+
+            users = list(batch.items())
+            failed, written = {}, 0
+            with self.app.app_context():
+                for position, (user_id, reactions) in enumerate(users):
+                    try:
+                        react_to_ideas(
+                            current_app.driver, user_id, list(reactions.values())
+                        )
+                    except (DriverError, TransientError):
+                        # The database is unavailable, so keep everyone not yet written
+                        self.app.logger.exception("Could not flush buffered reactions")
+                        failed.update(users[position:])
+                        break
+                    except Exception:
+                        self.app.logger.exception(
+                            "Could not flush buffered reactions of %s", user_id
+                        )
+                        kept = self.retry(user_id, reactions)
+                        if kept:
+                            failed[user_id] = kept
+                        continue
+
+                    self.attempts.pop(user_id, None)
+                    written += len(reactions)
+
+            if failed:
+                self.restore(failed)
+            else:
+                with self.lock:
+                    self.flushing = {}
+                os.remove(self.flushing_path)
+
+            return written
+
+    def close(self) -> None:
+        """Stop the flusher and write out whatever is left"""
+
+        if self.thread is None or self.stopped.is_set():
+            return
+
+        self.stopped.set()
+        self.wake.set()
+        self.thread.join()
+        self.flush()
+
+        with self.lock:
+            self.log.close()
+            if not self.pending:
+                os.remove(self.log_path)
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+    def append(self, entry: dict) -> None:
+        """Log an entry and add it to the pending reactions"""
+
+        with self.lock:
+            self.log.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self.log.flush()
+            os.fsync(self.log.fileno())
+
+            reactions = self.pending.setdefault(entry["userId"], {})
+            if entry["ideaId"] not in reactions:
+                self.count += 1
+            reactions[entry["ideaId"]] = {
+                "ideaId": entry["ideaId"],
+                "type": entry["type"],
+                "agreement": entry.get("agreement"),
+            }
+
+    def retry(
+        self, user_id: str, reactions: dict[str, ReactionRequest]
+    ) -> dict[str, ReactionRequest]:
+        """
+        Count a failed flush of a user's reactions. Once it has failed too often,
+        write them one at a time and move those that still fail to the dead-letter
+        log. Returns the reactions to keep for the next flush.
+        """
+
+        attempts = self.attempts.get(user_id, 0) + 1
+        if attempts < MAX_FLUSH_ATTEMPTS:
+            self.attempts[user_id] = attempts
+            return reactions
+
+        self.attempts.pop(user_id, None)
+        kept = {}
+        for idea_id, reaction in reactions.items():
+            try:
+                react_to_ideas(current_app.driver, user_id, [reaction])
+            except (DriverError, TransientError):
+                kept[idea_id] = reaction
+            except Exception as error:
+                self.app.logger.error(
+                    "Moving a reaction of %s to %s to the dead-letter log",
+                    user_id,
+                    idea_id,
+                )
+                self.dead_letter({"userId": user_id, **reaction, "error": repr(error)})
+        return kept
+
+    def dead_letter(self, entry: dict) -> None:
+        with open(self.dead_letter_path, "a", encoding="utf8") as log:
+            log.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+
+    def restore(self, failed: dict) -> None:
+        """Put the reactions that failed to flush back in front of newer ones"""
+
+        with self.lock:
+            for user_id, reactions in self.pending.items():
+                failed.setdefault(user_id, {}).update(reactions)
+            self.pending = failed
+            self.count = sum(len(reactions) for reactions in failed.values())
+            self.flushing = {}
+
+            # The log must again hold everything pending, oldest first. Reactions
+            # that were written are left out, so a crash cannot write them twice.
+            self.log.close()
+            restored = self.log_path + ".tmp"
+            with open(restored, "w", encoding="utf8") as log:
+                for user_id, reactions in failed.items():
+                    for reaction in reactions.values():
+                        entry = {"userId": user_id, **reaction}
+                        log.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                log.flush()
+                os.fsync(log.fileno())
+            os.replace(restored, self.log_path)
+            os.remove(self.flushing_path)
+            self.log = open(self.log_path, "a", encoding="utf8")
+
+    def claim_orphans(self) -> list[str]:
+        """
+        Take over the logs of workers that are no longer running, oldest first.
+        Renaming is atomic, so only one worker can claim each log.
+        """
+
+        orphans = []
+        for name in os.listdir(self.directory):
+            match = LOG_NAME.match(name)
+            if match is None:
+                continue
+            claimer, base, pid, kind = match.groups()
+            owner = int(claimer or pid)
+            if owner != self.pid and is_running(owner):
+                continue
+            orphans.append((int(pid), kind == "log", name, base))
+
+        claimed = []
+        for _, _, name, base in sorted(orphans):
+            path = os.path.join(self.directory, f"claimed-{self.pid}-{base}")
+            try:
+                os.replace(os.path.join(self.directory, name), path)
+            except FileNotFoundError:
+                continue
+            claimed.append(path)
+
+        return claimed
+
+
+##############################################################################
+# Main functions
+#
+
+
+def get_buffer() -> ReactionBuffer | None:
+    """Get this worker's reaction buffer, starting it on first use, if it is on"""
+
+    if not current_app.config.get("REACTION_BUFFER"):
+        return None
+
+    buffer = getattr(current_app, "reaction_buffer", None)
+
+    if buffer is None or buffer.pid != os.getpid():
+        buffer = ReactionBuffer(
+            current_app._get_current_object(),
+            current_app.config.get("REACTION_BUFFER_DIR"),
+            max_pending=current_app.config.get("REACTION_BUFFER_SIZE"),
+            interval=current_app.config.get("REACTION_BUFFER_INTERVAL"),
+        )
+        buffer.start()
+        atexit.register(buffer.close)
+        current_app.reaction_buffer = buffer
+
+    return buffer
+
+
+def buffer_reaction(user_id: str, reaction: ReactionRequest) -> None:
+    """Buffer a reaction to be written in the background"""
+    get_buffer().add(user_id, reaction)
+
+
+def pending_reactions(user_id: str) -> dict[str, ReactionRequest]:
+    """A user's buffered reactions that are not yet in the database, by ideaId"""
+
+    buffer = get_buffer()
+    return buffer.pending_for(user_id) if buffer is not None else {}
+
+
+def close_buffer() -> None:
+    """Flush and stop this worker's buffer, if it has one"""
+
+    buffer = getattr(current_app, "reaction_buffer", None)
+    if buffer is not None and buffer.pid == os.getpid():
+        buffer.close()
+
+
+##############################################################################
+# Helper functions
+#
+
+
+def read_log(log) -> list[dict]:
+    """Read a buffer log, skipping a last line cut short by a crash"""
+
+    entries = []
+    for line in log:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            continue
+    return entries
+
+
+def is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
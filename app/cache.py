@@ -0,0 +1,95 @@
+"""In-process caches, one copy per worker process"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe mapping whose entries expire ttl seconds after they are set.
+    The least recently used entries are dropped once it holds maxsize.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return default
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def values(self) -> list:
+        """Every value that has not expired"""
+        now = time.monotonic()
+        with self.lock:
+            return [value for expires, value in self.entries.values() if expires >= now]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class VersionedCache:
+    """
+    Thread-safe cache of values rendered from an object, such as the
+    responses for an idea, stored under the object's version and a variant.
+    Versions are read from where the object is stored and remembered for
+    version_ttl seconds, or until this worker forgets them after a write.
+    Values stored under an older version are never served again, and expire.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300, version_ttl=5):
+        self.values = TTLCache(maxsize, ttl)
+        self.versions = TTLCache(maxsize, version_ttl)
+        self.forgotten = TTLCache(maxsize, version_ttl)
+
+    def version(self, key) -> int | None:
+        """The remembered version of an object, or None to read it again"""
+        return self.versions.get(key)
+
+    def remember(self, key, version: int, read_at: float) -> None:
+        """
+        Remember a version read at time.monotonic() read_at, unless the
+        object was forgotten since, when the read may predate the write
+        """
+        forgotten = self.forgotten.get(key)
+        if forgotten is None or forgotten < read_at:
+            self.versions.set(key, version)
+
+    def forget(self, key) -> None:
+        """Drop an object's version. Call after writing to it."""
+        self.forgotten.set(key, time.monotonic())
+        self.versions.delete(key)
+
+    def get(self, key, version: int, variant: tuple, default=None):
+        return self.values.get((key, version, variant), default)
+
+    def set(self, key, version: int, variant: tuple, value) -> None:
+        self.values.set((key, version, variant), value)
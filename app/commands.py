@@ -0,0 +1,193 @@
+"""Command line jobs, run with `flask <command>`"""
+
+import os
+import sys
+import threading
+import time
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .loader import load_files
+from .migrations import migrate, schema_status
+from .queries import QUERIES, check_queries
+from .seed import set_db_properties
+from .snapshot import export_snapshot, restore_snapshot
+from .models.event import prune_events
+from .models.reaction import rebuild_rating_stats, rebuild_idea_counters
+from .models.similarity import update_stale_similarities
+
+
+@click.command("refresh-similarity")
+@click.option(
+    "--interval",
+    type=int,
+    default=0,
+    help="Seconds between refreshes. Runs once and exits if omitted.",
+)
+@with_appcontext
+def refresh_similarity_command(interval):
+    """Keep the SIMILAR neighbour graph up to date"""
+
+    refresh_similarity(interval, threading.Event())
+
+
+@click.command("rebuild-rating-stats")
+@with_appcontext
+def rebuild_rating_stats_command():
+    """Recompute rating statistics from the LIKES relationships"""
+
+    rebuilt = rebuild_rating_stats(current_app.driver)
+    click.echo(f"Rebuilt rating statistics for {rebuilt} users")
+
+
+@click.command("rebuild-idea-counters")
+@with_appcontext
+def rebuild_idea_counters_command():
+    """Recompute every idea's reaction counters from its relationships"""
+
+    batches = rebuild_idea_counters(current_app.driver)
+    click.echo(f"Rebuilt reaction counters in {batches} batches")
+
+
+@click.command("prune-reaction-events")
+@with_appcontext
+def prune_events_command():
+    """Delete reaction events older than REACTION_EVENT_RETENTION seconds"""
+
+    pruned = prune_events(
+        current_app.driver,
+        timedelta(seconds=current_app.config.get("REACTION_EVENT_RETENTION")),
+    )
+    click.echo(f"Pruned {pruned} reaction events")
+
+
+@click.command("load-data")
+@click.option("--users", type=click.Path(exists=True), help="Users file")
+@click.option("--sources", type=click.Path(exists=True), help="Sources file")
+@click.option("--ideas", type=click.Path(exists=True), help="Ideas file")
+@click.option("--reactions", type=click.Path(exists=True), help="Reactions file")
+@click.option("--batch-size", type=int, default=5000, help="Rows per transaction.")
+@click.option(
+    "--cheap-hash",
+    is_flag=True,
+    help="Hash passwords at the lowest bcrypt cost, for synthetic users.",
+)
+@with_appcontext
+def load_data_command(users, sources, ideas, reactions, batch_size, cheap_hash):
+    """Bulk load users, sources, ideas and reactions from JSONL or CSV files"""
+
+    paths = {
+        kind: path
+        for kind, path in {
+            "users": users,
+            "sources": sources,
+            "ideas": ideas,
+            "reactions": reactions,
+        }.items()
+        if path
+    }
+
+    started = time.perf_counter()
+    for report in load_files(current_app.driver, paths, batch_size, cheap_hash):
+        click.echo(
+            f"Loaded {report['written']} of {report['read']} {report['kind']} "
+            f"in {report['seconds']:.1f}s ({report['rowsPerSecond']:.0f} rows/s)"
+        )
+    click.echo(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+@click.command("export-snapshot")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--chunk-size", type=int, default=100000, help="Rows per file.")
+@with_appcontext
+def export_snapshot_command(directory, chunk_size):
+    """Write the whole database to a snapshot directory"""
+
+    manifest = export_snapshot(current_app.driver, directory, chunk_size)
+    rows = sum(entry["rows"] for entry in manifest["files"])
+    click.echo(f"Exported {rows} rows to {len(manifest['files'])} files")
+
+
+@click.command("restore-snapshot")
+@click.argument("directory", type=click.Path(exists=True, file_okay=False))
+@click.option("--batch-size", type=int, default=5000, help="Rows per transaction.")
+@click.option("--workers", type=int, default=4, help="Files restored at once.")
+@click.confirmation_option(prompt="This deletes everything in the database. Go on?")
+@with_appcontext
+def restore_snapshot_command(directory, batch_size, workers):
+    """Replace the whole database with a snapshot"""
+
+    restored = restore_snapshot(current_app.driver, directory, batch_size, workers)
+    set_db_properties(current_app.driver)
+    click.echo(
+        f"Restored {restored['nodes']} nodes and {restored['relationships']} "
+        f"relationships in {restored['seconds']:.1f}s"
+    )
+
+
+@click.command("migrate")
+@with_appcontext
+def migrate_command():
+    """Apply any schema migrations the database lacks"""
+
+    applied = migrate(
+        current_app.driver, current_app.config.get("SCHEMA_AWAIT_SECONDS")
+    )
+    for migration in applied:
+        click.echo(f"Applied {migration['version']}: {migration['name']}")
+
+    status = schema_status(current_app.driver)
+    click.echo(f"Schema is at version {status['version']} of {status['latest']}")
+    for index in status["indexes"]:
+        if index["state"] != "ONLINE":
+            click.echo(f"{index['name']} is {index['state']}")
+
+
+@click.command("check-queries")
+@with_appcontext
+def check_queries_command():
+    """Plan every registered query and report hot ones that scan"""
+
+    problems = check_queries(current_app.driver)
+    for problem in problems:
+        click.echo(f"{problem['query']}: {', '.join(problem['operators'])}")
+    click.echo(f"Planned {len(QUERIES)} queries, {len(problems)} with bad plans")
+
+    if problems:
+        sys.exit(1)
+
+
+def refresh_similarity(interval: int, stop: threading.Event) -> None:
+    """
+    Refresh stale users' similarity every interval seconds until stop is set,
+    or once if interval is 0. Stops if the process that started it exits.
+    """
+
+    parent = os.getppid()
+
+    while not stop.is_set():
+        try:
+            refreshed = update_stale_similarities(
+                current_app.driver,
+                k=current_app.config.get("SIMILARITY_NEIGHBOURS"),
+                min_overlap=current_app.config.get("SIMILARITY_MIN_OVERLAP"),
+                max_age=timedelta(seconds=current_app.config.get("SIMILARITY_MAX_AGE")),
+            )
+            click.echo(f"Refreshed similarity for {refreshed} users")
+        except Exception:
+            # A refresher that runs for good outlives database hiccups
+            if not interval:
+                raise
+            current_app.logger.exception("Similarity refresh failed")
+
+        if not interval:
+            return
+
+        stop.wait(interval)
+
+        # Nobody is left to stop a refresher whose parent has exited
+        if os.getppid() != parent:
+            return
@@ -0,0 +1,25 @@
+"""Opaque pagination cursors"""
+
+import base64
+import binascii
+import json
+
+
+def encode_cursor(position: dict) -> str:
+    """Turn a position in a listing into a token clients pass back unchanged"""
+    data = json.dumps(position, separators=(",", ":")).encode("utf8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str | None) -> dict | None:
+    """Read a token made by encode_cursor. Returns None if it is missing or invalid."""
+    if not token:
+        return None
+
+    try:
+        data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        position = json.loads(data)
+    except (binascii.Error, ValueError):
+        return None
+
+    return position if isinstance(position, dict) else None
@@ -3,18 +3,52 @@ Functions for connecting to Neo4j database
 Adapted from https://github.com/neo4j-graphacademy/app-python/blob/main/api/neo4j.py
 """
 
-from flask import Flask, current_app
+import os
+import threading
+import time
+
+from flask import current_app
 
 from neo4j import GraphDatabase
 
+from app.metrics import InstrumentedDriver, QueryMetrics
+
+
+def init_driver(uri, username, password, **settings):
+    """
+    Initialize db driver. Extra settings, such as max_connection_pool_size,
+    are passed on to the driver. With QUERY_METRICS on, the driver records
+    every transaction function its sessions run.
+    """
+    driver = GraphDatabase.driver(uri, auth=(username, password), **settings)
+    driver.verify_connectivity()
+    current_app.pool_monitor = PoolMonitor(driver)
 
-def init_driver(uri, username, password):
-    """Initialize db driver"""
-    current_app.driver = GraphDatabase.driver(uri, auth=(username, password))
-    current_app.driver.verify_connectivity()
+    current_app.query_metrics = QueryMetrics(
+        current_app.config.get("QUERY_PROFILE_RATE", 0.0),
+        current_app.config.get("QUERY_METRICS_DIR") or None,
+    )
+    if current_app.config.get("QUERY_METRICS"):
+        driver = InstrumentedDriver(driver, current_app.query_metrics)
+
+    current_app.driver = driver
     return current_app.driver
 
 
+def connect_driver():
+    """Initialize db driver from the app config"""
+    config = current_app.config
+    return init_driver(
+        config.get("NEO4J_URI"),
+        config.get("NEO4J_USERNAME"),
+        config.get("NEO4J_PASSWORD"),
+        max_connection_pool_size=config.get("NEO4J_MAX_POOL_SIZE"),
+        connection_acquisition_timeout=config.get("NEO4J_ACQUISITION_TIMEOUT"),
+        max_connection_lifetime=config.get("NEO4J_MAX_CONNECTION_LIFETIME"),
+        connection_timeout=config.get("NEO4J_CONNECTION_TIMEOUT"),
+    )
+
+
 def get_driver():
     """Get the instance of the Neo4j driver"""
     return current_app.driver
@@ -27,3 +61,80 @@ def close_driver():
         current_app.driver = None
 
         return current_app.driver
+
+
+class PoolMonitor:
+    """
+    Tracks how busy a driver's connection pool is and how long acquiring a
+    connection from it takes, for this worker process.
+
+    The driver has no public pool metrics, so this wraps its private pool.
+    If the pool is not shaped as expected, stats report what they can.
+    """
+
+    def __init__(self, driver):
+        self.pool = getattr(driver, "_pool", None)
+        self.lock = threading.Lock()
+        self.acquisitions = 0
+        self.failures = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+        if self.pool is not None and hasattr(self.pool, "acquire"):
+            self.pool.acquire = self.timed(self.pool.acquire)
+
+    def timed(self, acquire):
+        """Wrap the pool's acquire to record how long each call waits"""
+
+        def timed_acquire(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                connection = acquire(*args, **kwargs)
+            except Exception:
+                self.record(time.perf_counter() - started, failed=True)
+                raise
+            self.record(time.perf_counter() - started)
+            return connection
+
+        return timed_acquire
+
+    def record(self, wait: float, failed=False) -> None:
+        with self.lock:
+            self.acquisitions += 1
+            self.failures += failed
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def stats(self) -> dict:
+        """Current pool utilization and acquisition waits since the pool opened"""
+
+        with self.lock:
+            stats = {
+                "pid": os.getpid(),
+                "acquisitions": self.acquisitions,
+                "failures": self.failures,
+                "waitMeanMs": 1000 * self.wait_total / self.acquisitions
+                if self.acquisitions
+                else 0.0,
+                "waitMaxMs": 1000 * self.wait_max,
+            }
+
+        try:
+            connections = [
+                connection
+                for address in list(self.pool.connections)
+                for connection in list(self.pool.connections.get(address, ()))
+            ]
+            size = self.pool.pool_config.max_connection_pool_size
+        except AttributeError:
+            return stats
+
+        in_use = sum(bool(connection.in_use) for connection in connections)
+        stats.update(
+            maxSize=size,
+            open=len(connections),
+            inUse=in_use,
+            idle=len(connections) - in_use,
+            utilization=in_use / size if size and size > 0 else None,
+        )
+        return stats
@@ -0,0 +1,357 @@
+"""
+In-process recommendation engine
+Holds every user's agreement ratings in memory and answers the agreeable and
+disagreeable recommendations with NumPy instead of Cypher. Each worker process
+loads its own copy once, then follows the reaction event feed to stay in step
+with writes made by every worker. Enable with RECOMMENDER_BACKEND=numpy.
+"""
+
+import os
+import threading
+
+from flask import current_app
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from app.models.event import events_since, latest_event_seq
+from app.models.idea import ideas_by_id
+from app.types import RankedIdea, ReactionEvent
+
+
+class RecommendationEngine:
+    """
+    Sparse user x idea agreement matrix, stored as a dict of ratings per user
+    and per idea so single cells can change cheaply, with NumPy copies of each
+    row and column built on demand for the vectorized maths.
+    """
+
+    def __init__(self, neighbours=50, min_overlap=1):
+        if np is None:
+            raise RuntimeError("The numpy recommender backend requires numpy")
+
+        self.neighbours = neighbours
+        self.min_overlap = min_overlap
+        self.pid = os.getpid()
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.seq = 0
+
+        self.user_index: dict[str, int] = {}
+        self.idea_index: dict[str, int] = {}
+        self.idea_ids: list[str | None] = []
+
+        self.by_user: list[dict[int, int]] = []
+        self.by_idea: list[dict[int, int]] = []
+        self.seen: list[set[int]] = []
+
+        self.rating_sum = np.zeros(0)
+        self.rating_count = np.zeros(0)
+
+        self._user_arrays: dict[int, tuple] = {}
+        self._idea_arrays: dict[int, tuple] = {}
+
+    ##########################################################################
+    # Loading and updates
+    #
+
+    def load(self, driver) -> None:
+        """Read every reaction and post from the database"""
+
+        def read_all(tx):
+            result = tx.run(
+                """
+                MATCH (u:User)-[r:LIKES|DISLIKES|POSTED]->(i:Idea)
+                RETURN u.userId AS userId, i.ideaId AS ideaId,
+                    type(r) AS type, r.agreement AS agreement
+                """
+            )
+            for row in result:
+                self._set(row["userId"], row["ideaId"], row["type"], row["agreement"])
+
+        with self.lock:
+            self._reset()
+            with driver.session() as session:
+                # Read the feed position first: replaying events that the
+                # load already saw is harmless, missing some is not
+                seq = session.execute_read(latest_event_seq)
+                session.execute_read(read_all)
+            self.seq = seq
+
+    def sync(self, driver, batch_size=1000) -> None:
+        """Apply every event written since the last sync"""
+
+        with self.lock:
+            while True:
+                with driver.session() as session:
+                    events = session.execute_read(events_since, self.seq, batch_size)
+
+                if not events:
+                    return
+
+                if events[0]["seq"] != self.seq + 1:
+                    # Events we never saw have been pruned
+                    return self.load(driver)
+
+                for event in events:
+                    self.apply(event)
+
+                if len(events) < batch_size:
+                    return
+
+    def apply(self, event: ReactionEvent) -> None:
+        """Apply a single event from the feed"""
+
+        with self.lock:
+            if event["type"] == "DELETED":
+                self._delete(event["ideaId"])
+            else:
+                self._set(
+                    event["userId"], event["ideaId"], event["type"], event["agreement"]
+                )
+            self.seq = max(self.seq, event["seq"])
+
+    def _user(self, user_id: str) -> int:
+        if user_id not in self.user_index:
+            self.user_index[user_id] = len(self.by_user)
+            self.by_user.append({})
+            self.seen.append(set())
+            if len(self.by_user) > len(self.rating_sum):
+                grow = np.zeros(max(16, len(self.rating_sum)))
+                self.rating_sum = np.concatenate([self.rating_sum, grow])
+                self.rating_count = np.concatenate([self.rating_count, grow])
+        return self.user_index[user_id]
+
+    def _idea(self, idea_id: str) -> int:
+        if idea_id not in self.idea_index:
+            self.idea_index[idea_id] = len(self.idea_ids)
+            self.idea_ids.append(idea_id)
+            self.by_idea.append({})
+        return self.idea_index[idea_id]
+
+    def _set(self, user_id: str, idea_id: str, type: str, agreement) -> None:
+        u = self._user(user_id)
+        i = self._idea(idea_id)
+        self.seen[u].add(i)
+
+        if type == "POSTED":
+            return
+
+        previous = self.by_user[u].pop(i, None)
+        self.by_idea[i].pop(u, None)
+        if previous is not None:
+            self.rating_sum[u] -= previous
+            self.rating_count[u] -= 1
+
+        if type == "LIKES":
+            self.by_user[u][i] = agreement
+            self.by_idea[i][u] = agreement
+            self.rating_sum[u] += agreement
+            self.rating_count[u] += 1
+
+        self._user_arrays.pop(u, None)
+        self._idea_arrays.pop(i, None)
+
+    def _delete(self, idea_id: str) -> None:
+        i = self.idea_index.pop(idea_id, None)
+        if i is None:
+            return
+
+        for u, agreement in self.by_idea[i].items():
+            del self.by_user[u][i]
+            self.rating_sum[u] -= agreement
+            self.rating_count[u] -= 1
+            self._user_arrays.pop(u, None)
+
+        # Nobody rates the idea any more, so it can never score again and
+        # stale entries in seen sets are harmless
+        self.by_idea[i] = {}
+        self.idea_ids[i] = None
+        self._idea_arrays.pop(i, None)
+
+    def _user_row(self, u: int) -> tuple:
+        if u not in self._user_arrays:
+            ratings = self.by_user[u]
+            self._user_arrays[u] = (
+                np.fromiter(ratings.keys(), dtype=np.int64, count=len(ratings)),
+                np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings)),
+            )
+        return self._user_arrays[u]
+
+    def _idea_column(self, i: int) -> tuple:
+        if i not in self._idea_arrays:
+            ratings = self.by_idea[i]
+            self._idea_arrays[i] = (
+                np.fromiter(ratings.keys(), dtype=np.int64, count=len(ratings)),
+                np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings)),
+            )
+        return self._idea_arrays[i]
+
+    ##########################################################################
+    # Recommendations
+    #
+
+    def similar_users(self, user_id: str) -> tuple:
+        """
+        Pearson similarity between a user and everyone who rated an idea in
+        common, keeping the strongest neighbours either way. Returns arrays of
+        neighbour indexes and their similarity.
+        """
+
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0))
+        u = self.user_index.get(user_id)
+        if u is None or not self.by_user[u]:
+            return empty
+
+        ideas, ratings = self._user_row(u)
+        columns = [self._idea_column(i) for i in ideas]
+        users = np.concatenate([column[0] for column in columns])
+        theirs = np.concatenate([column[1] for column in columns])
+        mine = np.repeat(ratings, [len(column[0]) for column in columns])
+
+        others = users != u
+        users, theirs, mine = users[others], theirs[others], mine[others]
+        if not len(users):
+            return empty
+
+        neighbours, row = np.unique(users, return_inverse=True)
+
+        # Center on each user's mean over all their ratings, not just the
+        # shared ones, the same as the Cypher recommender
+        mine = mine - ratings.mean()
+        means = self.rating_sum[neighbours] / self.rating_count[neighbours]
+        theirs = theirs - means[row]
+
+        nom = np.bincount(row, mine * theirs)
+        denom = np.sqrt(
+            np.bincount(row, mine * mine) * np.bincount(row, theirs * theirs)
+        )
+        overlap = np.bincount(row)
+
+        keep = (denom > 1e-9) & (overlap >= self.min_overlap)
+        neighbours = neighbours[keep]
+        pearson = nom[keep] / denom[keep]
+
+        if len(neighbours) > self.neighbours:
+            strongest = np.argpartition(-np.abs(pearson), self.neighbours)[
+                : self.neighbours
+            ]
+            neighbours, pearson = neighbours[strongest], pearson[strongest]
+
+        return neighbours, pearson
+
+    def scores(self, user_id: str) -> tuple:
+        """
+        Score every idea the user has not seen by the agreement of similar
+        users, weighted by their similarity. Returns arrays of idea indexes,
+        scores and the number of neighbours who rated each idea.
+        """
+
+        with self.lock:
+            neighbours, pearson = self.similar_users(user_id)
+            if not len(neighbours):
+                return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+
+            rows = [self._user_row(n) for n in neighbours]
+            ideas = np.concatenate([row[0] for row in rows])
+            weights = np.repeat(pearson, [len(row[0]) for row in rows])
+            ratings = np.concatenate([row[1] for row in rows])
+
+            # Sparse matrix-vector product of the neighbours' ratings with
+            # their similarity
+            size = len(self.idea_ids)
+            score = np.bincount(ideas, weights * ratings, minlength=size)
+            popularity = np.bincount(ideas, minlength=size)
+
+            candidates = popularity > 0
+            seen = self.seen[self.user_index[user_id]]
+            if seen:
+                candidates[np.fromiter(seen, dtype=np.int64, count=len(seen))] = False
+
+            ideas = np.flatnonzero(candidates)
+            return ideas, score[ideas], popularity[ideas]
+
+    def best(self, user_id: str, agreeable: bool) -> tuple[str, float, int] | None:
+        """The highest or lowest scoring unseen idea, as (ideaId, score, popularity)"""
+
+        ideas, score, popularity = self.scores(user_id)
+        if not len(ideas):
+            return None
+
+        n = np.argmax(score) if agreeable else np.argmin(score)
+        return self.idea_ids[ideas[n]], float(score[n]), int(popularity[n])
+
+    def ranking(self, user_id: str, depth: int) -> dict[str, list[tuple]]:
+        """
+        The depth highest and lowest scoring unseen ideas, as lists of
+        (ideaId, score, popularity), best first for each polarity
+        """
+
+        ideas, score, popularity = self.scores(user_id)
+        order = np.argsort(-score, kind="stable")
+
+        def entries(positions):
+            return [
+                (self.idea_ids[ideas[n]], float(score[n]), int(popularity[n]))
+                for n in positions
+            ]
+
+        return {
+            "agreeable": entries(order[:depth]),
+            "disagreeable": entries(order[::-1][:depth]),
+        }
+
+
+##############################################################################
+# Main functions
+#
+
+
+def get_engine(driver) -> RecommendationEngine:
+    """
+    Get this worker's engine, loading it on first use. Engines are never
+    shared across a fork, so each gunicorn worker loads its own.
+    """
+
+    engine = getattr(current_app, "engine", None)
+
+    if engine is None or engine.pid != os.getpid():
+        engine = RecommendationEngine(
+            neighbours=current_app.config.get("SIMILARITY_NEIGHBOURS"),
+            min_overlap=current_app.config.get("SIMILARITY_MIN_OVERLAP"),
+        )
+        engine.load(driver)
+        current_app.engine = engine
+    else:
+        engine.sync(driver)
+
+    return engine
+
+
+def rank_ideas(driver, user_id: str, depth=100) -> dict[str, list[RankedIdea]]:
+    """Get the depth most agreeable and most disagreeable unseen ideas from the engine"""
+
+    ranking = get_engine(driver).ranking(user_id, depth)
+    ids = {entry[0] for entries in ranking.values() for entry in entries}
+
+    with driver.session() as session:
+        ideas = {
+            idea["ideaId"]: (ordinal, idea)
+            for ordinal, idea in session.execute_read(ideas_by_id, list(ids))
+        }
+
+    return {
+        polarity: [
+            {
+                "ordinal": ideas[idea_id][0],
+                "idea": {**ideas[idea_id][1], "score": score, "popularity": popularity},
+            }
+            for idea_id, score, popularity in entries
+            if idea_id in ideas
+        ]
+        for polarity, entries in ranking.items()
+    }
@@ -0,0 +1,105 @@
+"""
+Password hashing
+bcrypt runs on a small pool of processes in each worker, so that a burst of
+logins cannot take over every CPU or hold the request thread's GIL. Once the
+pool and a short queue are taken, further calls fail straight away with
+HashingBusy instead of waiting.
+
+Each worker makes its own pool the first time it hashes, so a worker that is
+killed takes its pool and its place in the queue with it. A hashing process
+that dies only fails the calls it had, and the next call starts a new pool.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+from flask import current_app
+
+
+class HashingBusy(Exception):
+    """Too many passwords are already waiting to be hashed"""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a pool of workers processes, with at most queue_depth more
+    calls waiting in this worker
+    """
+
+    def __init__(self, workers=2, queue_depth=8):
+        self.workers = workers
+        self.limit = workers + queue_depth
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.pool = None
+        self.pid = None
+
+    def executor(self) -> ProcessPoolExecutor:
+        """This process's pool, made after a fork or once the last one broke"""
+        with self.lock:
+            if self.pool is None or self.pid != os.getpid():
+                # Spawned, not forked, so no lock held by another thread of
+                # the worker is copied into the hashing processes
+                self.pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                self.pid = os.getpid()
+            return self.pool
+
+    def run(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.limit:
+                raise HashingBusy()
+            self.pending += 1
+
+        try:
+            pool = self.executor()
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool as error:
+                with self.lock:
+                    if self.pool is pool:
+                        self.pool = None
+                raise HashingBusy() from error
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def hash(self, password: str, rounds: int) -> str:
+        return self.run(hash_with_salt, password, rounds)
+
+    def check(self, password: str, hashed: str) -> bool:
+        return self.run(bcrypt.checkpw, password.encode("utf8"), hashed.encode("utf8"))
+
+
+def get_hasher() -> PasswordHasher:
+    """Get this worker's hasher"""
+    return current_app.hasher
+
+
+def hash_password(password: str) -> str:
+    """Hash a password at the configured cost"""
+    return get_hasher().hash(password, current_app.config.get("BCRYPT_ROUNDS"))
+
+
+def check_password(password: str, hashed: str) -> bool:
+    """Check a password against its stored hash"""
+    return get_hasher().check(password, hashed)
+
+
+def needs_rehash(hashed: str) -> bool:
+    """Whether a stored hash was made at a different cost than the configured one"""
+    return hash_rounds(hashed) != current_app.config.get("BCRYPT_ROUNDS")
+
+
+def hash_rounds(hashed: str) -> int:
+    """Read the cost factor out of a bcrypt hash, like $2b$12$..."""
+    return int(hashed.split("$")[2])
+
+
+def hash_with_salt(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode("utf8"), bcrypt.gensalt(rounds)).decode("utf8")
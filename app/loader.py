@@ -0,0 +1,304 @@
+"""
+Bulk loading
+Streams users, sources, ideas and reactions from JSONL or CSV files and
+writes them in large UNWIND batches, for building big test graphs quickly.
+
+Rows refer to each other by id: ideas by userId and sourceId, reactions by
+userId and ideaId. Rows that leave out their own id get a new one.
+
+    users       userId, email, username, password
+    sources     sourceId, name
+    ideas       ideaId, userId, sourceId, url, description, createdAt
+    reactions   userId, ideaId, type (like or dislike), agreement
+
+Reactions are written as relationships only: rating statistics and idea
+counters are rebuilt once they are all in, and no events are recorded for
+anything loaded.
+"""
+
+import csv
+import gzip
+import itertools
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+from flask import current_app
+
+from app.hashing import hash_with_salt
+from app.models.reaction import (
+    rebuild_idea_counters,
+    rebuild_rating_stats,
+    trending_decay,
+)
+from app.types import LoadReport
+
+KINDS = ("users", "sources", "ideas", "reactions")
+
+# The lowest cost bcrypt allows. Logging in rehashes at the configured cost.
+CHEAP_ROUNDS = 4
+
+
+##############################################################################
+# Transaction functions
+#
+
+
+def create_users(tx, rows: list[dict]) -> int:
+    """Transaction function for adding a batch of users"""
+    return tx.run(
+        """
+        UNWIND $rows AS row
+        CREATE (u:User {
+            userId: row.userId,
+            email: row.email,
+            password: row.password,
+            username: row.username
+        })
+        RETURN count(u) AS created
+        """,
+        rows=rows,
+    ).single()["created"]
+
+
+def create_sources(tx, rows: list[dict]) -> int:
+    """Transaction function for adding a batch of sources"""
+    return tx.run(
+        """
+        UNWIND $rows AS row
+        CREATE (s:Source {sourceId: row.sourceId, name: row.name})
+        RETURN count(s) AS created
+        """,
+        rows=rows,
+    ).single()["created"]
+
+
+def create_ideas(tx, rows: list[dict]) -> int:
+    """
+    Transaction function for adding a batch of ideas, posted by existing users
+    and authored by existing sources. Ideas whose user does not exist are
+    skipped.
+    """
+    return tx.run(
+        """
+        MERGE (seq:Sequence {name: "ideaOrdinal"})
+        SET seq.value = coalesce(seq.value, 0) + size($rows)
+        WITH seq.value - size($rows) AS base
+        UNWIND range(0, size($rows) - 1) AS n
+        WITH $rows[n] AS row, base + n + 1 AS ordinal
+        MATCH (u:User {userId: row.userId})
+        CREATE (u)-[:POSTED]->(i:Idea {
+            ideaId: row.ideaId,
+            url: row.url,
+            description: row.description,
+            createdAt: coalesce(datetime(row.createdAt), datetime()),
+            randomKey: rand(),
+            ordinal: ordinal,
+            likeCount: 0,
+            dislikeCount: 0,
+            agreementSum: 0,
+            agreementCounts: [0, 0, 0, 0, 0, 0, 0]
+        })
+        SET i.trending = i.createdAt.epochMillis / 1000.0 * $decay
+        WITH row, i
+        OPTIONAL MATCH (s:Source {sourceId: row.sourceId})
+        FOREACH (source IN CASE WHEN s IS NULL THEN [] ELSE [s] END |
+            CREATE (source)-[:AUTHORED]->(i)
+        )
+        RETURN count(i) AS created
+        """,
+        rows=rows,
+        decay=trending_decay(),
+    ).single()["created"]
+
+
+def create_reactions(tx, likes: list[dict], dislikes: list[dict]) -> int:
+    """
+    Transaction function for adding a batch of reactions, replacing any the
+    users already had to the same ideas. Each new like counts towards its
+    idea's trending score as if it came in when the idea was posted.
+    """
+    likes_query = """
+        UNWIND $rows AS row
+        MATCH (u:User {userId: row.userId})
+        MATCH (i:Idea {ideaId: row.ideaId})
+        OPTIONAL MATCH (u)-[old:LIKES|DISLIKES]->(i)
+        WITH u, i, row, collect(old) AS old,
+            any(r IN collect(old) WHERE type(r) = "LIKES") AS liked
+        FOREACH (r IN old | DELETE r)
+        CREATE (u)-[:LIKES {agreement: row.agreement}]->(i)
+        WITH i, count(*) AS n, sum(CASE WHEN liked THEN 0 ELSE 1 END) AS new
+        CALL {
+            WITH i, new
+            WITH i, new
+            WHERE new > 0
+            WITH i, i.createdAt.epochMillis / 1000.0 * $decay + log(new) AS added
+            WITH i, i.trending IS NULL AS first, added,
+                coalesce(i.trending, added) AS old
+            WITH i, first,
+                CASE WHEN old > added THEN old ELSE added END AS high,
+                CASE WHEN old > added THEN added ELSE old END AS low
+            SET i.trending = CASE WHEN first THEN high ELSE high + log(1 + exp(low - high)) END
+        }
+        RETURN sum(n) AS created
+        """
+    dislikes_query = """
+        UNWIND $rows AS row
+        MATCH (u:User {userId: row.userId})
+        MATCH (i:Idea {ideaId: row.ideaId})
+        OPTIONAL MATCH (u)-[old:LIKES|DISLIKES]->(i)
+        WITH u, i, collect(old) AS old
+        FOREACH (r IN old | DELETE r)
+        CREATE (u)-[:DISLIKES]->(i)
+        RETURN count(*) AS created
+        """
+
+    created = 0
+    if likes:
+        result = tx.run(likes_query, rows=likes, decay=trending_decay()).single()
+        created += result["created"]
+    if dislikes:
+        created += tx.run(dislikes_query, rows=dislikes).single()["created"]
+    return created
+
+
+##############################################################################
+# Main functions
+#
+
+
+def load_rows(
+    driver, kind: str, rows: Iterable[dict], batch_size=5000, cheap_hash=False
+) -> LoadReport:
+    """
+    Write rows of one kind in batches of batch_size. Passwords are hashed at
+    the lowest cost with cheap_hash, or the configured cost otherwise.
+    """
+
+    if kind not in KINDS:
+        raise ValueError(f"Cannot load {kind}")
+
+    rounds = CHEAP_ROUNDS if cheap_hash else current_app.config.get("BCRYPT_ROUNDS")
+    started = time.perf_counter()
+    read, written = 0, 0
+
+    with ThreadPoolExecutor(os.cpu_count()) as hashers, driver.session() as session:
+        for batch in batched(rows, batch_size):
+            read += len(batch)
+
+            if kind == "users":
+                batch = prepare_users(batch, rounds, hashers)
+                written += session.execute_write(create_users, batch)
+            elif kind == "sources":
+                batch = [with_id(row, "sourceId") for row in batch]
+                written += session.execute_write(create_sources, batch)
+            elif kind == "ideas":
+                batch = [with_id(row, "ideaId") for row in batch]
+                written += session.execute_write(create_ideas, batch)
+            else:
+                likes, dislikes = prepare_reactions(batch)
+                written += session.execute_write(create_reactions, likes, dislikes)
+
+    seconds = time.perf_counter() - started
+    return {
+        "kind": kind,
+        "read": read,
+        "written": written,
+        "seconds": seconds,
+        "rowsPerSecond": read / seconds if seconds else 0.0,
+    }
+
+
+def load_files(
+    driver, paths: dict[str, str], batch_size=5000, cheap_hash=False
+) -> list[LoadReport]:
+    """
+    Load a file of each kind given, in dependency order, then rebuild what
+    is derived from reactions if any were loaded.
+    """
+
+    reports = [
+        load_rows(driver, kind, read_rows(paths[kind]), batch_size, cheap_hash)
+        for kind in KINDS
+        if kind in paths
+    ]
+
+    if "reactions" in paths:
+        rebuild_derived(driver)
+
+    return reports
+
+
+def rebuild_derived(driver) -> None:
+    """Rebuild idea counters and rating statistics after loading reactions"""
+    rebuild_idea_counters(driver)
+    rebuild_rating_stats(driver)
+
+
+##############################################################################
+# Helper functions
+#
+
+
+def read_rows(path: str) -> Iterator[dict]:
+    """Stream rows from a JSONL or CSV file, which may be gzipped"""
+
+    opener = gzip.open if path.endswith(".gz") else open
+    name = path[: -len(".gz")] if path.endswith(".gz") else path
+
+    with opener(path, "rt", encoding="utf8", newline="") as file:
+        if name.endswith(".csv"):
+            for row in csv.DictReader(file):
+                # CSV has no nulls or numbers
+                yield {
+                    key: (int(value) if key == "agreement" else value)
+                    for key, value in row.items()
+                    if value != ""
+                }
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batched(rows: Iterable[dict], size: int) -> Iterator[list[dict]]:
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def with_id(row: dict, key: str) -> dict:
+    """A row with a new id if it has none"""
+    return row if row.get(key) else {**row, key: str(uuid.uuid4())}
+
+
+def prepare_users(rows: list[dict], rounds: int, hashers) -> list[dict]:
+    """Give users ids and hash their passwords, unless already hashed"""
+
+    def hashed(row: dict) -> dict:
+        password = row["password"]
+        if not password.startswith("$2"):
+            password = hash_with_salt(password, rounds)
+        return {**with_id(row, "userId"), "password": password}
+
+    return list(hashers.map(hashed, rows))
+
+
+def prepare_reactions(rows: list[dict]) -> tuple[list[dict], list[dict]]:
+    """Split reactions into likes and dislikes, keeping the last of any repeats"""
+
+    last = {(row["userId"], row["ideaId"]): row for row in rows}
+    likes = [
+        {"userId": user_id, "ideaId": idea_id, "agreement": row["agreement"]}
+        for (user_id, idea_id), row in last.items()
+        if row["type"] in ("like", "LIKES")
+    ]
+    dislikes = [
+        {"userId": user_id, "ideaId": idea_id}
+        for (user_id, idea_id), row in last.items()
+        if row["type"] in ("dislike", "DISLIKES")
+    ]
+    return likes, dislikes
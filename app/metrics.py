@@ -0,0 +1,589 @@
+"""
+Per-query metrics
+Every transaction function run through execute_read or execute_write is
+recorded under the registered names of the queries it runs: calls, retries,
+errors, wall time, the server's result_available_after and
+result_consumed_after, and records returned. A sample of transactions runs
+with PROFILE to count database hits.
+
+The driver is wrapped rather than every model function, so any transaction
+function, old or new, is measured without changes. The async driver of the
+ASGI app is wrapped the same way.
+
+Each worker keeps its own totals. Given a directory, it also saves them there
+every few seconds, and reports the sum of every worker's totals, those of
+workers that have exited included, like Prometheus' multiprocess mode.
+"""
+
+import fcntl
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from app.queries import QUERY_NAMES
+
+# Histogram buckets for wall time, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Schema commands cannot be profiled. Data CREATE clauses open a pattern.
+SCHEMA_COMMAND = re.compile(r"^\s*(?:CREATE\s+(?!\()|DROP\s|SHOW\s)", re.IGNORECASE)
+
+# The totals each worker saves, and those of the workers that have exited
+TOTALS_FILE = re.compile(r"^queries-(\d+|retired)\.json$")
+
+# The name of a transaction that ran no registered query
+UNREGISTERED = "unregistered"
+
+
+class QueryMetrics:
+    """Thread-safe totals per named query, for this worker process"""
+
+    def __init__(self, profile_rate=0.0, directory: str | None = None, interval=5.0):
+        self.profile_rate = profile_rate
+        self.directory = directory
+        self.interval = interval
+        self.saved_at = 0.0
+        self.lock = threading.Lock()
+        self.queries: dict[tuple[str, str], dict] = {}
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def entry(self, name: str, access: str) -> dict:
+        """The totals for a query, created on first use. Call with the lock held."""
+        key = (name, access)
+        if key not in self.queries:
+            self.queries[key] = {
+                "calls": 0,
+                "attempts": 0,
+                "errors": 0,
+                "seconds": 0.0,
+                "maxSeconds": 0.0,
+                "buckets": [0] * len(BUCKETS),
+                "availableAfterMs": 0,
+                "consumedAfterMs": 0,
+                "records": 0,
+                "profiled": 0,
+                "dbHits": 0,
+            }
+        return self.queries[key]
+
+    def record_call(self, name: str, access: str, seconds: float, failed: bool):
+        with self.lock:
+            entry = self.entry(name, access)
+            entry["calls"] += 1
+            entry["errors"] += failed
+            entry["seconds"] += seconds
+            entry["maxSeconds"] = max(entry["maxSeconds"], seconds)
+            for n, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][n] += 1
+            due = self.directory and time.monotonic() - self.saved_at >= self.interval
+
+        if due:
+            self.save()
+
+    def record_attempt(self, name: str, access: str, attempt: "TransactionRecorder"):
+        with self.lock:
+            entry = self.entry(name, access)
+            entry["attempts"] += 1
+            entry["availableAfterMs"] += attempt.available_after
+            entry["consumedAfterMs"] += attempt.consumed_after
+            entry["records"] += attempt.records
+            if attempt.profiled:
+                entry["profiled"] += 1
+                entry["dbHits"] += attempt.db_hits
+
+    def snapshot(self) -> dict[tuple[str, str], dict]:
+        """A copy of this worker's totals"""
+
+        with self.lock:
+            return {
+                key: {**entry, "buckets": list(entry["buckets"])}
+                for key, entry in self.queries.items()
+            }
+
+    def totals(self) -> dict[tuple[str, str], dict]:
+        """The totals of every worker sharing the directory, or of this one"""
+
+        if not self.directory:
+            return self.snapshot()
+
+        self.save()
+        totals = {}
+        with locked(self.directory, fcntl.LOCK_SH):
+            for name in os.listdir(self.directory):
+                if TOTALS_FILE.match(name):
+                    add_totals(totals, read_totals(os.path.join(self.directory, name)))
+        return totals
+
+    def save(self) -> None:
+        """Save this worker's totals for the others to add up"""
+
+        self.saved_at = time.monotonic()
+        write_totals(
+            os.path.join(self.directory, f"queries-{os.getpid()}.json"),
+            self.snapshot(),
+        )
+
+    def retire(self) -> None:
+        """Fold this worker's totals into those of exited workers, as it exits"""
+
+        if not self.directory:
+            return
+
+        retired = os.path.join(self.directory, "queries-retired.json")
+        with locked(self.directory, fcntl.LOCK_EX):
+            totals = read_totals(retired) if os.path.exists(retired) else {}
+            add_totals(totals, self.snapshot())
+            write_totals(retired, totals)
+            try:
+                os.remove(os.path.join(self.directory, f"queries-{os.getpid()}.json"))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """Totals and means per query, slowest total wall time first"""
+
+        queries = [
+            {"query": name, "access": access, **entry}
+            for (name, access), entry in self.totals().items()
+        ]
+
+        for query in queries:
+            calls, attempts = query["calls"], query["attempts"]
+            del query["buckets"]
+            query["meanMs"] = 1000 * query["seconds"] / calls if calls else 0.0
+            query["meanRecords"] = query["records"] / attempts if attempts else 0.0
+            query["meanDbHits"] = (
+                query["dbHits"] / query["profiled"] if query["profiled"] else None
+            )
+
+        queries.sort(key=lambda query: query["seconds"], reverse=True)
+        return {"queries": queries}
+
+    def prometheus(self) -> str:
+        """The totals in the Prometheus text exposition format"""
+
+        queries = self.totals()
+
+        lines = []
+
+        def family(name: str, kind: str, help: str, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, sample_labels, value in samples:
+                text = ",".join(f'{k}="{v}"' for k, v in sample_labels.items())
+                lines.append(f"{name}{suffix}{{{text}}} {value}")
+
+        def labels(name, access, **extra):
+            return {"query": name, "access": access, **extra}
+
+        def counter(name: str, help: str, key: str, scale=1):
+            family(
+                name,
+                "counter",
+                help,
+                [
+                    ("", labels(*query), entry[key] * scale)
+                    for query, entry in queries.items()
+                ],
+            )
+
+        histogram = []
+        for (name, access), entry in queries.items():
+            for bound, count in zip(BUCKETS, entry["buckets"]):
+                histogram.append(("_bucket", labels(name, access, le=bound), count))
+            histogram.append(
+                ("_bucket", labels(name, access, le="+Inf"), entry["calls"])
+            )
+            histogram.append(("_sum", labels(name, access), entry["seconds"]))
+            histogram.append(("_count", labels(name, access), entry["calls"]))
+        family(
+            "agnosis_query_seconds",
+            "histogram",
+            "Wall time of each transaction, retries included",
+            histogram,
+        )
+        counter("agnosis_query_attempts_total", "Transaction attempts", "attempts")
+        counter(
+            "agnosis_query_errors_total",
+            "Transactions that failed after any retries",
+            "errors",
+        )
+        counter(
+            "agnosis_query_server_available_seconds_total",
+            "Server time until the first record was available",
+            "availableAfterMs",
+            0.001,
+        )
+        counter(
+            "agnosis_query_server_consumed_seconds_total",
+            "Server time to stream every record",
+            "consumedAfterMs",
+            0.001,
+        )
+        counter("agnosis_query_records_total", "Records returned", "records")
+        counter(
+            "agnosis_query_profiled_total", "Transaction attempts profiled", "profiled"
+        )
+        counter(
+            "agnosis_query_db_hits_total",
+            "Database hits of the profiled attempts",
+            "dbHits",
+        )
+
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedDriver:
+    """A driver whose sessions record every transaction function they run"""
+
+    def __init__(self, driver, metrics: QueryMetrics):
+        self.driver = driver
+        self.metrics = metrics
+
+    def session(self, **config):
+        return InstrumentedSession(self.driver.session(**config), self.metrics)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.driver.close()
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+class InstrumentedSession:
+    """A session that times execute_read and execute_write per transaction function"""
+
+    def __init__(self, session, metrics: QueryMetrics):
+        self.session = session
+        self.metrics = metrics
+
+    def execute_read(self, transaction_function, *args, **kwargs):
+        return self.execute(
+            self.session.execute_read, "read", transaction_function, args, kwargs
+        )
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        return self.execute(
+            self.session.execute_write, "write", transaction_function, args, kwargs
+        )
+
+    def execute(self, execute, access: str, transaction_function, args, kwargs):
+        attempts = []
+
+        def recorded(tx, *args, **kwargs):
+            attempt = TransactionRecorder(
+                tx, random.random() < self.metrics.profile_rate
+            )
+            attempts.append(attempt)
+            value = transaction_function(attempt, *args, **kwargs)
+            # Results are gone once the transaction closes, so read their
+            # summaries now
+            attempt.summarize()
+            self.metrics.record_attempt(attempt.name(), access, attempt)
+            return value
+
+        started = time.perf_counter()
+        try:
+            value = execute(recorded, *args, **kwargs)
+        except Exception:
+            self.metrics.record_call(
+                call_name(attempts), access, time.perf_counter() - started, True
+            )
+            raise
+        self.metrics.record_call(
+            call_name(attempts), access, time.perf_counter() - started, False
+        )
+        return value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.session.close()
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class AsyncInstrumentedDriver(InstrumentedDriver):
+    """An async driver whose sessions record every transaction function they run"""
+
+    def session(self, **config):
+        return AsyncInstrumentedSession(self.driver.session(**config), self.metrics)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.driver.close()
+
+
+class AsyncInstrumentedSession(InstrumentedSession):
+    """
+    An async session that times execute_read and execute_write per transaction
+    function. Its names start with aio., apart from the sync transactions'.
+    """
+
+    async def execute_read(self, transaction_function, *args, **kwargs):
+        return await self.execute(
+            self.session.execute_read, "read", transaction_function, args, kwargs
+        )
+
+    async def execute_write(self, transaction_function, *args, **kwargs):
+        return await self.execute(
+            self.session.execute_write, "write", transaction_function, args, kwargs
+        )
+
+    async def execute(self, execute, access: str, transaction_function, args, kwargs):
+        attempts = []
+
+        async def recorded(tx, *args, **kwargs):
+            attempt = AsyncTransactionRecorder(
+                tx, random.random() < self.metrics.profile_rate
+            )
+            attempts.append(attempt)
+            value = await transaction_function(attempt, *args, **kwargs)
+            await attempt.summarize()
+            self.metrics.record_attempt("aio." + attempt.name(), access, attempt)
+            return value
+
+        started = time.perf_counter()
+        try:
+            value = await execute(recorded, *args, **kwargs)
+        except Exception:
+            self.metrics.record_call(
+                "aio." + call_name(attempts),
+                access,
+                time.perf_counter() - started,
+                True,
+            )
+            raise
+        self.metrics.record_call(
+            "aio." + call_name(attempts), access, time.perf_counter() - started, False
+        )
+        return value
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+
+class TransactionRecorder:
+    """A managed transaction that keeps the results of its queries"""
+
+    def __init__(self, tx, profile: bool):
+        self.tx = tx
+        self.profile = profile
+        self.profiled = False
+        self.names: list[str] = []
+        self.results: list[CountedResult] = []
+        self.available_after = 0
+        self.consumed_after = 0
+        self.records = 0
+        self.db_hits = 0
+
+    def run(self, query, parameters=None, **kwparameters):
+        self.names.append(registered_name(query))
+        if self.profile and isinstance(query, str) and profilable(query):
+            query = "PROFILE " + query
+            self.profiled = True
+        result = CountedResult(self.tx.run(query, parameters, **kwparameters))
+        self.results.append(result)
+        return result
+
+    def name(self) -> str:
+        """The registered names of the queries run, joined in the order first run"""
+        return "+".join(dict.fromkeys(self.names)) or UNREGISTERED
+
+    def summarize(self) -> None:
+        for result in self.results:
+            summary = result.result.consume()
+            self.available_after += summary.result_available_after or 0
+            self.consumed_after += summary.result_consumed_after or 0
+            self.records += result.records
+            if summary.profile:
+                self.db_hits += db_hits(summary.profile)
+
+    def __getattr__(self, name):
+        return getattr(self.tx, name)
+
+
+class AsyncTransactionRecorder(TransactionRecorder):
+    """An async managed transaction that keeps the results of its queries"""
+
+    async def run(self, query, parameters=None, **kwparameters):
+        self.names.append(registered_name(query))
+        if self.profile and isinstance(query, str) and profilable(query):
+            query = "PROFILE " + query
+            self.profiled = True
+        result = AsyncCountedResult(
+            await self.tx.run(query, parameters, **kwparameters)
+        )
+        self.results.append(result)
+        return result
+
+    async def summarize(self) -> None:
+        for result in self.results:
+            summary = await result.result.consume()
+            self.available_after += summary.result_available_after or 0
+            self.consumed_after += summary.result_consumed_after or 0
+            self.records += result.records
+            if summary.profile:
+                self.db_hits += db_hits(summary.profile)
+
+
+class CountedResult:
+    """A result that counts the records read from it"""
+
+    def __init__(self, result):
+        self.result = result
+        self.records = 0
+
+    def __iter__(self):
+        for record in self.result:
+            self.records += 1
+            yield record
+
+    def single(self, strict=False):
+        record = self.result.single(strict)
+        self.records += record is not None
+        return record
+
+    def value(self, key=0, default=None):
+        values = self.result.value(key, default)
+        self.records += len(values)
+        return values
+
+    def values(self, *keys):
+        values = self.result.values(*keys)
+        self.records += len(values)
+        return values
+
+    def data(self, *keys):
+        data = self.result.data(*keys)
+        self.records += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.result, name)
+
+
+class AsyncCountedResult(CountedResult):
+    """An async result that counts the records read from it"""
+
+    async def __aiter__(self):
+        async for record in self.result:
+            self.records += 1
+            yield record
+
+    async def single(self, strict=False):
+        record = await self.result.single(strict)
+        self.records += record is not None
+        return record
+
+    async def value(self, key=0, default=None):
+        values = await self.result.value(key, default)
+        self.records += len(values)
+        return values
+
+    async def values(self, *keys):
+        values = await self.result.values(*keys)
+        self.records += len(values)
+        return values
+
+    async def data(self, *keys):
+        data = await self.result.data(*keys)
+        self.records += len(data)
+        return data
+
+
+def registered_name(query) -> str:
+    """The name a query was registered under in app.queries"""
+    return QUERY_NAMES.get(getattr(query, "text", query), UNREGISTERED)
+
+
+def call_name(attempts: list[TransactionRecorder]) -> str:
+    """Name a transaction after the queries of its last attempt"""
+    return attempts[-1].name() if attempts else UNREGISTERED
+
+
+def clear_totals(directory: str | None) -> None:
+    """Forget the totals saved in a directory, before a server starts its workers"""
+
+    if not directory or not os.path.isdir(directory):
+        return
+
+    for name in os.listdir(directory):
+        if TOTALS_FILE.match(name):
+            os.remove(os.path.join(directory, name))
+
+
+def read_totals(path: str) -> dict[tuple[str, str], dict]:
+    try:
+        with open(path, encoding="utf8") as totals:
+            return {(name, access): entry for name, access, entry in json.load(totals)}
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_totals(path: str, totals: dict[tuple[str, str], dict]) -> None:
+    """Replace a totals file at once, so readers never see half of it"""
+
+    written = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(written, "w", encoding="utf8") as file:
+        json.dump([[*key, entry] for key, entry in totals.items()], file)
+    os.replace(written, path)
+
+
+def add_totals(totals: dict, more: dict) -> None:
+    """Add one set of totals to another"""
+
+    for key, entry in more.items():
+        if key not in totals:
+            totals[key] = {**entry, "buckets": list(entry["buckets"])}
+            continue
+        total = totals[key]
+        for field, value in entry.items():
+            if field == "buckets":
+                total[field] = [a + b for a, b in zip(total[field], value)]
+            elif field == "maxSeconds":
+                total[field] = max(total[field], value)
+            else:
+                total[field] += value
+
+
+@contextmanager
+def locked(directory: str, operation: int):
+    """Hold a lock on a totals directory, shared to read or exclusive to retire"""
+
+    with open(os.path.join(directory, ".lock"), "a") as lock:
+        fcntl.flock(lock, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def profilable(query: str) -> bool:
+    return not SCHEMA_COMMAND.match(query) and not re.match(
+        r"^\s*(?:PROFILE|EXPLAIN)\b", query, re.IGNORECASE
+    )
+
+
+def db_hits(plan: dict) -> int:
+    """Sum the database hits of a profiled plan and all its children"""
+    return plan.get("dbHits", 0) + sum(
+        db_hits(child) for child in plan.get("children", ())
+    )
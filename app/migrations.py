@@ -0,0 +1,144 @@
+"""
+Schema migrations
+Every constraint and index the queries rely on, in numbered migrations.
+Each migration is applied once, in order, and recorded as a Migration node,
+so the database holds the version of its schema. Statements use IF NOT
+EXISTS, so databases built before migrations existed take them as no-ops.
+
+Migration nodes are schema, not data: clearing the database and snapshots
+leave them out.
+"""
+
+from app.types import Migration
+
+MIGRATIONS: list[Migration] = [
+    {
+        "version": 1,
+        "name": "Uniqueness constraints",
+        "statements": (
+            "CREATE CONSTRAINT unique_email IF NOT EXISTS FOR (user:User) REQUIRE user.email IS UNIQUE",
+            "CREATE CONSTRAINT unique_username IF NOT EXISTS FOR (user:User) REQUIRE user.username IS UNIQUE",
+            "CREATE CONSTRAINT unique_source_name IF NOT EXISTS FOR (source:Source) REQUIRE source.name IS UNIQUE",
+            "CREATE CONSTRAINT unique_sequence_name IF NOT EXISTS FOR (s:Sequence) REQUIRE s.name IS UNIQUE",
+            "CREATE CONSTRAINT unique_idea_ordinal IF NOT EXISTS FOR (i:Idea) REQUIRE i.ordinal IS UNIQUE",
+            "CREATE CONSTRAINT unique_user_id IF NOT EXISTS FOR (user:User) REQUIRE user.userId IS UNIQUE",
+            "CREATE CONSTRAINT unique_source_id IF NOT EXISTS FOR (source:Source) REQUIRE source.sourceId IS UNIQUE",
+            "CREATE CONSTRAINT unique_idea_id IF NOT EXISTS FOR (i:Idea) REQUIRE i.ideaId IS UNIQUE",
+        ),
+    },
+    {
+        "version": 2,
+        "name": "Search, sampling and listing indexes",
+        "statements": (
+            "CREATE FULLTEXT INDEX urlsAndDescriptions IF NOT EXISTS FOR (i:Idea) ON EACH [i.url, i.description]",
+            "CREATE RANGE INDEX reaction_event_seq IF NOT EXISTS FOR (e:ReactionEvent) ON (e.seq)",
+            "CREATE RANGE INDEX idea_random_key IF NOT EXISTS FOR (i:Idea) ON (i.randomKey)",
+            "CREATE RANGE INDEX idea_like_count IF NOT EXISTS FOR (i:Idea) ON (i.likeCount)",
+            "CREATE RANGE INDEX idea_trending IF NOT EXISTS FOR (i:Idea) ON (i.trending)",
+            "CREATE RANGE INDEX idea_created_at IF NOT EXISTS FOR (i:Idea) ON (i.createdAt)",
+        ),
+    },
+    {
+        "version": 3,
+        "name": "Idea url and event age indexes",
+        "statements": (
+            # add_idea merges ideas on their url
+            "CREATE RANGE INDEX idea_url IF NOT EXISTS FOR (i:Idea) ON (i.url)",
+            # prune_events deletes events by age
+            "CREATE RANGE INDEX reaction_event_at IF NOT EXISTS FOR (e:ReactionEvent) ON (e.at)",
+        ),
+    },
+]
+
+LATEST_VERSION = MIGRATIONS[-1]["version"]
+
+
+##############################################################################
+# Transaction functions
+#
+
+
+def applied_version(tx) -> int:
+    """Transaction function for getting the version of the newest migration applied"""
+    return tx.run(
+        """
+        OPTIONAL MATCH (m:Migration)
+        RETURN coalesce(max(m.version), 0) AS version
+        """
+    ).single()["version"]
+
+
+def apply_statements(tx, statements: tuple[str, ...]) -> None:
+    """Transaction function for running a migration's schema statements"""
+    for statement in statements:
+        tx.run(statement)
+
+
+def record_migration(tx, migration: Migration) -> None:
+    """Transaction function for recording that a migration was applied"""
+    tx.run(
+        """
+        MERGE (m:Migration {version: $version})
+        SET m.name = $name, m.appliedAt = datetime()
+        """,
+        version=migration["version"],
+        name=migration["name"],
+    )
+
+
+def await_indexes(tx, timeout: int) -> None:
+    """Transaction function for waiting until every index is online"""
+    tx.run("CALL db.awaitIndexes($timeout)", timeout=timeout).consume()
+
+
+def index_states(tx) -> list[dict]:
+    """Transaction function for listing every index and how far it is built"""
+    return tx.run(
+        """
+        SHOW INDEXES
+        YIELD name, type, labelsOrTypes, properties, state, populationPercent
+        RETURN name, type, labelsOrTypes, properties, state, populationPercent
+        ORDER BY name
+        """
+    ).data()
+
+
+##############################################################################
+# Main functions
+#
+
+
+def migrate(driver, await_seconds=300) -> list[Migration]:
+    """
+    Apply every migration newer than the database's version, then wait up
+    to await_seconds for the indexes to come online. Returns the migrations
+    applied.
+    """
+
+    applied = []
+
+    with driver.session() as session:
+        version = session.execute_read(applied_version)
+
+        for migration in MIGRATIONS:
+            if migration["version"] <= version:
+                continue
+            # Schema and data changes cannot share a transaction
+            session.execute_write(apply_statements, migration["statements"])
+            session.execute_write(record_migration, migration)
+            applied.append(migration)
+
+        session.execute_read(await_indexes, await_seconds)
+
+    return applied
+
+
+def schema_status(driver) -> dict:
+    """The database's schema version, the newest this code knows, and its indexes"""
+
+    with driver.session() as session:
+        return {
+            "version": session.execute_read(applied_version),
+            "latest": LATEST_VERSION,
+            "indexes": session.execute_read(index_states),
+        }
@@ -0,0 +1,109 @@
+"""
+Reaction event model
+An append-only feed of (:ReactionEvent) nodes, numbered by a single sequence,
+that lets in-process caches in every worker follow writes made by the others.
+Each event states what a user's relationship to an idea is now, so replaying
+an event more than once is harmless.
+"""
+
+from datetime import timedelta
+
+from flask import current_app
+
+from app.queries import register
+from app.types import ReactionEvent
+
+
+RECORD_EVENTS = register(
+    "event.record",
+    """
+    MERGE (s:Sequence {name: "reactionEvents"})
+    SET s.value = coalesce(s.value, 0) + size($events)
+    WITH s.value - size($events) AS base
+    UNWIND range(0, size($events) - 1) AS n
+    WITH base + n + 1 AS seq, $events[n] AS e
+    CREATE (:ReactionEvent {
+        seq: seq,
+        userId: e.userId,
+        ideaId: e.ideaId,
+        type: e.type,
+        agreement: e.agreement,
+        at: datetime()
+    })
+    """,
+    {"events": [{"userId": "", "ideaId": "", "type": "", "agreement": 0}]},
+    write=True,
+)
+
+
+##############################################################################
+# Transaction functions
+#
+
+
+def record_events(tx, events: list[ReactionEvent]) -> None:
+    """Transaction function for appending events to the feed"""
+
+    if not events or not events_enabled():
+        return
+
+    tx.run(RECORD_EVENTS, events=events)
+
+
+def events_since(tx, seq: int, limit: int) -> list[ReactionEvent]:
+    """Transaction function for reading the feed after a sequence number"""
+    result = tx.run(
+        """
+        MATCH (e:ReactionEvent)
+        WHERE e.seq > $seq
+        RETURN e {.seq, .userId, .ideaId, .type, .agreement} AS event
+        ORDER BY e.seq
+        LIMIT $limit
+        """,
+        seq=seq,
+        limit=limit,
+    )
+    return [row["event"] for row in result]
+
+
+def latest_event_seq(tx) -> int:
+    """Transaction function for getting the sequence number of the latest event"""
+    result = tx.run(
+        """
+        MATCH (s:Sequence {name: "reactionEvents"})
+        RETURN s.value AS value
+        """
+    ).single()
+    return result["value"] if result else 0
+
+
+##############################################################################
+# Main functions
+#
+
+
+def prune_events(driver, max_age: timedelta) -> int:
+    """Delete events older than max_age. Returns the number deleted."""
+
+    with driver.session() as session:
+        return session.execute_write(
+            lambda tx: tx.run(
+                """
+                MATCH (e:ReactionEvent)
+                WHERE e.at < datetime() - duration({seconds: $max_age})
+                DELETE e
+                RETURN count(*) AS deleted
+                """,
+                max_age=int(max_age.total_seconds()),
+            ).single()["deleted"]
+        )
+
+
+##############################################################################
+# Helper functions
+#
+
+
+def events_enabled() -> bool:
+    """Events are only worth writing when an in-process engine reads them"""
+    return current_app.config.get("RECOMMENDER_BACKEND") == "numpy"
@@ -1,40 +1,672 @@
 """Idea model"""
 
-from datetime import datetime
+import random
+import re
+from typing import Iterator
 from flask import current_app
-from neo4j.exceptions import ConstraintError
 
+from app.models.event import record_events
+from app.models.reaction import (
+    previous_reactions,
+    record_reactions,
+    reaction_change,
+    reaction_histogram,
+    remove_idea_reactions,
+    trending_decay,
+    with_pending_reaction,
+)
+from app.cursors import encode_cursor, decode_cursor
+from app.queries import register
+from app.seen import bump_seen, get_seen, update_seen
 from app.types import (
     IdeaData,
     Idea,
     IdeaWithAllReactions,
     IdeaWithAnonReactions,
+    IdeaWithHistogram,
     IdeaWithScore,
+    RankedIdea,
+    ReactionRequest,
+    ReactionResult,
+)
+
+
+RANDOM_IDEA = register(
+    "idea.random",
+    """
+    MATCH (i:Idea)
+    WHERE i.randomKey >= $start
+    RETURN i {
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt)
+    }
+    ORDER BY i.randomKey
+    LIMIT 1
+    """,
+    {"start": 0.5},
+)
+
+RANDOM_SAMPLE = register(
+    "idea.random_sample",
+    """
+    MATCH (i:Idea)
+    WHERE i.randomKey >= $start
+    RETURN i.ordinal AS ordinal, i {
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt),
+        popularity: null,
+        score: null
+    } AS idea
+    ORDER BY i.randomKey
+    LIMIT $batch_size
+    """,
+    {"start": 0.5, "batch_size": 20},
+)
+
+# The fallback for users who have seen nearly everything, so it scans
+UNSEEN_SCAN = register(
+    "idea.unseen_scan",
+    """
+    MATCH (i:Idea)
+    WHERE NOT i.ordinal IN $seen AND NOT i.ideaId IN $exclude
+    RETURN i {
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt),
+        popularity: null,
+        score: null
+    } AS idea
+    ORDER BY rand()
+    LIMIT 1
+    """,
+    {"seen": [0], "exclude": [""]},
+    allow=["NodeByLabelScan"],
+)
+
+# Liked ideas in descending order of a counter, a batch at a time. Each batch
+# after the first seeks past the last idea of the one before, by its counter
+# and then its ordinal, rather than skipping every idea already read.
+ORDERED_BY = """
+    MATCH (i:Idea)
+    WHERE i.{key} > 0{seek}
+    RETURN i.{key} AS key, i.ordinal AS ordinal, i {{
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt),
+        popularity: i.likeCount,
+        score: null
+    }} AS idea
+    ORDER BY i.{key} DESC, i.ordinal DESC
+    LIMIT $batch_size
+"""
+
+ORDERED_SEEK = """
+        AND i.{key} <= $key
+        AND (i.{key} < $key OR i.ordinal < $ordinal)"""
+
+ORDERED = {
+    key: (
+        register(
+            f"idea.ordered.{key}",
+            ORDERED_BY.format(key=key, seek=""),
+            {"batch_size": 20},
+        ),
+        register(
+            f"idea.ordered.{key}.after",
+            ORDERED_BY.format(key=key, seek=ORDERED_SEEK.format(key=key)),
+            {"batch_size": 20, "key": sample, "ordinal": 0},
+        ),
+    )
+    for key, sample in (("likeCount", 0), ("trending", 0.0))
+}
+
+LISTING = """
+    MATCH (i:Idea)
+    WHERE i.{key} IS NOT NULL{seek}
+    RETURN i {{
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt)
+    }} AS idea
+    ORDER BY i.{key} {order}, i.ideaId {order}
+    LIMIT $limit
+"""
+
+LISTING_SEEK = """
+        AND i.{key} {op}= {param}
+        AND (i.{key} {op} {param} OR i.ideaId {op} $id)"""
+
+# The createdAt of a listing cursor, as Neo4j writes datetimes
+DATETIME = re.compile(
+    r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:\d{2})$"
+)
+
+# Each listing order maps to a fixed pair of queries, for its first page and
+# for the pages after a cursor, so that no Cypher is built per request
+LISTINGS = {
+    (key, order): (
+        register(
+            f"idea.listing.{key}.{order}",
+            LISTING.format(key=key, order=order.upper(), seek=""),
+            {"limit": 20},
+        ),
+        register(
+            f"idea.listing.{key}.{order}.after",
+            LISTING.format(
+                key=key,
+                order=order.upper(),
+                seek=LISTING_SEEK.format(key=key, op=op, param=param),
+            ),
+            {"limit": 20, "key": sample, "id": ""},
+        ),
+    )
+    for key, param, sample in (
+        ("createdAt", "datetime($key)", "2022-01-01T00:00:00Z"),
+        ("likeCount", "$key", 0),
+        ("trending", "$key", 0.0),
+    )
+    for order, op in (("desc", "<"), ("asc", ">"))
+}
+
+CREATE_IDEA_WITH_SOURCE = register(
+    "idea.create_with_source",
+    """
+    MATCH (u:User {userId: $user_id})
+    MATCH (s:Source {sourceId: $source_id})
+    MERGE (seq:Sequence {name: "ideaOrdinal"})
+    SET seq.value = coalesce(seq.value, 0) + 1
+    WITH u, s, seq.value AS ordinal
+    MERGE (u)-[:POSTED]->(i:Idea {url: $url, description: $description})<-[f:AUTHORED]-(s)
+    ON CREATE SET i.createdAt = datetime(), i.ideaId = randomUuid(), i.randomKey = rand(),
+        i.ordinal = ordinal, i.likeCount = 0, i.dislikeCount = 0, i.agreementSum = 0,
+        i.agreementCounts = [0, 0, 0, 0, 0, 0, 0],
+        i.trending = datetime().epochMillis / 1000.0 * $decay
+    RETURN i {
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt)
+    } AS idea
+    """,
+    {"url": "", "user_id": "", "source_id": "", "description": "", "decay": 0.0},
+    write=True,
+)
+
+CREATE_IDEA = register(
+    "idea.create",
+    """
+    MATCH (u:User {userId: $user_id})
+    MERGE (seq:Sequence {name: "ideaOrdinal"})
+    SET seq.value = coalesce(seq.value, 0) + 1
+    WITH u, seq.value AS ordinal
+    MERGE (u)-[:POSTED]->(i:Idea {url: $url, description: $description})
+    ON CREATE SET i.createdAt = datetime(), i.ideaId = randomUuid(), i.randomKey = rand(),
+        i.ordinal = ordinal, i.likeCount = 0, i.dislikeCount = 0, i.agreementSum = 0,
+        i.agreementCounts = [0, 0, 0, 0, 0, 0, 0],
+        i.trending = datetime().epochMillis / 1000.0 * $decay
+    RETURN i {
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt)
+    } AS idea
+    """,
+    {"url": "", "user_id": "", "description": "", "decay": 0.0},
+    write=True,
+)
+
+IDEAS_BY_ID = register(
+    "idea.by_id",
+    """
+    UNWIND $idea_ids AS idea_id
+    MATCH (i:Idea {ideaId: idea_id})
+    RETURN idea_id, i.ordinal AS ordinal, i {
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt)
+    } AS idea
+    """,
+    {"idea_ids": [""]},
 )
 
+# Scores unseen ideas liked by similar users. The polarities differ only in
+# which end of the scores they take.
+SIMILAR_SCORES = """
+    MATCH (:User {{userId: $user_id}})-[s:SIMILAR]->(u2:User)
+    MATCH (u2)-[l:LIKES]->(i:Idea)
+    WHERE NOT i.ordinal IN $seen
+    WITH i, SUM(s.pearson * l.agreement) AS score, COUNT(u2) AS popularity
+    RETURN i {{
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt),
+        score: score,
+        popularity: popularity
+        }}
+    ORDER BY score{order} LIMIT 1
+"""
+
+DISAGREEABLE_IDEA = register(
+    "idea.disagreeable",
+    SIMILAR_SCORES.format(order=""),
+    {"user_id": "", "seen": [0]},
+)
+
+AGREEABLE_IDEA = register(
+    "idea.agreeable",
+    SIMILAR_SCORES.format(order=" DESC"),
+    {"user_id": "", "seen": [0]},
+)
+
+IDEA_RANKINGS = register(
+    "idea.rankings",
+    """
+    MATCH (:User {userId: $user_id})-[s:SIMILAR]->(u2:User)
+    MATCH (u2)-[l:LIKES]->(i:Idea)
+    WHERE NOT i.ordinal IN $seen
+    WITH i, SUM(s.pearson * l.agreement) AS score, COUNT(u2) AS popularity
+    ORDER BY score DESC
+    WITH collect({ordinal: i.ordinal, idea: i {
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt),
+        score: score,
+        popularity: popularity
+        }}) AS ranked
+    RETURN ranked[..$depth] AS agreeable,
+        reverse(ranked)[..$depth] AS disagreeable
+    """,
+    {"user_id": "", "depth": 100, "seen": [0]},
+)
+
+SEARCH_IDEAS = register(
+    "idea.search",
+    """
+    CALL db.index.fulltext.queryNodes("urlsAndDescriptions", $search_str) YIELD node, score
+    RETURN node.ideaId AS id, node.url AS url, node.description AS description, score
+    """,
+    {"search_str": "idea"},
+)
+
+LIKE_IDEA = register(
+    "idea.like",
+    """
+    MATCH (u:User {userId: $user_id})
+    MATCH (i:Idea {ideaId: $idea_id})
+    OPTIONAL MATCH (u)-[d:DISLIKES]->(i)
+    DELETE d
+    MERGE (u)-[l:LIKES]->(i)
+    SET l.agreement=$agreement, u.reactedAt=datetime()
+    RETURN i.ideaId AS id, type(l) AS type, l.agreement AS agreement
+    """,
+    {"user_id": "", "idea_id": "", "agreement": 0},
+    write=True,
+)
+
+DISLIKE_IDEA = register(
+    "idea.dislike",
+    """
+    MATCH (u:User {userId: $user_id})
+    MATCH (i:Idea {ideaId: $idea_id})
+    OPTIONAL MATCH (u)-[l:LIKES]->(i)
+    DELETE l
+    MERGE (u)-[d:DISLIKES]->(i)
+    SET u.reactedAt=datetime()
+    RETURN i.ideaId as id, d
+    """,
+    {"user_id": "", "idea_id": ""},
+    write=True,
+)
+
+LIKE_IDEAS = register(
+    "idea.like_many",
+    """
+    MATCH (u:User {userId: $user_id})
+    UNWIND $likes AS r
+    MATCH (i:Idea {ideaId: r.ideaId})
+    OPTIONAL MATCH (u)-[d:DISLIKES]->(i)
+    DELETE d
+    MERGE (u)-[l:LIKES]->(i)
+    SET l.agreement = r.agreement
+    RETURN i.ideaId AS id
+    """,
+    {"user_id": "", "likes": [{"ideaId": "", "agreement": 0}]},
+    write=True,
+)
+
+DISLIKE_IDEAS = register(
+    "idea.dislike_many",
+    """
+    MATCH (u:User {userId: $user_id})
+    UNWIND $dislikes AS r
+    MATCH (i:Idea {ideaId: r.ideaId})
+    OPTIONAL MATCH (u)-[l:LIKES]->(i)
+    DELETE l
+    MERGE (u)-[:DISLIKES]->(i)
+    RETURN i.ideaId AS id
+    """,
+    {"user_id": "", "dislikes": [{"ideaId": ""}]},
+    write=True,
+)
+
+MARK_REACTED = register(
+    "idea.mark_reacted",
+    "MATCH (u:User {userId: $user_id}) SET u.reactedAt = datetime()",
+    {"user_id": ""},
+    write=True,
+)
+
+DELETE_IDEA = register(
+    "idea.delete",
+    """
+    MATCH (i:Idea {ideaId: $idea_id})
+    WITH i, i.ideaId AS id
+    DETACH DELETE i
+    RETURN id
+    """,
+    {"idea_id": ""},
+    write=True,
+)
+
+POSTED_IDEA = register(
+    "idea.posted_by",
+    """
+    MATCH (u:User {userId: $user_id})-[:POSTED]->(i:Idea {ideaId: $idea_id})
+    RETURN i.ideaId AS id
+    """,
+    {"idea_id": "", "user_id": ""},
+)
+
+LIKED_IDEAS = register(
+    "idea.liked",
+    """
+    MATCH (u:User {userId: $user_id})-[:LIKES]->(i:Idea)
+    RETURN i
+    """,
+    {"user_id": ""},
+)
+
+DISLIKED_IDEAS = register(
+    "idea.disliked",
+    """
+    MATCH (u:User {userId: $user_id})-[:DISLIKES]->(i:Idea)
+    RETURN i
+    """,
+    {"user_id": ""},
+)
+
+# Ideas a user posted or reacted to, newest first, whole or a page at a time
+SEEN = """
+    MATCH (u:User {{userId: $user_id}})-[]->(i:Idea)
+    WHERE $before IS NULL OR i.ordinal < $before
+    WITH DISTINCT i
+    ORDER BY i.ordinal DESC{limit}
+    RETURN i.ordinal AS ordinal, i {{
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt)
+    }} AS idea
+    ORDER BY i.ordinal DESC
+"""
+
+SEEN_IDEAS = {
+    False: register("idea.seen", SEEN.format(limit=""), {"user_id": "", "before": 0}),
+    True: register(
+        "idea.seen.paged",
+        SEEN.format(limit="\n    LIMIT $limit"),
+        {"user_id": "", "before": 0, "limit": 20},
+    ),
+}
+
+# Bumped by every change to an idea's reactions, so responses rendered from
+# the idea can be cached until it changes in any worker
+IDEA_VERSION = register(
+    "idea.version",
+    """
+    MATCH (i:Idea {ideaId: $idea_id})
+    RETURN coalesce(i.reactionVersion, 0) AS version
+    """,
+    {"idea_id": ""},
+)
+
+IDEA_DETAILS = register(
+    "idea.details",
+    """
+    MATCH (i:Idea {ideaId: $idea_id})
+    MATCH (poster:User)-[:POSTED]->(i)
+    RETURN i {
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt),
+        postedBy: poster.userId
+    }
+    """,
+    {"idea_id": ""},
+)
+
+IDEA_DETAILS_WITH_ANON_REACTIONS = register(
+    "idea.details_with_anon_reactions",
+    """
+    MATCH (i:Idea {ideaId: $idea_id})
+    MATCH (poster:User)-[:POSTED]->(i)
+    OPTIONAL MATCH (:User)-[r:LIKES|DISLIKES]->(i)
+    RETURN DISTINCT i {
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt),
+        allReactions: collect(type(r)),
+        allAgreement: collect(r.agreement),
+        postedBy: poster.userId
+    }
+    """,
+    {"idea_id": ""},
+)
+
+IDEA_DETAILS_WITH_ALL_REACTIONS = register(
+    "idea.details_with_all_reactions",
+    """
+    MATCH (u:User {userId: $user_id})-[relationship:LIKES|DISLIKES]->(i:Idea {ideaId: $idea_id})
+    MATCH (poster:User)-[:POSTED]->(i)
+    OPTIONAL MATCH (:User)-[r]->(i:Idea {ideaId: $idea_id})
+    RETURN DISTINCT i {
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .trending,
+        createdAt: toString(i.createdAt),
+        userReaction: type(relationship),
+        userAgreement: relationship.agreement,
+        allReactions: collect(type(r)),
+        allAgreement: collect(r.agreement),
+        postedBy: poster.userId
+    }
+    """,
+    {"idea_id": "", "user_id": ""},
+)
+
+# Ideas a user reacted to, newest first, with their reaction. Their counts
+# come from each idea's counters, agreementCounts to be made into a histogram;
+# every reaction, one by one, only on request.
+REACTED = """
+    {anchor}
+    WHERE $before IS NULL OR i.ordinal < $before
+    WITH i, reaction
+    ORDER BY i.ordinal DESC{limit}{raw}
+    RETURN i.ordinal AS ordinal, i {{
+        .ideaId,
+        .url,
+        .description,
+        .likeCount,
+        .dislikeCount,
+        .agreementSum,
+        .agreementCounts,
+        .trending,
+        createdAt: toString(i.createdAt),
+        userAgreement: reaction.agreement,
+        userReaction: type(reaction){raw_fields}
+    }} AS idea
+    ORDER BY i.ordinal DESC
+"""
+
+REACTED_RAW = """
+    CALL {
+        WITH i
+        OPTIONAL MATCH (:User)-[r:LIKES|DISLIKES]->(i)
+        RETURN collect(type(r)) AS allReactions, collect(r.agreement) AS allAgreement
+    }"""
+
+REACTED_RAW_FIELDS = """,
+        allReactions: allReactions,
+        allAgreement: allAgreement"""
+
+# Each choice of raw reactions and paging maps to a fixed query for the
+# ideas a user has seen and for those they posted
+REACTED_IDEAS = {
+    (kind, raw, paged): register(
+        f"idea.{kind}{'.raw' if raw else ''}{'.paged' if paged else ''}",
+        REACTED.format(
+            anchor=anchor,
+            limit="\n    LIMIT $limit" if paged else "",
+            raw=REACTED_RAW if raw else "",
+            raw_fields=REACTED_RAW_FIELDS if raw else "",
+        ),
+        {"user_id": "", "before": 0, **({"limit": 20} if paged else {})},
+    )
+    for kind, anchor in (
+        (
+            "seen_with_reactions",
+            "MATCH (u:User {userId: $user_id})-[reaction:LIKES|DISLIKES]->(i:Idea)",
+        ),
+        (
+            "posted",
+            """MATCH (u:User {userId: $user_id})-[:POSTED]->(i:Idea)
+    MATCH (u)-[reaction:LIKES|DISLIKES]->(i)""",
+        ),
+    )
+    for raw in (False, True)
+    for paged in (False, True)
+}
+
+# The same, for the ideas a user has buffered reactions to, whether or not
+# they have reacted to them yet
+PENDING_REACTED_IDEAS = {
+    (kind, raw): register(
+        f"idea.pending_{kind}{'.raw' if raw else ''}",
+        REACTED.format(
+            anchor=anchor,
+            limit="",
+            raw=REACTED_RAW if raw else "",
+            raw_fields=REACTED_RAW_FIELDS if raw else "",
+        ),
+        {"user_id": "", "idea_ids": [""], "before": None},
+    )
+    for kind, anchor in (
+        (
+            "seen_with_reactions",
+            """MATCH (i:Idea)
+    WHERE i.ideaId IN $idea_ids
+    OPTIONAL MATCH (:User {userId: $user_id})-[reaction:LIKES|DISLIKES]->(i)
+    WITH i, reaction""",
+        ),
+        (
+            "posted",
+            """MATCH (u:User {userId: $user_id})-[:POSTED]->(i:Idea)
+    WHERE i.ideaId IN $idea_ids
+    OPTIONAL MATCH (u)-[reaction:LIKES|DISLIKES]->(i)
+    WITH i, reaction""",
+        ),
+    )
+    for raw in (False, True)
+}
+
+# Records the driver fetches at a time when streaming a user's ideas
+STREAM_FETCH_SIZE = 200
 
 ##############################################################################
 # Transaction functions
 #
 
 
-def get_ideas(tx, sort, order, limit, skip) -> list[Idea]:
-    """Transaction function for getting ideas"""
-
-    cypher = """
-        MATCH (i:Idea)
-        WHERE exists(i.`{0}`)
-        RETURN i {{
-            .*
-        }} AS idea
-        ORDER BY i.`{0}` {1}
-        SKIP $skip
-        LIMIT $limit
-    """.format(
-        sort, order
-    )
+def get_ideas(tx, sort: str, order: str, limit: int, after: dict | None) -> list[Idea]:
+    """
+    Transaction function for getting a page of ideas in a listing order,
+    starting after the idea at position after, or from the top if it is None
+    """
+
+    first, rest = LISTINGS[(sort, order)]
 
-    result = tx.run(cypher, limit=limit, skip=skip)
+    if after is None:
+        result = tx.run(first, limit=limit)
+    else:
+        result = tx.run(rest, limit=limit, key=after["key"], id=after["id"])
 
     return [row.value("idea") for row in result]
 
@@ -42,166 +674,165 @@ def get_ideas(tx, sort, order, limit, skip) -> list[Idea]:
 def create_idea(tx, data: IdeaData) -> Idea:
     """Transaction function for adding a new idea to the db"""
     if data.get("source_id", None):
-        return tx.run(
-            """
-            MATCH (u:User {userId: $user_id})
-            MATCH (s:Source {sourceId: $source_id})
-            MERGE (u)-[:POSTED]->(i:Idea {url: $url, description: $description})<-[f:AUTHORED]-(s)
-            ON CREATE SET i.createdAt = datetime(), i.ideaId = randomUuid()
-            RETURN i {
-                .*,
-                createdAt: toString(i.createdAt)
-            } AS idea
-            """,
+        result = tx.run(
+            CREATE_IDEA_WITH_SOURCE,
             url=data["url"],
             user_id=data["user_id"],
             source_id=data["source_id"],
             description=data["description"],
+            decay=trending_decay(),
+        ).single()
+    else:
+        result = tx.run(
+            CREATE_IDEA,
+            url=data["url"],
+            user_id=data["user_id"],
+            description=data["description"],
+            decay=trending_decay(),
         ).single()
 
-    result = tx.run(
-        """
-        MATCH (u:User {userId: $user_id})
-        MERGE (u)-[:POSTED]->(i:Idea {url: $url, description: $description})
-        ON CREATE SET i.createdAt = datetime(), i.ideaId = randomUuid()
-        RETURN i {
-            .*,
-            createdAt: toString(i.createdAt)
-        } AS idea
-        """,
-        url=data["url"],
-        user_id=data["user_id"],
-        description=data["description"],
-    ).single()
+    record_events(
+        tx,
+        [
+            {
+                "userId": data["user_id"],
+                "ideaId": result["idea"]["ideaId"],
+                "type": "POSTED",
+                "agreement": None,
+            }
+        ],
+    )
     return result
 
 
+def ideas_by_id(tx, idea_ids: list[str]) -> list[tuple[int, Idea]]:
+    """Transaction function for getting ideas by id with their ordinals, in order"""
+    result = tx.run(IDEAS_BY_ID, idea_ids=idea_ids)
+    ideas = {row["idea_id"]: (row["ordinal"], row["idea"]) for row in result}
+    return [ideas[idea_id] for idea_id in idea_ids if idea_id in ideas]
+
+
 ##############################################################################
 # Main functions
 #
 
 
-def all_ideas(driver, sort, order, limit=6, skip=0) -> list[Idea]:
-    """Get all ideas with optional paging"""
+def all_ideas(
+    driver, sort="createdAt", order="desc", limit=20, cursor: str | None = None
+) -> tuple[list[Idea], str | None]:
+    """
+    Get a page of all ideas, ordered by createdAt, likeCount or trending.
+    Returns the ideas and the cursor of the next page, or None if this is
+    the last page.
+    """
+
+    position = listing_position(sort, order, cursor)
 
     with driver.session() as session:
-        return session.execute_read(get_ideas, sort, order, limit, skip)
+        ideas = session.execute_read(get_ideas, sort, order, limit, position)
+
+    return ideas, listing_cursor(sort, order, limit, ideas)
 
 
 def add_idea(driver, data: IdeaData) -> Idea:
     """Add a new idea to the database"""
 
+    def create(tx, data: IdeaData):
+        idea = create_idea(tx, data)["idea"]
+        return idea, bump_seen(tx, data["user_id"], [idea["ideaId"]])
+
     with driver.session() as session:
-        return session.execute_write(create_idea, data)["idea"]
+        idea, seen = session.execute_write(create, data)
 
+    update_seen(seen)
+    return idea
 
-def random_idea(driver) -> Idea:
-    """Get a completely random idea"""
-    with driver.session() as session:
-        return session.execute_read(
-            lambda tx: tx.run(
-                """
-                MATCH (i:Idea)
-                RETURN i {
-                    .*,
-                    createdAt: toString(i.createdAt)
-                }
-                ORDER BY rand()
-                LIMIT 1
-                """
-            ).single()
-        )["i"]
 
+def find_ideas(driver, idea_ids: list[str]) -> list[Idea]:
+    """Get ideas by id, in the order given, skipping any that do not exist"""
 
-def random_unseen_idea(driver, user_id: str) -> Idea:
-    """Get a random idea not seen by the user"""
     with driver.session() as session:
-        return session.execute_read(
-            lambda tx: tx.run(
-                """
-                MATCH (u:User {userId: $user_id})
-                MATCH (i:Idea)
-                WHERE NOT (u)-[]->(i)
-                RETURN i {
-                    .*,
-                    createdAt: toString(i.createdAt),
-                    popularity: null,
-                    score: null
-                }
-                ORDER BY rand()
-                LIMIT 1
-                """,
-                user_id=user_id,
-            ).single()
-        )
+        return [idea for _, idea in session.execute_read(ideas_by_id, idea_ids)]
 
 
-def popular_unseen_idea(driver, user_id: str) -> Idea:
-    """Get the most liked idea that the user has not yet rated"""
+def random_idea(driver) -> Idea:
+    """
+    Get a completely random idea.
+    Seeks to a random point in the randomKey index rather than sorting every idea.
+    """
+
+    def sample(tx):
+        for start in (random.random(), 0.0):
+            result = tx.run(RANDOM_IDEA, start=start).single()
+            # Nothing after the random point, so wrap around to the start
+            if result is not None:
+                return result
+
     with driver.session() as session:
-        return session.execute_read(
-            lambda tx: tx.run(
-                """
-                MATCH (u1:User {userId: $user_id})
-                MATCH (u2)-[r:LIKES]->(i:Idea)
-                WHERE NOT (u1)-[]->(i)
-                WITH i, toString(i.createdAt) AS createdAt, count(u2) AS popularity
-                RETURN i {
-                    .*,
-                    createdAt: toString(i.createdAt),
-                    popularity: popularity,
-                    score: null
-                }
-                ORDER BY i.popularity DESC LIMIT 1
-                """,
-                user_id=user_id,
-            ).single()
-        )
+        return session.execute_read(sample)["i"]
 
 
-def get_disagreeable_idea(driver, user_id) -> IdeaWithScore:
+def random_unseen_idea(
+    driver, user_id: str, batch_size=20, attempts=3, exclude=()
+) -> Idea | None:
     """
-    Get an idea that the user is most likely to find interesting but wrong.
-    It identifies user similarity using a Pearson similarity function.
-    The query is modified from one found in the official Neo4j documentation.
-    Currently it picks every adjacent user; this could be simplified.
+    Get a random idea not seen by the user, nor in exclude.
+    Reads a batch of ideas from a random point in the randomKey index and
+    filters them against the user's cached seen set, retrying from new points
+    a few times. Falls back to scanning every idea when the user has seen so
+    much that sampling keeps missing.
     """
+
+    def sample(tx, start: float):
+        result = tx.run(RANDOM_SAMPLE, start=start, batch_size=batch_size)
+        return [(row["ordinal"], row["idea"]) for row in result]
+
+    def scan(tx, seen: list[int]):
+        result = tx.run(UNSEEN_SCAN, seen=seen, exclude=list(exclude)).single()
+        return result["idea"] if result else None
+
+    seen = get_seen(driver, user_id)
+
     with driver.session() as session:
-        result = session.execute_read(
-            lambda tx: tx.run(
-                """
-                MATCH (u1:User {userId: $user_id})-[l:LIKES]->(i:Idea)
-                WITH u1, avg(l.agreement) AS u1_mean
+        for _ in range(attempts):
+            for ordinal, idea in session.execute_read(sample, random.random()):
+                if ordinal not in seen and idea["ideaId"] not in exclude:
+                    return idea
 
-                MATCH (u1)-[r1:LIKES]->(i:Idea)<-[r2:LIKES]-(u2)
-                WITH u1, u1_mean, u2, COLLECT({r1: r1, r2: r2}) AS ratings
+        return session.execute_read(scan, list(seen))
 
-                MATCH (u2)-[r:LIKES]->(i:Idea)
-                WITH u1, u1_mean, u2, avg(r.agreement) AS u2_mean, ratings
 
-                UNWIND ratings AS r
+def popular_unseen_idea(
+    driver, user_id: str, batch_size=20, exclude=()
+) -> IdeaWithScore | None:
+    """Get the most liked idea that the user has not yet rated"""
 
-                WITH sum( (r.r1.agreement-u1_mean) * (r.r2.agreement-u2_mean) ) AS nom,
-                    sqrt( sum( (r.r1.agreement - u1_mean)^2) * sum( (r.r2.agreement - u2_mean) ^2)) AS denom,
-                    u1, u2 WHERE denom <> 0
+    return first_unseen(driver, user_id, "likeCount", batch_size, exclude)
 
-                WITH u1, u2, nom/denom AS pearson
-                ORDER BY pearson
 
-                MATCH (u2)-[l:LIKES]->(i:Idea) WHERE NOT EXISTS( (u1)-[]->(i) )
+def trending_unseen_idea(
+    driver, user_id: str, batch_size=20, exclude=()
+) -> IdeaWithScore | None:
+    """Get the idea with the most recent likes that the user has not yet rated"""
 
-                RETURN i {
-                    .*,
-                    createdAt: toString(i.createdAt),
-                    score: SUM( pearson * l.agreement),
-                    popularity: COUNT(u2)
-                    }
-                ORDER BY i.score LIMIT 1
-                """,
-                user_id=user_id,
+    return first_unseen(driver, user_id, "trending", batch_size, exclude)
+
+
+def get_disagreeable_idea(driver, user_id) -> IdeaWithScore:
+    """
+    Get an idea that the user is most likely to find interesting but wrong.
+    User similarity is read from the precomputed SIMILAR edges, which hold the
+    Pearson similarity between the user and their closest neighbours.
+    See app.models.similarity for how those edges are kept up to date.
+    """
+    seen = get_seen(driver, user_id)
+
+    with driver.session() as session:
+        return session.execute_read(
+            lambda tx: tx.run(
+                DISAGREEABLE_IDEA, user_id=user_id, seen=list(seen)
             ).single()
         )
-        return result
 
         # Original query
         # 1. Gets all idea nodes that are connected by three likes, but that are not directly connected to the user.
@@ -229,54 +860,40 @@ def get_agreeable_idea(driver, user_id) -> IdeaWithScore:
     Get an idea that the user is most likely to find interesting and correct.
     Almost identical to get_disagreeable_idea.
     """
+    seen = get_seen(driver, user_id)
+
     with driver.session() as session:
         return session.execute_read(
-            lambda tx: tx.run(
-                """
-                MATCH (u1:User {userId: $user_id})-[l:LIKES]->(i:Idea)
-                WITH u1, avg(l.agreement) AS u1_mean
-
-                MATCH (u1)-[r1:LIKES]->(i:Idea)<-[r2:LIKES]-(u2)
-                WITH u1, u1_mean, u2, COLLECT({r1: r1, r2: r2}) AS ratings
-
-                MATCH (u2)-[r:LIKES]->(i:Idea)
-                WITH u1, u1_mean, u2, avg(r.agreement) AS u2_mean, ratings
-
-                UNWIND ratings AS r
-
-                WITH sum( (r.r1.agreement-u1_mean) * (r.r2.agreement-u2_mean) ) AS nom,
-                    sqrt( sum( (r.r1.agreement - u1_mean)^2) * sum( (r.r2.agreement - u2_mean) ^2)) AS denom,
-                    u1, u2 WHERE denom <> 0
+            lambda tx: tx.run(AGREEABLE_IDEA, user_id=user_id, seen=list(seen)).single()
+        )
 
-                WITH u1, u2, nom/denom AS pearson
-                ORDER BY pearson
 
-                MATCH (u2)-[l:LIKES]->(i:Idea) WHERE NOT EXISTS( (u1)-[]->(i) )
+def get_idea_rankings(driver, user_id, depth=100) -> dict[str, list[RankedIdea]]:
+    """
+    Score every unseen idea liked by a similar user once, and return the
+    depth best ideas for each polarity, each with its ordinal. Agreeable ideas
+    come highest score first, disagreeable ideas lowest score first.
+    """
+    seen = get_seen(driver, user_id)
 
-                RETURN i {
-                    .*,
-                    createdAt: toString(i.createdAt),
-                    score: SUM( pearson * l.agreement),
-                    popularity: COUNT(u2)
-                    }
-                ORDER BY i.score DESC LIMIT 1
-                """,
+    with driver.session() as session:
+        return session.execute_read(
+            lambda tx: tx.run(
+                IDEA_RANKINGS,
                 user_id=user_id,
+                depth=depth,
+                seen=list(seen),
             ).single()
-        )
+        ).data()
 
 
 def search_ideas(driver, search_str: str) -> list[Idea]:
     """Search an idea by url and description"""
 
     def search(tx, search_str: str):
-        result = tx.run(
-            """
-            CALL db.index.fulltext.queryNodes("urlsAndDescriptions", $search_str) YIELD node, score
-            RETURN node.ideaId AS id, node.url AS url, node.description AS description, score
-            """,
-            search_str=search_str,
-        ).values("id", "url", "description")
+        result = tx.run(SEARCH_IDEAS, search_str=search_str).values(
+            "id", "url", "description"
+        )
         return [record for record in result]
 
     with driver.session() as session:
@@ -290,94 +907,157 @@ def like_idea(driver, user_id: str, idea_id: str, agreement: int) -> int:
     """
 
     def like(tx, user_id: str, idea_id: str, agreement: int):
+        previous = previous_reactions(tx, user_id, [idea_id]).get(idea_id)
         result = tx.run(
-            """
-            MATCH (u:User {userId: $user_id})
-            MATCH (i:Idea {ideaId: $idea_id})
-            OPTIONAL MATCH (u)-[d:DISLIKES]->(i)
-            DELETE d
-            MERGE (u)-[l:LIKES]->(i)
-            SET l.agreement=$agreement
-            RETURN i.ideaId AS id, type(l) AS type, l.agreement AS agreement
-            """,
+            LIKE_IDEA,
             user_id=user_id,
             idea_id=idea_id,
             agreement=agreement,
         ).values("id", "type", "agreement")[0]
-        return {"ideaId": result[0], "type": result[1], "agreement": result[2]}
+        seen = record_reactions(
+            tx, user_id, [reaction_change(idea_id, previous, "LIKES", agreement)]
+        )
+        return {"ideaId": result[0], "type": result[1], "agreement": result[2]}, seen
 
     with driver.session() as session:
-        return session.execute_write(like, user_id, idea_id, agreement)
+        reaction, seen = session.execute_write(like, user_id, idea_id, agreement)
+
+    update_seen(seen)
+    current_app.idea_responses.forget(idea_id)
+    return reaction
 
 
 def dislike_idea(driver, user_id: str, idea_id: str):
     """Add a like relationship to an idea. If idea already liked, deletes like relationship"""
 
     def dislike(tx, user_id: str, idea_id: str):
-        result = tx.run(
-            """
-            MATCH (u:User {userId: $user_id})
-            MATCH (i:Idea {ideaId: $idea_id})
-            OPTIONAL MATCH (u)-[l:LIKES]->(i)
-            DELETE l
-            MERGE (u)-[d:DISLIKES]->(i)
-            RETURN i.ideaId as id, d
-            """,
-            user_id=user_id,
-            idea_id=idea_id,
-        ).values("id", "d")[0]
-        return {"ideaId": result[0], "type": result[1].type}
+        previous = previous_reactions(tx, user_id, [idea_id]).get(idea_id)
+        result = tx.run(DISLIKE_IDEA, user_id=user_id, idea_id=idea_id).values(
+            "id", "d"
+        )[0]
+        seen = record_reactions(
+            tx, user_id, [reaction_change(idea_id, previous, "DISLIKES")]
+        )
+        return {"ideaId": result[0], "type": result[1].type}, seen
+
+    with driver.session() as session:
+        reaction, seen = session.execute_write(dislike, user_id, idea_id)
+
+    update_seen(seen)
+    current_app.idea_responses.forget(idea_id)
+    return reaction
+
+
+def react_to_ideas(
+    driver, user_id: str, reactions: list[ReactionRequest]
+) -> list[ReactionResult]:
+    """
+    Apply many reactions from one user in a single transaction, with the same
+    semantics as like_idea and dislike_idea. If an idea appears more than once,
+    its last reaction wins. Returns a result for each requested reaction, in
+    order, with status "saved", "not found", or "superseded" for a reaction
+    to an idea that a later one in the batch replaced.
+    """
+
+    latest = {reaction["ideaId"]: reaction for reaction in reactions}
+    likes = [
+        {"ideaId": reaction["ideaId"], "agreement": reaction["agreement"]}
+        for reaction in latest.values()
+        if reaction["type"] == "LIKES"
+    ]
+    dislikes = [
+        {"ideaId": reaction["ideaId"]}
+        for reaction in latest.values()
+        if reaction["type"] == "DISLIKES"
+    ]
+
+    def react(tx):
+        previous = previous_reactions(tx, user_id, list(latest))
+
+        liked = tx.run(LIKE_IDEAS, user_id=user_id, likes=likes).value("id")
+        disliked = tx.run(DISLIKE_IDEAS, user_id=user_id, dislikes=dislikes).value("id")
+
+        saved = set(liked) | set(disliked)
+        if not saved:
+            return saved, None
+
+        tx.run(MARK_REACTED, user_id=user_id)
+        seen = record_reactions(
+            tx,
+            user_id,
+            [
+                reaction_change(
+                    idea_id,
+                    previous.get(idea_id),
+                    latest[idea_id]["type"],
+                    latest[idea_id].get("agreement"),
+                )
+                for idea_id in latest
+                if idea_id in saved
+            ],
+        )
+        return saved, seen
 
     with driver.session() as session:
-        return session.execute_write(dislike, user_id, idea_id)
+        saved, seen = session.execute_write(react)
+
+    if seen is not None:
+        update_seen(seen)
+    for idea_id in saved:
+        current_app.idea_responses.forget(idea_id)
+
+    last = {reaction["ideaId"]: n for n, reaction in enumerate(reactions)}
+
+    def status(n: int, reaction: ReactionRequest) -> str:
+        if reaction["ideaId"] not in saved:
+            return "not found"
+        if n != last[reaction["ideaId"]]:
+            return "superseded"
+        return "saved"
+
+    return [
+        {
+            "ideaId": reaction["ideaId"],
+            "type": reaction["type"],
+            "agreement": reaction.get("agreement")
+            if reaction["type"] == "LIKES"
+            else None,
+            "status": status(n, reaction),
+        }
+        for n, reaction in enumerate(reactions)
+    ]
 
 
 def delete_idea(driver, idea_id, user_id, admin=False) -> str | None:
     """Delete an idea"""
 
-    def user_delete(tx, idea_id, user_id):
-        result = tx.run(
-            """
-            MATCH (u:User {userId: $user_id})-[:POSTED]->(i:Idea {ideaId: $idea_id})
-            WITH i, i.ideaId AS id
-            DETACH DELETE i
-            RETURN id
-            """,
-            idea_id=idea_id,
-            user_id=user_id,
-        ).single()
-        return result.value("id")
+    def detach_delete(tx, idea_id):
+        remove_idea_reactions(tx, idea_id)
+        result = tx.run(DELETE_IDEA, idea_id=idea_id).single()
+        return result.value("id") if result else None
 
-    def admin_delete(tx, idea_id):
-        result = tx.run(
-            """
-            MATCH (i:Idea {ideaId: $idea_id})
-            WITH i, i.ideaId AS id
-            DETACH DELETE i
-            RETURN id
-            """,
-            idea_id=idea_id,
-        ).single()
-        return result.value("id")
+    def user_delete(tx, idea_id, user_id):
+        result = tx.run(POSTED_IDEA, idea_id=idea_id, user_id=user_id).single()
+        if result is None:
+            return None
+        return detach_delete(tx, idea_id)
 
     with driver.session() as session:
         if admin:
-            return session.execute_write(admin_delete, idea_id)
+            deleted = session.execute_write(detach_delete, idea_id)
         else:
-            return session.execute_write(user_delete, idea_id, user_id)
+            deleted = session.execute_write(user_delete, idea_id, user_id)
+
+    if deleted:
+        current_app.idea_responses.forget(idea_id)
+    return deleted
 
 
 def get_liked_ideas(driver, user_id: str) -> list:
     """Get all ideas that a user liked"""
 
     def user_liked(tx, user_id):
-        result = tx.run(
-            """
-            MATCH (u:User {userId: $user_id})-[:LIKES]->(i:Idea)
-            RETURN i
-            """,
-            user_id=user_id,
-        ).value("i")
+        result = tx.run(LIKED_IDEAS, user_id=user_id).value("i")
         return result
 
     with driver.session() as session:
@@ -388,60 +1068,73 @@ def get_disliked_ideas(driver, user_id: str) -> list:
     """Get all ideas that a user disliked"""
 
     def user_disliked(tx, user_id):
-        result = tx.run(
-            """
-            MATCH (u:User {userId: $user_id})-[:DISLIKES]->(i:Idea)
-            RETURN i
-            """,
-            user_id=user_id,
-        ).value("i")
+        result = tx.run(DISLIKED_IDEAS, user_id=user_id).value("i")
         return result
 
     with driver.session() as session:
         return session.execute_read(user_disliked, user_id)
 
 
-def get_seen_ideas(driver, user_id: str) -> list:
-    """Get all ideas that a user has a direct connection with"""
+def get_seen_ideas(
+    driver, user_id: str, limit=None, cursor=None
+) -> tuple[list[Idea], str | None]:
+    """
+    Get the ideas that a user has a direct connection with, newest first.
+    Pages by limit if given, from cursor.
+    """
 
-    def user_seen(tx, user_id):
-        result = tx.run(
-            """
-            MATCH (u:User {userId: $user_id})-[]->(i:Idea)
-            RETURN i {
-                .*,
-                createdAt: toString(i.createdAt)
-            }
-            """,
-            user_id=user_id,
-        ).value("i")
-        return result
+    query = SEEN_IDEAS[limit is not None]
+
+    def user_seen(tx, before):
+        result = tx.run(query, user_id=user_id, before=before, limit=limit)
+        return [(row["ordinal"], row["idea"]) for row in result]
 
     with driver.session() as session:
-        return session.execute_read(user_seen, user_id)
+        rows = session.execute_read(user_seen, page_start(cursor))
+
+    return [idea for _, idea in rows], page_cursor(rows, limit)
 
 
-def get_all_seen_ideas_with_user_and_aggregate_reactions(driver, user_id: str) -> list:
-    """Get all ideas that a user has a direct connection with, along with reaction data"""
+def stream_seen_ideas(driver, user_id: str) -> Iterator[Idea]:
+    """Yield every idea that a user has a direct connection with, newest first"""
+    return stream_ideas(driver, SEEN_IDEAS[False], user_id=user_id, before=None)
+
+
+def get_all_seen_ideas_with_user_and_aggregate_reactions(
+    driver, user_id: str, limit=None, cursor=None, raw=False
+) -> tuple[list[IdeaWithHistogram], str | None]:
+    """
+    Get the ideas that a user has reacted to, newest first, with their
+    reaction and a histogram of everyone's. Pages by limit if given, from
+    cursor. With raw, also list every reaction and agreement.
+    """
+
+    return reacted_ideas(driver, "seen_with_reactions", user_id, limit, cursor, raw)
+
+
+def stream_seen_ideas_with_reactions(
+    driver, user_id: str, raw=False
+) -> Iterator[IdeaWithHistogram]:
+    """
+    Yield every idea that a user has reacted to, newest first, as for
+    get_all_seen_ideas_with_user_and_aggregate_reactions
+    """
+
+    query = REACTED_IDEAS[("seen_with_reactions", raw, False)]
+    for idea in stream_ideas(driver, query, user_id=user_id, before=None):
+        idea["histogram"] = reaction_histogram(idea)
+        yield idea
+
+
+def idea_version(driver, idea_id: str) -> int | None:
+    """The version of an idea's reactions, or None if there is no such idea"""
+
+    def version(tx, idea_id):
+        result = tx.run(IDEA_VERSION, idea_id=idea_id).single()
+        return result["version"] if result else None
 
     with driver.session() as session:
-        return session.execute_read(
-            lambda tx: tx.run(
-                """
-            MATCH (u:User {userId: $user_id})-[relationship:LIKES|DISLIKES]->(i:Idea)
-            MATCH (:User)-[r:LIKES|DISLIKES]->(i)
-            RETURN DISTINCT i {
-                .*,
-                createdAt: toString(i.createdAt),
-                userAgreement: relationship.agreement,
-                userReaction: type(relationship),
-                allReactions: collect(type(r)),
-                allAgreement: collect(r.agreement)
-            }
-            """,
-                user_id=user_id,
-            ).value("i")
-        )
+        return session.execute_read(version, idea_id)
 
 
 def get_idea_details(
@@ -450,56 +1143,16 @@ def get_idea_details(
     """Get all details of an idea"""
 
     def with_no_reactions(tx, idea_id):
-        result = tx.run(
-            """
-            MATCH (i:Idea {ideaId: $idea_id})
-            MATCH (poster:User)-[:POSTED]->(i)
-            RETURN i {
-                .*,
-                createdAt: toString(i.createdAt),
-                postedBy: poster.userId
-            }
-            """,
-            idea_id=idea_id,
-        ).single()
+        result = tx.run(IDEA_DETAILS, idea_id=idea_id).single()
         return result[0] if result else None
 
     def with_anon_reactions(tx, idea_id):
-        result = tx.run(
-            """
-            MATCH (i:Idea {ideaId: $idea_id})
-            MATCH (poster:User)-[:POSTED]->(i)
-            OPTIONAL MATCH (:User)-[r:LIKES|DISLIKES]->(i)
-            RETURN DISTINCT i {
-                .*,
-                createdAt: toString(i.createdAt),
-                allReactions: collect(type(r)),
-                allAgreement: collect(r.agreement),
-                postedBy: poster.userId
-            }
-            """,
-            idea_id=idea_id,
-        ).single()
+        result = tx.run(IDEA_DETAILS_WITH_ANON_REACTIONS, idea_id=idea_id).single()
         return result[0] if result else None
 
     def with_all_reactions(tx, idea_id, user_id):
         result = tx.run(
-            """
-            MATCH (u:User {userId: $user_id})-[relationship:LIKES|DISLIKES]->(i:Idea {ideaId: $idea_id})
-            MATCH (poster:User)-[:POSTED]->(i)
-            OPTIONAL MATCH (:User)-[r]->(i:Idea {ideaId: $idea_id})
-            RETURN DISTINCT i {
-                .*,
-                createdAt: toString(i.createdAt),
-                userReaction: type(relationship),
-                userAgreement: relationship.agreement,
-                allReactions: collect(type(r)),
-                allAgreement: collect(r.agreement),
-                postedBy: poster.userId
-            }
-            """,
-            idea_id=idea_id,
-            user_id=user_id,
+            IDEA_DETAILS_WITH_ALL_REACTIONS, idea_id=idea_id, user_id=user_id
         ).single()
         return result[0] if result else None
 
@@ -514,25 +1167,189 @@ def get_idea_details(
         return session.execute_read(with_no_reactions, idea_id)
 
 
-def get_posted_ideas(driver, user_id) -> list[IdeaWithAllReactions]:
-    """Get all ideas posted by a user"""
+def get_posted_ideas(
+    driver, user_id, limit=None, cursor=None, raw=False
+) -> tuple[list[IdeaWithHistogram], str | None]:
+    """
+    Get the ideas posted by a user, newest first, paged and with raw
+    reactions as for get_all_seen_ideas_with_user_and_aggregate_reactions
+    """
+
+    return reacted_ideas(driver, "posted", user_id, limit, cursor, raw)
+
+
+def pending_reacted_ideas(
+    driver, kind: str, user_id: str, pending: dict[str, ReactionRequest], raw=False
+) -> list[IdeaWithHistogram]:
+    """
+    Get the ideas, seen or posted, that a user has buffered reactions to,
+    newest first, as reacted_ideas will give them once the reactions are written
+    """
+
+    query = PENDING_REACTED_IDEAS[(kind, raw)]
+
+    def reacted(tx):
+        return tx.run(
+            query, user_id=user_id, idea_ids=list(pending), before=None
+        ).value("idea")
 
     with driver.session() as session:
-        return session.execute_read(
-            lambda tx: tx.run(
-                """
-                MATCH (u:User {userId: $user_id})-[:POSTED]->(i:Idea)
-                MATCH (u)-[reaction:LIKES|DISLIKES]->(i)
-                MATCH (:User)-[r:LIKES|DISLIKES]->(i)
-                RETURN i {
-                    .*,
-                    createdAt: toString(i.createdAt),
-                    userAgreement: reaction.agreement,
-                    userReaction: type(reaction),
-                    allReactions: collect(type(r)),
-                    allAgreement: collect(r.agreement)
-                }
-                """,
-                user_id=user_id,
-            ).value("i")
-        )
+        ideas = session.execute_read(reacted)
+
+    ideas = [with_pending_reaction(idea, pending[idea["ideaId"]]) for idea in ideas]
+    for idea in ideas:
+        idea["histogram"] = reaction_histogram(idea)
+
+    return ideas
+
+
+##############################################################################
+# Helper functions
+#
+
+
+def reacted_ideas(
+    driver, kind: str, user_id: str, limit: int | None, cursor: str | None, raw: bool
+) -> tuple[list[IdeaWithHistogram], str | None]:
+    """
+    Get a page of the ideas a user reacted to, seen or posted, with a
+    histogram of their reactions, and the cursor for the next page
+    """
+
+    query = REACTED_IDEAS[(kind, raw, limit is not None)]
+
+    def reacted(tx, before):
+        result = tx.run(query, user_id=user_id, before=before, limit=limit)
+        return [(row["ordinal"], row["idea"]) for row in result]
+
+    with driver.session() as session:
+        rows = session.execute_read(reacted, page_start(cursor))
+
+    ideas = [idea for _, idea in rows]
+    for idea in ideas:
+        idea["histogram"] = reaction_histogram(idea)
+
+    return ideas, page_cursor(rows, limit)
+
+
+def page_start(cursor: str | None) -> int | None:
+    """
+    The ordinal a page of a user's ideas starts below, or None for the newest.
+    Raises ValueError if the cursor is not one page_cursor made.
+    """
+
+    if not cursor:
+        return None
+
+    before = (decode_cursor(cursor) or {}).get("before")
+    if not isinstance(before, int) or isinstance(before, bool):
+        raise ValueError("Invalid cursor")
+
+    return before
+
+
+def page_cursor(rows: list[tuple[int, Idea]], limit: int | None) -> str | None:
+    """
+    Make the cursor for the page of a user's ideas after rows of ordinals and
+    ideas, or None if last
+    """
+
+    if limit is None or len(rows) < limit:
+        return None
+
+    return encode_cursor({"before": rows[-1][0]})
+
+
+def stream_ideas(driver, query: str, **params) -> Iterator[dict]:
+    """
+    Yield the idea of each record of a read query as the driver fetches it,
+    STREAM_FETCH_SIZE records at a time. The transaction stays open until the
+    last record is read or the generator is closed, and is not retried.
+    """
+
+    with driver.session(fetch_size=STREAM_FETCH_SIZE) as session:
+        with session.begin_transaction() as tx:
+            for record in tx.run(query, **params):
+                yield record["idea"]
+
+
+def listing_position(sort: str, order: str, cursor: str | None) -> dict | None:
+    """
+    Read where a listing cursor points, or None to start from the top when
+    there is no cursor. Raises ValueError if the cursor is not one
+    listing_cursor made for this sort and order.
+    """
+
+    if (sort, order) not in LISTINGS:
+        raise ValueError(f"Cannot list ideas by {sort} {order}")
+
+    if not cursor:
+        return None
+
+    position = decode_cursor(cursor)
+    if position is None:
+        raise ValueError("Invalid cursor")
+    if position.get("sort") != [sort, order]:
+        raise ValueError(f"The cursor is not for ideas sorted by {sort} {order}")
+
+    key = position.get("key")
+    if sort == "createdAt":
+        valid_key = isinstance(key, str) and DATETIME.match(key) is not None
+    else:
+        valid_key = isinstance(key, (int, float)) and not isinstance(key, bool)
+
+    if not valid_key or not isinstance(position.get("id"), str):
+        raise ValueError("Invalid cursor")
+
+    return position
+
+
+def listing_cursor(sort: str, order: str, limit: int, ideas: list[Idea]) -> str | None:
+    """Make the cursor for the listing page after ideas, or None if it was the last"""
+
+    if not ideas or len(ideas) < limit:
+        return None
+
+    last = ideas[-1]
+    return encode_cursor(
+        {"sort": [sort, order], "key": last[sort], "id": last["ideaId"]}
+    )
+
+
+def first_unseen(
+    driver, user_id: str, order: str, batch_size: int, exclude=()
+) -> IdeaWithScore | None:
+    """
+    Get the first idea the user has not seen and is not in exclude, walking
+    ideas in descending order of likeCount or trending, a batch at a time,
+    each batch seeking past the last idea of the one before.
+    """
+
+    if order not in ORDERED:
+        raise ValueError(f"Cannot order ideas by {order}")
+
+    first, rest = ORDERED[order]
+
+    def ordered(tx, after: tuple | None):
+        if after is None:
+            result = tx.run(first, batch_size=batch_size)
+        else:
+            key, ordinal = after
+            result = tx.run(rest, batch_size=batch_size, key=key, ordinal=ordinal)
+        return [(row["key"], row["ordinal"], row["idea"]) for row in result]
+
+    seen = get_seen(driver, user_id)
+    after = None
+
+    with driver.session() as session:
+        while True:
+            batch = session.execute_read(ordered, after)
+
+            for _, ordinal, idea in batch:
+                if ordinal not in seen and idea["ideaId"] not in exclude:
+                    return idea
+
+            if len(batch) < batch_size:
+                return None
+
+            after = batch[-1][:2]
@@ -0,0 +1,502 @@
+"""
+Reaction bookkeeping
+Every write that adds, changes or removes a LIKES or DISLIKES relationship
+also calls into this module, in the same transaction, so that the data derived
+from reactions stays consistent with the relationships themselves.
+"""
+
+import math
+
+from flask import current_app
+
+from app.models.event import record_events
+from app.queries import register
+from app.seen import bump_seen
+from app.types import (
+    Reaction,
+    ReactionChange,
+    ReactionHistogram,
+    ReactionRequest,
+    SeenUpdate,
+)
+
+# The agreement a like can carry, from strong disagreement to strong agreement
+AGREEMENT_SCALE = range(-3, 4)
+
+
+PREVIOUS_REACTIONS = register(
+    "reaction.previous",
+    """
+    UNWIND $idea_ids AS idea_id
+    MATCH (:User {userId: $user_id})-[r:LIKES|DISLIKES]->(i:Idea {ideaId: idea_id})
+    RETURN i.ideaId AS id, type(r) AS type, r.agreement AS agreement
+    """,
+    {"user_id": "", "idea_ids": [""]},
+)
+
+ADD_COUNTS = register(
+    "reaction.add_counts",
+    """
+    UNWIND $counts AS c
+    MATCH (i:Idea {ideaId: c.ideaId})
+    SET i.likeCount = coalesce(i.likeCount, 0) + c.likes,
+        i.dislikeCount = coalesce(i.dislikeCount, 0) + c.dislikes,
+        i.agreementSum = coalesce(i.agreementSum, 0) + c.agreement,
+        i.agreementCounts = [n IN range(0, size(c.histogram) - 1) |
+            coalesce(i.agreementCounts[n], 0) + c.histogram[n]],
+        i.reactionVersion = coalesce(i.reactionVersion, 0) + 1
+    """,
+    {
+        "counts": [
+            {"ideaId": "", "likes": 0, "dislikes": 0, "agreement": 0, "histogram": [0]}
+        ]
+    },
+    write=True,
+)
+
+ADD_TRENDING = register(
+    "reaction.add_trending",
+    """
+    WITH datetime().epochMillis / 1000.0 * $decay AS now
+    UNWIND $liked AS idea_id
+    MATCH (i:Idea {ideaId: idea_id})
+    WITH i, now, coalesce(i.trending, now) AS old
+    WITH i, i.trending IS NULL AS first,
+        CASE WHEN old > now THEN old ELSE now END AS high,
+        CASE WHEN old > now THEN now ELSE old END AS low
+    SET i.trending = CASE WHEN first THEN high ELSE high + log(1 + exp(low - high)) END
+    """,
+    {"liked": [""], "decay": 0.0},
+    write=True,
+)
+
+ADD_RATINGS = register(
+    "reaction.add_ratings",
+    """
+    MATCH (u:User {userId: $user_id})
+    SET u.ratingCount = coalesce(u.ratingCount, 0) + $n,
+        u.ratingSum = coalesce(u.ratingSum, 0) + $sum,
+        u.ratingSqSum = coalesce(u.ratingSqSum, 0) + $sq
+    """,
+    {"user_id": "", "n": 0, "sum": 0, "sq": 0},
+    write=True,
+)
+
+ADD_CORATINGS = register(
+    "reaction.add_coratings",
+    """
+    MATCH (u:User {userId: $user_id})
+    UNWIND $deltas AS d
+    MATCH (v:User)-[l:LIKES]->(:Idea {ideaId: d.ideaId})
+    WHERE v <> u
+    MERGE (u)-[a:CORATES]->(v)
+    MERGE (v)-[b:CORATES]->(u)
+    SET a.n = coalesce(a.n, 0) + d.n,
+        a.sumSelf = coalesce(a.sumSelf, 0) + d.sum,
+        a.sumOther = coalesce(a.sumOther, 0) + l.agreement * d.n,
+        a.sumProduct = coalesce(a.sumProduct, 0) + l.agreement * d.sum,
+        a.sumSelfSq = coalesce(a.sumSelfSq, 0) + d.sq,
+        a.sumOtherSq = coalesce(a.sumOtherSq, 0) + l.agreement * l.agreement * d.n,
+        b.n = coalesce(b.n, 0) + d.n,
+        b.sumSelf = coalesce(b.sumSelf, 0) + l.agreement * d.n,
+        b.sumOther = coalesce(b.sumOther, 0) + d.sum,
+        b.sumProduct = coalesce(b.sumProduct, 0) + l.agreement * d.sum,
+        b.sumSelfSq = coalesce(b.sumSelfSq, 0) + l.agreement * l.agreement * d.n,
+        b.sumOtherSq = coalesce(b.sumOtherSq, 0) + d.sq
+    WITH DISTINCT a, b
+    WHERE a.n = 0
+    DELETE a, b
+    """,
+    {"user_id": "", "deltas": [{"ideaId": "", "n": 0, "sum": 0, "sq": 0}]},
+    write=True,
+)
+
+MARK_NEIGHBOURS = register(
+    "reaction.mark_neighbours",
+    """
+    MATCH (v:User)-[:SIMILAR]->(:User {userId: $user_id})
+    SET v.neighbourReactedAt = datetime()
+    """,
+    {"user_id": ""},
+    write=True,
+)
+
+REMOVE_RATINGS = register(
+    "reaction.remove_ratings",
+    """
+    MATCH (u:User)-[l:LIKES]->(:Idea {ideaId: $idea_id})
+    SET u.ratingCount = u.ratingCount - 1,
+        u.ratingSum = u.ratingSum - l.agreement,
+        u.ratingSqSum = u.ratingSqSum - l.agreement * l.agreement
+    """,
+    {"idea_id": ""},
+    write=True,
+)
+
+REMOVE_CORATINGS = register(
+    "reaction.remove_coratings",
+    """
+    MATCH (u:User)-[lu:LIKES]->(:Idea {ideaId: $idea_id})<-[lv:LIKES]-(v:User)
+    MATCH (u)-[a:CORATES]->(v)
+    SET a.n = a.n - 1,
+        a.sumSelf = a.sumSelf - lu.agreement,
+        a.sumOther = a.sumOther - lv.agreement,
+        a.sumProduct = a.sumProduct - lu.agreement * lv.agreement,
+        a.sumSelfSq = a.sumSelfSq - lu.agreement * lu.agreement,
+        a.sumOtherSq = a.sumOtherSq - lv.agreement * lv.agreement
+    WITH DISTINCT a
+    WHERE a.n = 0
+    DELETE a
+    """,
+    {"idea_id": ""},
+    write=True,
+)
+
+
+##############################################################################
+# Transaction functions
+#
+
+
+def previous_reactions(tx, user_id: str, idea_ids: list[str]) -> dict[str, Reaction]:
+    """Transaction function for getting a user's current reactions to some ideas"""
+    result = tx.run(PREVIOUS_REACTIONS, user_id=user_id, idea_ids=idea_ids)
+    return {
+        row["id"]: {"type": row["type"], "agreement": row["agreement"]}
+        for row in result
+    }
+
+
+def record_reactions(tx, user_id: str, changes: list[ReactionChange]) -> SeenUpdate:
+    """
+    Transaction function for updating derived data after a user's reactions
+    changed. Returns the update to apply to the user's cached seen set once
+    the transaction commits.
+
+    Every change is appended to the reaction event feed, and the ideas are
+    added to the user's seen set.
+
+    Each idea keeps likeCount, dislikeCount and agreementSum over the
+    reactions it has received, agreementCounts with the number of likes at
+    each point of AGREEMENT_SCALE, a reactionVersion that every change to
+    them bumps, and a trending score to which every new like adds one,
+    decaying with a half-life of TRENDING_HALF_LIFE seconds. The score is
+    stored as the log of the like weights measured at the epoch, so
+    it never has to be decayed in place: ordering ideas by it is the same as
+    ordering them by their current decayed score. Removing a like leaves the
+    score to decay.
+
+    Each user keeps ratingCount, ratingSum and ratingSqSum over their LIKES.
+    Each pair of users who both liked an idea keeps a CORATES relationship in
+    both directions, holding n, sumSelf, sumOther, sumProduct, sumSelfSq and
+    sumOtherSq over the ideas they both rated, from the start node's point of
+    view. That is everything needed to compute their Pearson similarity
+    without looking at a single LIKES relationship.
+    """
+
+    record_events(
+        tx,
+        [
+            {
+                "userId": user_id,
+                "ideaId": change["ideaId"],
+                "type": change["type"],
+                "agreement": change["agreement"],
+            }
+            for change in changes
+        ],
+    )
+
+    seen = bump_seen(tx, user_id, [change["ideaId"] for change in changes])
+
+    counts = [count_delta(change) for change in changes]
+    counts = [
+        count
+        for count in counts
+        if count["likes"]
+        or count["dislikes"]
+        or count["agreement"]
+        or any(count["histogram"])
+    ]
+
+    if counts:
+        tx.run(ADD_COUNTS, counts=counts)
+
+    liked = [count["ideaId"] for count in counts if count["likes"] > 0]
+
+    if liked:
+        tx.run(ADD_TRENDING, liked=liked, decay=trending_decay())
+
+    deltas = [rating_delta(change) for change in changes]
+    deltas = [delta for delta in deltas if delta["n"] or delta["sum"] or delta["sq"]]
+
+    if not deltas:
+        return seen
+
+    tx.run(
+        ADD_RATINGS,
+        user_id=user_id,
+        n=sum(delta["n"] for delta in deltas),
+        sum=sum(delta["sum"] for delta in deltas),
+        sq=sum(delta["sq"] for delta in deltas),
+    )
+
+    tx.run(ADD_CORATINGS, user_id=user_id, deltas=deltas)
+
+    # Users who have this user as a neighbour now hold a stale similarity
+    tx.run(MARK_NEIGHBOURS, user_id=user_id)
+
+    return seen
+
+
+def remove_idea_reactions(tx, idea_id: str) -> None:
+    """
+    Transaction function for taking every reaction to an idea out of the
+    derived data. Must run before the idea is deleted.
+    """
+    record_events(
+        tx, [{"userId": None, "ideaId": idea_id, "type": "DELETED", "agreement": None}]
+    )
+
+    tx.run(REMOVE_RATINGS, idea_id=idea_id)
+
+    tx.run(REMOVE_CORATINGS, idea_id=idea_id)
+
+
+def rebuild_user_stats(tx, user_id: str) -> None:
+    """Transaction function for recomputing a user's rating statistics from scratch"""
+    tx.run(
+        """
+        MATCH (u:User {userId: $user_id})
+        OPTIONAL MATCH (u)-[l:LIKES]->(:Idea)
+        WITH u, count(l) AS n, sum(l.agreement) AS total,
+            sum(l.agreement * l.agreement) AS sq
+        SET u.ratingCount = n, u.ratingSum = total, u.ratingSqSum = sq
+        """,
+        user_id=user_id,
+    )
+
+    tx.run(
+        """
+        MATCH (:User {userId: $user_id})-[c:CORATES]->(:User)
+        DELETE c
+        """,
+        user_id=user_id,
+    )
+
+    tx.run(
+        """
+        MATCH (u:User {userId: $user_id})-[a:LIKES]->(:Idea)<-[b:LIKES]-(v:User)
+        WITH u, v, count(*) AS n,
+            sum(a.agreement) AS sumSelf,
+            sum(b.agreement) AS sumOther,
+            sum(a.agreement * b.agreement) AS sumProduct,
+            sum(a.agreement * a.agreement) AS sumSelfSq,
+            sum(b.agreement * b.agreement) AS sumOtherSq
+        CREATE (u)-[:CORATES {
+            n: n,
+            sumSelf: sumSelf,
+            sumOther: sumOther,
+            sumProduct: sumProduct,
+            sumSelfSq: sumSelfSq,
+            sumOtherSq: sumOtherSq
+        }]->(v)
+        """,
+        user_id=user_id,
+    )
+
+
+def rebuild_counters(tx, after: int, batch_size: int) -> int | None:
+    """
+    Transaction function for recomputing the reaction counters of the next
+    batch of ideas by ordinal. Returns the last ordinal done, or None when
+    there are none left.
+    """
+    return tx.run(
+        """
+        MATCH (i:Idea)
+        WHERE i.ordinal > $after
+        WITH i
+        ORDER BY i.ordinal
+        LIMIT $batch_size
+        CALL {
+            WITH i
+            OPTIONAL MATCH (:User)-[l:LIKES]->(i)
+            RETURN count(l) AS likes, coalesce(sum(l.agreement), 0) AS agreement,
+                collect(l.agreement) AS agreements
+        }
+        CALL {
+            WITH i
+            OPTIONAL MATCH (:User)-[d:DISLIKES]->(i)
+            RETURN count(d) AS dislikes
+        }
+        SET i.likeCount = likes, i.dislikeCount = dislikes, i.agreementSum = agreement,
+            i.agreementCounts = [point IN $scale | size([a IN agreements WHERE a = point])],
+            i.reactionVersion = coalesce(i.reactionVersion, 0) + 1
+        RETURN max(i.ordinal) AS last
+        """,
+        after=after,
+        batch_size=batch_size,
+        scale=list(AGREEMENT_SCALE),
+    ).single()["last"]
+
+
+##############################################################################
+# Main functions
+#
+
+
+def rebuild_rating_stats(driver) -> int:
+    """
+    Recompute every user's rating statistics and CORATES relationships from
+    the LIKES relationships. Returns the number of users rebuilt.
+    """
+
+    with driver.session() as session:
+        user_ids = session.execute_read(
+            lambda tx: tx.run("MATCH (u:User) RETURN u.userId AS id").value("id")
+        )
+
+    for user_id in user_ids:
+        with driver.session() as session:
+            session.execute_write(rebuild_user_stats, user_id)
+
+    return len(user_ids)
+
+
+def rebuild_idea_counters(driver, batch_size=1000) -> int:
+    """
+    Recompute every idea's likeCount, dislikeCount, agreementSum and
+    agreementCounts from its LIKES and DISLIKES relationships. Returns the
+    number of batches rebuilt.
+    """
+
+    after, batches = 0, 0
+
+    while True:
+        with driver.session() as session:
+            after = session.execute_write(rebuild_counters, after, batch_size)
+
+        if after is None:
+            return batches
+
+        batches += 1
+
+
+##############################################################################
+# Helper functions
+#
+
+
+def reaction_change(
+    idea_id: str, previous: Reaction | None, type: str, agreement: int | None = None
+) -> ReactionChange:
+    """Describe how a user's reaction to an idea is about to change"""
+    return {
+        "ideaId": idea_id,
+        "previousType": previous["type"] if previous else None,
+        "previousAgreement": previous["agreement"] if previous else None,
+        "type": type,
+        "agreement": agreement if type == "LIKES" else None,
+    }
+
+
+def trending_decay() -> float:
+    """How much an idea's log trending score decays per second"""
+    return math.log(2) / current_app.config.get("TRENDING_HALF_LIFE")
+
+
+def rating_delta(change: ReactionChange) -> dict:
+    """How much a change moves the count, sum and sum of squares of a user's ratings"""
+    old = change["previousAgreement"] if change["previousType"] == "LIKES" else None
+    new = change["agreement"] if change["type"] == "LIKES" else None
+
+    return {
+        "ideaId": change["ideaId"],
+        "n": (new is not None) - (old is not None),
+        "sum": (new or 0) - (old or 0),
+        "sq": (new or 0) ** 2 - (old or 0) ** 2,
+    }
+
+
+def count_delta(change: ReactionChange) -> dict:
+    """How much a change moves an idea's reaction counters"""
+    old = change["previousAgreement"] if change["previousType"] == "LIKES" else 0
+    new = change["agreement"] if change["type"] == "LIKES" else 0
+
+    histogram = [0] * len(AGREEMENT_SCALE)
+    if change["previousType"] == "LIKES" and old in AGREEMENT_SCALE:
+        histogram[AGREEMENT_SCALE.index(old)] -= 1
+    if change["type"] == "LIKES" and new in AGREEMENT_SCALE:
+        histogram[AGREEMENT_SCALE.index(new)] += 1
+
+    return {
+        "ideaId": change["ideaId"],
+        "likes": (change["type"] == "LIKES") - (change["previousType"] == "LIKES"),
+        "dislikes": (change["type"] == "DISLIKES")
+        - (change["previousType"] == "DISLIKES"),
+        "agreement": new - old,
+        "histogram": histogram,
+    }
+
+
+def with_pending_reaction(idea: dict, pending: ReactionRequest) -> dict:
+    """
+    Show an idea as it will be once a user's buffered reaction is written:
+    the reaction in place of any the user already had, in the idea's reactions
+    and counters. The idea holds the user's current reaction, if any, as
+    userReaction and userAgreement.
+    """
+    change = {
+        "ideaId": idea["ideaId"],
+        "previousType": idea.get("userReaction"),
+        "previousAgreement": idea.get("userAgreement"),
+        "type": pending["type"],
+        "agreement": pending["agreement"],
+    }
+
+    delta = count_delta(change)
+    overlaid = {
+        **idea,
+        "userReaction": change["type"],
+        "userAgreement": change["agreement"],
+        "likeCount": (idea.get("likeCount") or 0) + delta["likes"],
+        "dislikeCount": (idea.get("dislikeCount") or 0) + delta["dislikes"],
+        "agreementSum": (idea.get("agreementSum") or 0) + delta["agreement"],
+    }
+
+    # The count of each agreement, only if the idea is to be made a histogram
+    if "agreementCounts" in idea:
+        counts = idea["agreementCounts"] or [0] * len(AGREEMENT_SCALE)
+        overlaid["agreementCounts"] = [
+            n + d for n, d in zip(counts, delta["histogram"])
+        ]
+
+    # Every reaction, one by one, only if the idea lists them
+    if "allReactions" in idea:
+        reactions = list(idea["allReactions"] or [])
+        agreement = list(idea.get("allAgreement") or [])
+        if change["previousType"] in reactions:
+            reactions.remove(change["previousType"])
+        if change["previousAgreement"] in agreement:
+            agreement.remove(change["previousAgreement"])
+        reactions.append(change["type"])
+        if change["agreement"] is not None:
+            agreement.append(change["agreement"])
+        overlaid["allReactions"] = reactions
+        overlaid["allAgreement"] = agreement
+
+    return overlaid
+
+
+def reaction_histogram(idea: dict) -> ReactionHistogram:
+    """
+    Take an idea's reaction counters out of its properties and describe them
+    as how many likes and dislikes it has, and how many likes at each agreement
+    """
+    counts = idea.pop("agreementCounts", None) or [0] * len(AGREEMENT_SCALE)
+    return {
+        "likes": idea.get("likeCount") or 0,
+        "dislikes": idea.get("dislikeCount") or 0,
+        "agreement": dict(zip(AGREEMENT_SCALE, counts)),
+    }
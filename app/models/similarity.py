@@ -0,0 +1,144 @@
+"""User similarity model"""
+
+from datetime import datetime, timedelta
+
+from app.queries import register
+
+# Looks through every user, so it scans. Only the refresh job runs it.
+STALE_USERS = register(
+    "similarity.stale_users",
+    """
+    MATCH (u:User)
+    WHERE u.similarityUpdatedAt IS NULL
+        OR u.similarityUpdatedAt < u.reactedAt
+        OR u.similarityUpdatedAt < u.neighbourReactedAt
+        OR u.similarityUpdatedAt < datetime() - duration({seconds: $max_age})
+    RETURN u.userId AS id
+    LIMIT $limit
+    """,
+    {"max_age": 0, "limit": 500},
+    hot=False,
+)
+
+CLEAR_NEIGHBOURS = register(
+    "similarity.clear_neighbours",
+    """
+    MATCH (:User {userId: $user_id})-[s:SIMILAR]->(:User)
+    DELETE s
+    """,
+    {"user_id": ""},
+    write=True,
+)
+
+# Pearson over co-rated ideas, with each user's mean taken over all their
+# ratings, expanded so it only needs the sums kept by app.models.reaction
+FIND_NEIGHBOURS = register(
+    "similarity.find_neighbours",
+    """
+    MATCH (u1:User {userId: $user_id})-[c:CORATES]->(u2:User)
+    WHERE c.n >= $min_overlap
+    WITH u1, u2, c,
+        toFloat(u1.ratingSum) / u1.ratingCount AS m1,
+        toFloat(u2.ratingSum) / u2.ratingCount AS m2
+
+    WITH u1, u2, c.n AS overlap,
+        c.sumProduct - m2 * c.sumSelf - m1 * c.sumOther + c.n * m1 * m2 AS nom,
+        (c.sumSelfSq - 2 * m1 * c.sumSelf + c.n * m1 * m1)
+            * (c.sumOtherSq - 2 * m2 * c.sumOther + c.n * m2 * m2) AS denom_sq
+    WHERE denom_sq > 1e-9
+
+    WITH u1, u2, overlap, nom / sqrt(denom_sq) AS pearson
+    ORDER BY abs(pearson) DESC
+    LIMIT $k
+
+    CREATE (u1)-[:SIMILAR {pearson: pearson, overlap: overlap, updatedAt: datetime()}]->(u2)
+    RETURN count(*) AS count
+    """,
+    {"user_id": "", "k": 50, "min_overlap": 1},
+    write=True,
+)
+
+MARK_REFRESHED = register(
+    "similarity.mark_refreshed",
+    """
+    MATCH (u:User {userId: $user_id})
+    SET u.similarityUpdatedAt = datetime()
+    """,
+    {"user_id": ""},
+    write=True,
+)
+
+
+##############################################################################
+# Transaction functions
+#
+
+
+def stale_users(tx, max_age: timedelta, limit: int) -> list[str]:
+    """
+    Transaction function for finding users whose similarity edges are missing,
+    older than their latest reaction or a reaction of one of their neighbours,
+    or older than max_age
+    """
+    result = tx.run(
+        STALE_USERS,
+        max_age=int(max_age.total_seconds()),
+        limit=limit,
+    )
+    return [row["id"] for row in result]
+
+
+def refresh_neighbours(tx, user_id: str, k: int, min_overlap: int) -> int:
+    """
+    Transaction function for replacing a user's SIMILAR edges with the k
+    neighbours whose Pearson similarity is strongest in either direction
+    """
+    tx.run(CLEAR_NEIGHBOURS, user_id=user_id)
+
+    count = tx.run(
+        FIND_NEIGHBOURS, user_id=user_id, k=k, min_overlap=min_overlap
+    ).single()["count"]
+
+    tx.run(MARK_REFRESHED, user_id=user_id)
+
+    return count
+
+
+##############################################################################
+# Main functions
+#
+
+
+def update_user_similarity(driver, user_id: str, k=50, min_overlap=1) -> int:
+    """Recompute the top-k SIMILAR edges of a single user"""
+
+    with driver.session() as session:
+        return session.execute_write(refresh_neighbours, user_id, k, min_overlap)
+
+
+def update_stale_similarities(
+    driver, k=50, min_overlap=1, max_age=timedelta(hours=1), batch_size=500
+) -> int:
+    """
+    Recompute SIMILAR edges for every user that reacted since their last
+    refresh, or whose edges are older than max_age. Returns the number of
+    users refreshed.
+    """
+
+    refreshed = 0
+    started = datetime.utcnow()
+
+    while True:
+        with driver.session() as session:
+            user_ids = session.execute_read(stale_users, max_age, batch_size)
+
+        if not user_ids:
+            return refreshed
+
+        for user_id in user_ids:
+            update_user_similarity(driver, user_id, k, min_overlap)
+            refreshed += 1
+
+        # Users who react faster than we refresh would keep this loop alive
+        if datetime.utcnow() - started > max_age:
+            return refreshed
@@ -3,8 +3,41 @@
 from flask import current_app
 from neo4j.exceptions import ConstraintError
 
+from app.queries import register
 from app.types import SourceData
 
+CREATE_SOURCE = register(
+    "source.create",
+    """
+    CREATE (s:Source {
+        sourceId: randomUuid(),
+        name: $name
+    })
+    RETURN s
+    """,
+    {"name": ""},
+    write=True,
+)
+
+SOURCE_BY_NAME = register(
+    "source.by_name",
+    """
+    MATCH (s:Source {name: $name})
+    RETURN s
+    """,
+    {"name": ""},
+)
+
+# Lists every source, so it scans
+ALL_SOURCES = register(
+    "source.all",
+    """
+    MATCH (s:Source)
+    RETURN s
+    """,
+    allow=["NodeByLabelScan"],
+)
+
 
 ##############################################################################
 # Transaction functions
@@ -13,20 +46,7 @@ from app.types import SourceData
 
 def create_source(tx, data: SourceData):
     """Transaction function for adding a new source to the database"""
-    return (
-        tx.run(
-            """
-        CREATE (s:Source {
-            sourceId: randomUuid(),
-            name: $name
-        })
-        RETURN s
-        """,
-            name=data["name"],
-        )
-        .single()
-        .get("s")
-    )
+    return tx.run(CREATE_SOURCE, name=data["name"]).single().get("s")
 
 
 def get_source(tx, name):
@@ -40,17 +60,7 @@ def get_source(tx, name):
     #     """,
     #     name=name,
     # ).values("s", "idea")
-    source = (
-        tx.run(
-            """
-        MATCH (s:Source {name: $name})
-        RETURN s
-        """,
-            name=name,
-        )
-        .single()
-        .get("s")
-    )
+    source = tx.run(SOURCE_BY_NAME, name=name).single().get("s")
 
     return source
 
@@ -78,12 +88,7 @@ def all_sources(driver):
     """Get all sources"""
 
     def get_all(tx):
-        result = tx.run(
-            """
-            MATCH (s:Source)
-            RETURN s
-            """
-        )
+        result = tx.run(ALL_SOURCES)
         return [record["s"] for record in result]
 
     try:
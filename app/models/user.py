@@ -2,12 +2,98 @@
 
 from datetime import datetime
 import jwt
-import bcrypt
 from flask import current_app
 from neo4j.exceptions import ConstraintError
 
 from app.exceptions.validation_exception import ValidationException
-from app.types import RegistrationData, User, UserToken, UserData
+from app.hashing import hash_password, check_password, needs_rehash, HashingBusy
+from app.queries import register
+from app.types import RegistrationData, User, UserToken, UserData, Profile
+
+CREATE_USER = register(
+    "user.create",
+    """
+    CREATE (u:User {
+        userId: randomUuid(),
+        email: $email,
+        password: $encrypted,
+        username: $username
+    })
+    RETURN u
+    """,
+    {"email": "", "encrypted": "", "username": ""},
+    write=True,
+)
+
+USER_BY_EMAIL = register(
+    "user.by_email",
+    """
+    MATCH (u:User {email: $email})
+    RETURN u {
+        .*
+    }
+    """,
+    {"email": ""},
+)
+
+PROFILE_BY_ID = register(
+    "user.profile",
+    """
+    MATCH (u:User {userId: $user_id})
+    RETURN u {
+        .userId,
+        .username,
+        .email,
+        profileVersion: coalesce(u.profileVersion, 0)
+    } AS profile
+    """,
+    {"user_id": ""},
+)
+
+USER_BY_ID = register(
+    "user.by_id",
+    """
+    MATCH (u:User {userId: $user_id})
+    RETURN u {
+        .*
+    }
+    """,
+    {"user_id": ""},
+)
+
+SET_PASSWORD = register(
+    "user.set_password",
+    """
+    MATCH (u:User {userId: $user_id})
+    WHERE u.password = $previous
+    SET u.password = $encrypted
+    """,
+    {"user_id": "", "previous": "", "encrypted": ""},
+    write=True,
+)
+
+# Every edit bumps profileVersion, so cached profiles give way to it
+UPDATE_FIELD = """
+    MATCH (u:User {{userId: $user_id}})
+    SET u.{0} = ${0},
+        u.profileVersion = coalesce(u.profileVersion, 0) + 1
+    RETURN u {{
+        userId: u.userId,
+        username: u.username,
+        email: u.email,
+        profileVersion: u.profileVersion
+    }}
+"""
+
+UPDATE_USER = {
+    field: register(
+        f"user.update_{field}",
+        UPDATE_FIELD.format(field),
+        {"user_id": "", field: ""},
+        write=True,
+    )
+    for field in ("username", "email", "password")
+}
 
 ##############################################################################
 # Transaction functions
@@ -17,15 +103,7 @@ from app.types import RegistrationData, User, UserToken, UserData
 def create_user(tx, email: str, encrypted: str, username: str) -> User:
     """Transaction function for adding a new user to the database"""
     return tx.run(
-        """
-        CREATE (u:User {
-            userId: randomUuid(),
-            email: $email,
-            password: $encrypted,
-            username: $username
-        })
-        RETURN u
-        """,
+        CREATE_USER,
         email=email,
         encrypted=encrypted,
         username=username,
@@ -37,15 +115,7 @@ def user_by_email(tx, email: str) -> User | None:
     Transaction function for getting a user from the database
     TODO: Let user be found by username as well
     """
-    user = tx.run(
-        """
-        MATCH (u:User {email: $email})
-        RETURN u {
-            .*
-        }
-        """,
-        email=email,
-    ).single()
+    user = tx.run(USER_BY_EMAIL, email=email).single()
 
     if user is None:
         return None
@@ -53,17 +123,16 @@ def user_by_email(tx, email: str) -> User | None:
     return user.get("u")
 
 
+def profile_by_id(tx, user_id: str) -> Profile | None:
+    """Transaction function for getting the public profile of a user"""
+    result = tx.run(PROFILE_BY_ID, user_id=user_id).single()
+
+    return result["profile"] if result else None
+
+
 def user_by_id(tx, user_id: str) -> User | None:
     """Transaction function for getting a user from the database"""
-    user = tx.run(
-        """
-        MATCH (u:User {userId: $user_id})
-        RETURN u {
-            .*
-        }
-        """,
-        user_id=user_id,
-    ).single()
+    user = tx.run(USER_BY_ID, user_id=user_id).single()
 
     if user is None:
         return None
@@ -71,6 +140,19 @@ def user_by_id(tx, user_id: str) -> User | None:
     return user.get("u")
 
 
+def set_password(tx, user_id: str, previous: str, encrypted: str) -> None:
+    """
+    Transaction function for replacing a user's password hash, unless it has
+    changed since previous was read
+    """
+    tx.run(
+        SET_PASSWORD,
+        user_id=user_id,
+        previous=previous,
+        encrypted=encrypted,
+    )
+
+
 ##############################################################################
 # Main functions
 #
@@ -79,9 +161,7 @@ def user_by_id(tx, user_id: str) -> User | None:
 def register(driver, data: RegistrationData) -> UserToken:
     """Register a new user"""
 
-    encrypted = bcrypt.hashpw(data["password"].encode("utf8"), bcrypt.gensalt()).decode(
-        "utf8"
-    )
+    encrypted = hash_password(data["password"])
 
     try:
         with driver.session() as session:
@@ -98,6 +178,7 @@ def register(driver, data: RegistrationData) -> UserToken:
         "userId": user["userId"],
         "email": user["email"],
         "username": user["username"],
+        "profileVersion": 0,
     }
 
     # Generate Token
@@ -119,16 +200,28 @@ def authenticate(driver, email: str, password: str) -> UserToken | bool:
     if user is None:
         return False
 
-    if (
-        bcrypt.checkpw(password.encode("utf-8"), user["password"].encode("utf-8"))
-        is False
-    ):
+    if check_password(password, user["password"]) is False:
         return False
 
+    if needs_rehash(user["password"]):
+        # The configured cost changed since this hash was made. Upgrading it
+        # can wait for another login if the hashing pool is busy.
+        try:
+            encrypted = hash_password(password)
+        except HashingBusy:
+            encrypted = None
+
+        if encrypted is not None:
+            with driver.session() as session:
+                session.execute_write(
+                    set_password, user["userId"], user["password"], encrypted
+                )
+
     payload = {
         "userId": user["userId"],
         "email": user["email"],
         "username": user["username"],
+        "profileVersion": user.get("profileVersion", 0),
     }
 
     payload["token"] = generate_token(payload)
@@ -141,6 +234,27 @@ def find_user(driver, user_id: str) -> User | None:
         return session.execute_read(user_by_id, user_id)
 
 
+def get_profile(driver, user_id: str, min_version=0) -> Profile | None:
+    """
+    Get a user's public profile, from this worker's cache if it holds one at
+    least as new as min_version. Pass the profileVersion claim of the
+    request's token, so that a token issued after an edit on another worker
+    never sees the profile from before it.
+    """
+
+    profile = current_app.profiles.get(user_id)
+    if profile is not None and profile["profileVersion"] >= min_version:
+        return profile
+
+    with driver.session() as session:
+        profile = session.execute_read(profile_by_id, user_id)
+
+    if profile is not None:
+        current_app.profiles.set(user_id, profile)
+
+    return profile
+
+
 def edit_user(
     driver,
     user_id: str,
@@ -153,47 +267,15 @@ def edit_user(
 
     def update_username(tx, user_id: str, username: str):
         return tx.run(
-            """
-            MATCH (u:User {userId: $user_id})
-            SET u.username = $username
-            RETURN u {
-                userId: u.userId,
-                username: u.username,
-                email: u.email
-            }
-            """,
-            user_id=user_id,
-            username=username,
+            UPDATE_USER["username"], user_id=user_id, username=username
         ).single()[0]
 
     def update_email(tx, user_id: str, email: str):
-        return tx.run(
-            """
-            MATCH (u:User {userId: $user_id})
-            SET u.email = $email
-            RETURN u {
-                userId: u.userId,
-                username: u.username,
-                email: u.email
-            }
-            """,
-            user_id=user_id,
-            email=email,
-        ).single()[0]
+        return tx.run(UPDATE_USER["email"], user_id=user_id, email=email).single()[0]
 
     def update_password(tx, user_id: str, password: str):
         return tx.run(
-            """
-            MATCH (u:User {userId: $user_id})
-            SET u.password = $password
-            RETURN u {
-                userId: u.userId,
-                username: u.username,
-                email: u.email
-            }
-            """,
-            user_id=user_id,
-            password=password,
+            UPDATE_USER["password"], user_id=user_id, password=password
         ).single()[0]
 
     with driver.session() as session:
@@ -206,12 +288,7 @@ def edit_user(
                 {"details": None},
             )
 
-        if (
-            bcrypt.checkpw(
-                current_password.encode("utf-8"), user["password"].encode("utf-8")
-            )
-            is False
-        ):
+        if check_password(current_password, user["password"]) is False:
             raise ValidationException(
                 "Invalid password",
                 {"details": None},
@@ -227,15 +304,17 @@ def edit_user(
             raise ValidationException(err.message, {"email": err.message})
 
         if new_password:
-            encrypted = bcrypt.hashpw(
-                new_password.encode("utf8"), bcrypt.gensalt()
-            ).decode("utf8")
+            encrypted = hash_password(new_password)
             user = session.execute_write(update_password, user_id, encrypted)
 
+        # Other workers see the new profileVersion in this user's new token
+        current_app.profiles.delete(user_id)
+
         payload = {
             "userId": user["userId"],
             "email": user["email"],
             "username": user["username"],
+            "profileVersion": user.get("profileVersion", 0),
         }
 
         # Generate Token
@@ -0,0 +1,168 @@
+"""
+Named queries
+Models register their Cypher here by name, with sample parameters of the
+types they are run with. At startup every registered query is run with
+EXPLAIN, which plans it without running it:
+
+- Plans of hot queries, the ones requests wait on, are checked for label
+  and full scans and for cartesian products of more than one row a side.
+  QUERY_PLAN_CHECK decides whether a bad plan logs a warning or stops the app.
+- The server caches each plan, keyed by query text and parameter types, so
+  the first requests after a deploy skip planning.
+"""
+
+import re
+
+from app.types import PlanProblem, RegisteredQuery
+
+QUERIES: dict[str, RegisteredQuery] = {}
+
+# The name of each registered query, by its text
+QUERY_NAMES: dict[str, str] = {}
+
+# Operators that read every node, or every node with a label
+SCANS = {"AllNodesScan", "NodeByLabelScan"}
+
+# Leaves that give at most one row for each row coming in
+SINGLE_ROW = {"NodeUniqueIndexSeek", "Argument"}
+
+
+class QueryPlanError(Exception):
+    """A hot query is planned with a scan or a cartesian product"""
+
+
+def register(
+    name: str, text: str, sample: dict | None = None, write=False, hot=True, allow=()
+) -> str:
+    """
+    Add a query to the registry and return its text. Sample parameters must
+    have the types the query runs with, and may have any name.
+    Operators in allow are not reported, for queries that scan on purpose.
+    """
+
+    if name in QUERIES and QUERIES[name]["text"] != text:
+        raise ValueError(f"Another query is registered as {name}")
+
+    QUERIES[name] = {
+        "name": name,
+        "text": text,
+        "write": write,
+        "hot": hot,
+        "allow": tuple(allow),
+        "sample": sample or {},
+    }
+    QUERY_NAMES[text] = name
+    return text
+
+
+##############################################################################
+# Transaction functions
+#
+
+
+def explain(tx, text: str, sample: dict) -> dict:
+    """Transaction function for planning a query without running it"""
+    return tx.run("EXPLAIN " + text, sample).consume().plan
+
+
+##############################################################################
+# Main functions
+#
+
+
+def check_queries(driver, names=None) -> list[PlanProblem]:
+    """
+    Plan every registered query, or those named, caching their plans on the
+    server. Returns the problems found in the plans of hot queries.
+    """
+
+    problems = []
+
+    with driver.session() as session:
+        for query in QUERIES.values():
+            if names is not None and query["name"] not in names:
+                continue
+
+            execute = session.execute_write if query["write"] else session.execute_read
+            plan = execute(explain, query["text"], query["sample"])
+
+            if query["hot"]:
+                found = [
+                    operator
+                    for operator in plan_problems(plan)
+                    if operator not in query["allow"]
+                ]
+                if found:
+                    problems.append({"query": query["name"], "operators": found})
+
+    return problems
+
+
+def verify_queries(driver, mode: str, logger) -> list[PlanProblem]:
+    """
+    Check every registered query as QUERY_PLAN_CHECK says: "off" skips it,
+    "warn" logs each problem and "fail" raises QueryPlanError
+    """
+
+    if mode == "off":
+        return []
+
+    problems = check_queries(driver)
+    for problem in problems:
+        logger.warning(
+            "Query %s is planned with %s",
+            problem["query"],
+            ", ".join(problem["operators"]),
+        )
+
+    if problems and mode == "fail":
+        raise QueryPlanError(
+            "Bad plans for " + ", ".join(problem["query"] for problem in problems)
+        )
+
+    return problems
+
+
+##############################################################################
+# Helper functions
+#
+
+
+def operator_name(plan: dict) -> str:
+    """The operator of a plan step, without its runtime or (Locking) suffix"""
+    return re.sub(r"\(.*\)", "", plan["operatorType"].split("@")[0])
+
+
+def operators(plan: dict) -> list[str]:
+    """Every operator in a plan"""
+    return [operator_name(plan)] + [
+        operator for child in plan.get("children", []) for operator in operators(child)
+    ]
+
+
+def plan_problems(plan: dict) -> list[str]:
+    """
+    The scans in a plan, and its cartesian products unless each side seeks a
+    unique key, which makes them one row by one row
+    """
+
+    operator = operator_name(plan)
+    children = plan.get("children", [])
+    found = [operator] if operator in SCANS else []
+
+    if operator == "CartesianProduct" and not all(
+        set(leaves(child)) <= SINGLE_ROW for child in children
+    ):
+        found.append(operator)
+
+    for child in children:
+        found += [problem for problem in plan_problems(child) if problem not in found]
+
+    return found
+
+
+def leaves(plan: dict) -> list[str]:
+    children = plan.get("children", [])
+    if not children:
+        return [operator_name(plan)]
+    return [leaf for child in children for leaf in leaves(child)]
@@ -0,0 +1,137 @@
+"""
+Per-user recommendation rankings
+A ranking is computed once from a single similarity computation, then cached
+in the worker so that later pages and single-idea recommendations are served
+from memory. Ideas the user reacts to are skipped rather than recomputed:
+those in the user's seen set, which follows reactions made through any
+worker, and those marked here before the seen set has them.
+"""
+
+from flask import current_app
+
+from app.cursors import encode_cursor, decode_cursor
+from app.engine import rank_ideas
+from app.models.idea import get_idea_rankings
+from app.seen import get_seen
+from app.types import IdeaWithScore
+
+POLARITIES = ("agreeable", "disagreeable")
+
+
+def get_rankings(driver, user_id: str) -> dict:
+    """Get the cached rankings for a user, computing them if needed"""
+
+    rankings = current_app.rankings.get(user_id)
+    if rankings is not None:
+        return rankings
+
+    depth = current_app.config.get("RANKING_DEPTH")
+    if current_app.config.get("RECOMMENDER_BACKEND") == "numpy":
+        ranked = rank_ideas(driver, user_id, depth)
+    else:
+        ranked = get_idea_rankings(driver, user_id, depth)
+
+    return cache_rankings(user_id, ranked)
+
+
+def ranked_page(
+    driver, user_id: str, polarity: str, limit: int, cursor: str | None = None
+) -> tuple[list[IdeaWithScore], str | None]:
+    """
+    Get a page of a user's ranking for one polarity, skipping ideas they have
+    seen since it was computed. Returns the ideas and the cursor of the next
+    page, or None if this is the last page. Raises ValueError if the limit is
+    below 1 or the cursor is not one made for this polarity.
+    """
+
+    offset = ranking_offset(polarity, limit, cursor)
+    rankings = get_rankings(driver, user_id)
+    return page_ranking(rankings, get_seen(driver, user_id), polarity, limit, offset)
+
+
+def top_idea(driver, user_id: str, agreeable: bool) -> IdeaWithScore | None:
+    """Get the best unseen idea for a user from their ranking"""
+
+    polarity = "agreeable" if agreeable else "disagreeable"
+    cached = current_app.rankings.get(user_id) is not None
+
+    page, _ = ranked_page(driver, user_id, polarity, 1)
+
+    if not page and cached:
+        # The cached ranking may be used up while deeper ideas remain
+        current_app.rankings.delete(user_id)
+        page, _ = ranked_page(driver, user_id, polarity, 1)
+
+    return page[0] if page else None
+
+
+def mark_seen(user_id: str, *idea_ids: str) -> None:
+    """Keep ideas the user has reacted to out of their cached ranking"""
+
+    rankings = current_app.rankings.get(user_id)
+    if rankings is not None:
+        rankings["seen"].update(idea_ids)
+
+
+def drop_idea(idea_id: str) -> None:
+    """Take a deleted idea out of every ranking cached in this worker"""
+
+    for rankings in current_app.rankings.values():
+        rankings["seen"].add(idea_id)
+
+
+def cache_rankings(user_id: str, ranked: dict) -> dict:
+    """Cache a user's freshly computed rankings in this worker"""
+
+    rankings = {**ranked, "seen": set()}
+    current_app.rankings.set(user_id, rankings)
+    return rankings
+
+
+def ranking_offset(polarity: str, limit: int, cursor: str | None) -> int:
+    """
+    Read how far into a polarity of rankings a cursor points, or 0 without one.
+    Raises ValueError if the limit is below 1 or the cursor is not one
+    page_ranking made for this polarity.
+    """
+
+    if limit < 1:
+        raise ValueError("The limit must be at least 1")
+
+    if not cursor:
+        return 0
+
+    position = decode_cursor(cursor) or {}
+    offset = position.get("offset")
+    if (
+        position.get("polarity") != polarity
+        or not isinstance(offset, int)
+        or isinstance(offset, bool)
+        or offset < 0
+    ):
+        raise ValueError(f"Invalid {polarity} cursor")
+
+    return offset
+
+
+def page_ranking(
+    rankings: dict, seen, polarity: str, limit: int, offset: int
+) -> tuple[list[IdeaWithScore], str | None]:
+    """Get a page of a polarity of rankings from offset, skipping seen ideas"""
+
+    ranked = rankings[polarity]
+
+    page = []
+    while offset < len(ranked) and len(page) < limit:
+        entry = ranked[offset]
+        if (
+            entry["idea"]["ideaId"] not in rankings["seen"]
+            and entry["ordinal"] not in seen
+        ):
+            page.append(entry["idea"])
+        offset += 1
+
+    if offset >= len(ranked):
+        return page, None
+
+    return page, encode_cursor({"polarity": polarity, "offset": offset})
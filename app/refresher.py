@@ -0,0 +1,39 @@
+"""
+Similarity refresher, run beside the workers with `python -m app.refresher`.
+It only loads the config and connects to the database, so unlike the flask
+commands it never resets, seeds or plans queries when it starts.
+"""
+
+import argparse
+import signal
+import threading
+
+from app import create_minimal_app
+from app.commands import refresh_similarity
+from app.db import close_driver
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Keep the SIMILAR graph up to date")
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=0,
+        help="Seconds between refreshes. Runs once and exits if omitted.",
+    )
+    args = parser.parse_args(argv)
+
+    # Finish the refresh under way, then close the driver
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    app = create_minimal_app()
+    with app.app_context():
+        try:
+            refresh_similarity(args.interval, stop)
+        finally:
+            close_driver()
+
+
+if __name__ == "__main__":
+    main()
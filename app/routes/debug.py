@@ -0,0 +1,38 @@
+"""Routes for inspecting a running worker"""
+
+from flask import Blueprint, Response, jsonify, current_app
+
+from app.migrations import schema_status
+
+debug = Blueprint("debug", __name__, url_prefix="/api/debug")
+
+
+@debug.get("/pool")
+def pool_stats():
+    """Get the database connection pool stats of the worker that serves this request"""
+
+    return (jsonify(pool=current_app.pool_monitor.stats()), 200)
+
+
+@debug.get("/queries")
+def query_stats():
+    """Get the per-query timings and db hits, summed over every worker"""
+
+    return (jsonify(current_app.query_metrics.stats()), 200)
+
+
+@debug.get("/metrics")
+def query_metrics():
+    """Get the same per-query metrics in the Prometheus text format"""
+
+    return Response(
+        current_app.query_metrics.prometheus(),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
+@debug.get("/schema")
+def schema():
+    """Get the schema version of the database and the state of its indexes"""
+
+    return (jsonify(schema_status(current_app.driver)), 200)
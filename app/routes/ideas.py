@@ -1,25 +1,40 @@
 """ Routes for ideas """
 
-from flask import Blueprint, jsonify, request, current_app
+import hashlib
+import time
+from itertools import chain
+from typing import Callable, Iterable
+
+from flask import Blueprint, jsonify, request, current_app, stream_with_context
 from flask.wrappers import Response
 from flask_jwt_extended import jwt_required, get_jwt
 from flask_expects_json import expects_json
 
 from app.models.idea import (
     add_idea,
+    all_ideas,
+    LISTINGS,
     random_idea,
     random_unseen_idea,
     popular_unseen_idea,
-    get_agreeable_idea,
-    get_disagreeable_idea,
+    trending_unseen_idea,
     like_idea,
     dislike_idea,
+    react_to_ideas,
     get_seen_ideas,
+    stream_seen_ideas,
     delete_idea,
     get_posted_ideas,
     get_all_seen_ideas_with_user_and_aggregate_reactions,
+    stream_seen_ideas_with_reactions,
     get_idea_details,
+    idea_version,
+    find_ideas,
+    pending_reacted_ideas,
 )
+from app.buffer import get_buffer, buffer_reaction, pending_reactions
+from app.models.reaction import with_pending_reaction
+from app.ranking import POLARITIES, ranked_page, top_idea, mark_seen, drop_idea
 
 ideas = Blueprint("ideas", __name__, url_prefix="/api/ideas")
 
@@ -33,12 +48,35 @@ post_idea_schema = {
     "required": ["url", "description"],
 }
 
+# Agreement runs from -3, strong disagreement, to 3, so that each idea can
+# count its likes at every point
+AGREEMENT_SCHEMA = {"type": "integer", "minimum": -3, "maximum": 3}
+
 post_reaction_schema = {
     "type": "object",
-    "properties": {"type": {"type": "string"}, "agreement": {"type": "number"}},
+    "properties": {"type": {"type": "string"}, "agreement": AGREEMENT_SCHEMA},
     "required": ["type"],
 }
 
+post_reactions_schema = {
+    "type": "object",
+    "properties": {
+        "reactions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "ideaId": {"type": "string"},
+                    "type": {"enum": ["like", "dislike"]},
+                    "agreement": AGREEMENT_SCHEMA,
+                },
+                "required": ["ideaId", "type"],
+            },
+        },
+    },
+    "required": ["reactions"],
+}
+
 
 @ideas.post("/")
 @expects_json(post_idea_schema)
@@ -67,11 +105,42 @@ def post_idea() -> tuple[Response, int]:
     return (jsonify(idea=idea), 201)
 
 
+@ideas.get("/")
+def list_ideas() -> tuple[Response, int]:
+    """
+    Get a page of all ideas, sorted by createdAt, likeCount or trending.
+    Pass the returned cursor back to get the next page.
+    """
+
+    sort = request.args.get("sort", "createdAt")
+    order = request.args.get("order", "desc")
+    limit = request.args.get("limit", 20, type=int)
+
+    if (sort, order) not in LISTINGS:
+        return (jsonify(msg=f"Ideas cannot be sorted by {sort} {order}."), 400)
+
+    if limit < 1:
+        return (jsonify(msg="The limit must be at least 1."), 400)
+
+    try:
+        ideas, cursor = all_ideas(
+            current_app.driver,
+            sort,
+            order,
+            min(limit, 100),
+            request.args.get("cursor", None),
+        )
+    except ValueError as err:
+        return (jsonify(msg=f"{err}."), 400)
+
+    return (jsonify(ideas=ideas, cursor=cursor), 200)
+
+
 @ideas.get("/random")
 def get_idea() -> tuple[Response, int]:
     """Get an idea from the database"""
 
-    idea = random_idea(current_app.driver, "fake")
+    idea = random_idea(current_app.driver)
 
     return (jsonify(idea=idea), 200)
 
@@ -84,12 +153,14 @@ def get_unseen_idea() -> tuple[Response, int]:
     claims = get_jwt()
     user_id = claims.get("userId", None)
 
-    idea = random_unseen_idea(current_app.driver, user_id)
+    idea = random_unseen_idea(
+        current_app.driver, user_id, exclude=pending_reactions(user_id).keys()
+    )
 
     if idea is None:
         return (jsonify(msg="We are all out of ideas you haven't seen before."), 404)
 
-    return (jsonify(idea=idea[0]), 200)
+    return (jsonify(idea=idea), 200)
 
 
 @ideas.get("/popular")
@@ -99,12 +170,31 @@ def get_popular_idea() -> tuple[Response, int]:
     claims = get_jwt()
     user_id = claims.get("userId", None)
 
-    idea = popular_unseen_idea(current_app.driver, user_id)
+    idea = popular_unseen_idea(
+        current_app.driver, user_id, exclude=pending_reactions(user_id).keys()
+    )
+
+    if idea is None:
+        return (jsonify(msg="We are all out of idea you haven't seen before."), 404)
+
+    return (jsonify(idea=idea), 200)
+
+
+@ideas.get("/trending")
+@jwt_required()
+def get_trending_idea() -> tuple[Response, int]:
+    """Get the most liked idea of late that the user has not yet seen"""
+    claims = get_jwt()
+    user_id = claims.get("userId", None)
+
+    idea = trending_unseen_idea(
+        current_app.driver, user_id, exclude=pending_reactions(user_id).keys()
+    )
 
     if idea is None:
         return (jsonify(msg="We are all out of idea you haven't seen before."), 404)
 
-    return (jsonify(idea=idea[0]), 200)
+    return (jsonify(idea=idea), 200)
 
 
 @ideas.get("/disagreeable")
@@ -115,12 +205,12 @@ def disagreeable_idea():
     claims = get_jwt()
     user_id = claims.get("userId", None)
 
-    idea = get_disagreeable_idea(current_app.driver, user_id)
+    idea = top_idea(current_app.driver, user_id, agreeable=False)
 
     if idea is None:
         return (jsonify(msg="We are all out of ideas for you to disagree with."), 404)
 
-    return (jsonify(idea=idea[0]), 200)
+    return (jsonify(idea=idea), 200)
 
 
 @ideas.get("/agreeable")
@@ -131,18 +221,52 @@ def agreeable_idea():
     claims = get_jwt()
     user_id = claims.get("userId", None)
 
-    idea = get_agreeable_idea(current_app.driver, user_id)
+    idea = top_idea(current_app.driver, user_id, agreeable=True)
 
     if idea is None:
         return (jsonify(msg="We are all out of nice ideas."), 404)
 
-    return (jsonify(idea=idea[0]), 200)
+    return (jsonify(idea=idea), 200)
+
+
+@ideas.get("/recommendations")
+@jwt_required()
+def recommendations():
+    """
+    Get a page of the most agreeable and the most disagreeable ideas.
+    Each polarity pages independently with the cursor returned for it.
+    """
+
+    claims = get_jwt()
+    user_id = claims.get("userId", None)
+
+    limit = min(request.args.get("limit", 10, type=int), 50)
+
+    pages = {}
+    for polarity in POLARITIES:
+        try:
+            ideas, cursor = ranked_page(
+                current_app.driver,
+                user_id,
+                polarity,
+                limit,
+                request.args.get(f"{polarity}Cursor", None),
+            )
+        except ValueError as err:
+            return (jsonify(msg=f"{err}."), 400)
+        pages[polarity] = {"ideas": ideas, "cursor": cursor}
+
+    return (jsonify(**pages), 200)
 
 
 @ideas.post("/<string:idea_id>/react")
 @expects_json(post_reaction_schema)
 @jwt_required()
 def react_to_idea(idea_id):
+    """
+    React to an idea. With REACTION_BUFFER on, the reaction is buffered and
+    written in the background, and this answers 202 straight away.
+    """
 
     claims = get_jwt()
     user_id = claims.get("userId", None)
@@ -150,6 +274,20 @@ def react_to_idea(idea_id):
     data = request.get_json()
     type = data["type"]
 
+    if get_buffer() is not None:
+        if type == "like" and "agreement" not in data:
+            return (jsonify(msg="A like needs an agreement."), 400)
+
+        reaction = {
+            "ideaId": idea_id,
+            "type": "LIKES" if type == "like" else "DISLIKES",
+            "agreement": data.get("agreement") if type == "like" else None,
+        }
+        buffer_reaction(user_id, reaction)
+        mark_seen(user_id, idea_id)
+
+        return (jsonify(reaction=reaction), 202)
+
     if type == "like":
         reaction = like_idea(current_app.driver, user_id, idea_id, data["agreement"])
     else:
@@ -158,32 +296,133 @@ def react_to_idea(idea_id):
     if reaction is None:
         return (jsonify(msg="Reaction could not be saved."), 400)
 
+    mark_seen(user_id, idea_id)
+
     return (jsonify(reaction=reaction), 200)
 
 
+@ideas.post("/reactions")
+@expects_json(post_reactions_schema)
+@jwt_required()
+def react_to_many_ideas():
+    """
+    Save many reactions at once. Each one is like a POST to
+    /<idea_id>/react, and gets a result saying whether it was saved.
+    """
+
+    claims = get_jwt()
+    user_id = claims.get("userId", None)
+
+    reactions = request.get_json()["reactions"]
+
+    if len(reactions) > current_app.config.get("REACTION_BATCH_LIMIT"):
+        return (jsonify(msg="Too many reactions in one request."), 413)
+
+    if any(r["type"] == "like" and "agreement" not in r for r in reactions):
+        return (jsonify(msg="Every like needs an agreement."), 400)
+
+    results = react_to_ideas(
+        current_app.driver,
+        user_id,
+        [
+            {
+                "ideaId": r["ideaId"],
+                "type": "LIKES" if r["type"] == "like" else "DISLIKES",
+                "agreement": r.get("agreement"),
+            }
+            for r in reactions
+        ],
+    )
+
+    mark_seen(user_id, *(r["ideaId"] for r in results if r["status"] == "saved"))
+
+    return (jsonify(reactions=results), 200)
+
+
 @ideas.get("/viewed")
 @jwt_required()
 def viewed_ideas():
+    """
+    Get the ideas the user posted or reacted to, newest first. Pages by
+    ?limit= and ?cursor= if given, or streams NDJSON with ?stream=true.
+    """
+
     claims = get_jwt()
     user_id = claims.get("userId", None)
 
-    ideas = get_seen_ideas(current_app.driver, user_id)
+    try:
+        limit, cursor = page_args()
+    except ValueError as err:
+        return (jsonify(msg=f"{err}."), 400)
+
+    # Reactions still in the write-behind buffer come first
+    pending = list(pending_reactions(user_id))
+    buffered = find_ideas(current_app.driver, pending) if pending else []
+
+    if request.args.get("stream", None) == "true":
+        ideas = stream_seen_ideas(current_app.driver, user_id)
+        return ndjson(
+            chain(buffered, (idea for idea in ideas if idea["ideaId"] not in pending))
+        )
+
+    try:
+        ideas, cursor = get_seen_ideas(current_app.driver, user_id, limit, cursor)
+    except ValueError as err:
+        return (jsonify(msg=f"{err}."), 400)
+
+    ideas = [idea for idea in ideas if idea["ideaId"] not in pending]
+    if request.args.get("cursor", None) is None:
+        ideas = buffered + ideas
 
-    return jsonify(ideas=ideas)
+    return jsonify(ideas=ideas, cursor=cursor)
 
 
 @ideas.get("/viewed-with-relationships")
 @jwt_required()
 def viewed_ideas_with_relationships():
+    """
+    Get the ideas the user reacted to, newest first, with histograms of
+    everyone's reactions. Pages by ?limit= and ?cursor= if given, or streams
+    NDJSON with ?stream=true, and lists every reaction with ?raw-reactions=true.
+    """
 
     claims = get_jwt()
     user_id = claims.get("userId", None)
-
-    ideas = get_all_seen_ideas_with_user_and_aggregate_reactions(
-        current_app.driver, user_id
+    raw = request.args.get("raw-reactions", None) == "true"
+
+    try:
+        limit, cursor = page_args()
+    except ValueError as err:
+        return (jsonify(msg=f"{err}."), 400)
+
+    # Reactions still in the write-behind buffer come first
+    pending = pending_reactions(user_id)
+    buffered = (
+        pending_reacted_ideas(
+            current_app.driver, "seen_with_reactions", user_id, pending, raw
+        )
+        if pending
+        else []
     )
 
-    return jsonify(ideas=ideas)
+    if request.args.get("stream", None) == "true":
+        ideas = stream_seen_ideas_with_reactions(current_app.driver, user_id, raw)
+        return ndjson(
+            chain(buffered, (idea for idea in ideas if idea["ideaId"] not in pending))
+        )
+
+    try:
+        ideas, cursor = get_all_seen_ideas_with_user_and_aggregate_reactions(
+            current_app.driver, user_id, limit, cursor, raw
+        )
+    except ValueError as err:
+        return (jsonify(msg=f"{err}."), 400)
+
+    ideas = [idea for idea in ideas if idea["ideaId"] not in pending]
+    if request.args.get("cursor", None) is None:
+        ideas = buffered + ideas
+
+    return jsonify(ideas=ideas, cursor=cursor)
 
 
 @ideas.get("/<string:idea_id>/reactions")
@@ -193,18 +432,34 @@ def idea_reactions(idea_id):
     claims = get_jwt()
     user_id = claims.get("userId", None)
 
-    idea = get_idea_details(current_app.driver, idea_id, True, user_id)
-    if idea is None:
-        return (jsonify(msg="Reactions not found."), 404)
-
-    return jsonify(
-        reactions={
-            "userReaction": idea["userReaction"],
-            "userAgreement": idea["userAgreement"],
-            "allReactions": idea["allReactions"],
-            "allAgreement": idea["allAgreement"],
+    pending = pending_reactions(user_id).get(idea_id)
+
+    def render():
+        idea = get_idea_details(current_app.driver, idea_id, True, user_id)
+
+        if pending is not None:
+            # The user's reaction may only be in the buffer so far, so read
+            # the idea without one and fold the buffered reaction in
+            if idea is None:
+                idea = get_idea_details(current_app.driver, idea_id, True)
+            if idea is not None:
+                idea = with_pending_reaction(idea, pending)
+
+        if idea is None:
+            return None
+
+        return {
+            "reactions": {
+                "userReaction": idea["userReaction"],
+                "userAgreement": idea["userAgreement"],
+                "allReactions": idea["allReactions"],
+                "allAgreement": idea["allAgreement"],
+            }
         }
-    )
+
+    # A buffered reaction is not in the database yet, so is not cached
+    variant = ("reactions", user_id) if pending is None else None
+    return cached_idea_response(idea_id, variant, render, "Reactions not found.")
 
 
 @ideas.get("/<string:idea_id>")
@@ -218,14 +473,20 @@ def idea_details(idea_id):
     with_user_reaction = request.args.get("with-user-reaction", None) == "true"
 
     if with_user_reaction:
-        idea = get_idea_details(current_app.driver, idea_id, True, user_id)
+        variant = ("details", user_id)
+
+        def render():
+            idea = get_idea_details(current_app.driver, idea_id, True, user_id)
+            return {"idea": idea} if idea is not None else None
+
     else:
-        idea = get_idea_details(current_app.driver, idea_id, with_reactions)
+        variant = ("details", with_reactions)
 
-    if idea is None:
-        return (jsonify(msg="Idea not found."), 404)
+        def render():
+            idea = get_idea_details(current_app.driver, idea_id, with_reactions)
+            return {"idea": idea} if idea is not None else None
 
-    return jsonify(idea=idea)
+    return cached_idea_response(idea_id, variant, render, "Idea not found.")
 
 
 @ideas.delete("/<string:idea_id>")
@@ -237,6 +498,8 @@ def delete_single_idea(idea_id):
 
     user_id = claims.get("userId", None)
     query_res = delete_idea(current_app.driver, idea_id, user_id)
+    if query_res:
+        drop_idea(query_res)
 
     return jsonify({"deleted": query_res})
 
@@ -244,12 +507,97 @@ def delete_single_idea(idea_id):
 @ideas.get("/user/<string:user_id>")
 @jwt_required()
 def posted_by_user(user_id):
-    """Get ideas posted by a user"""
+    """Get ideas posted by a user, paged as for /viewed-with-relationships"""
 
     claims = get_jwt()
     current_user = claims.get("userId", None)
     if current_user != user_id:
         return (jsonify(msg="You are not authorized to view this resource"), 403)
 
-    ideas = get_posted_ideas(current_app.driver, user_id)
-    return jsonify(ideas=ideas)
+    raw = request.args.get("raw-reactions", None) == "true"
+
+    try:
+        ideas, cursor = get_posted_ideas(current_app.driver, user_id, *page_args(), raw)
+    except ValueError as err:
+        return (jsonify(msg=f"{err}."), 400)
+
+    # The user's reactions to their own ideas that are still buffered
+    pending = pending_reactions(user_id)
+    if pending:
+        buffered = pending_reacted_ideas(
+            current_app.driver, "posted", user_id, pending, raw
+        )
+        ideas = [idea for idea in ideas if idea["ideaId"] not in pending]
+        if request.args.get("cursor", None) is None:
+            ideas = buffered + ideas
+
+    return jsonify(ideas=ideas, cursor=cursor)
+
+
+def page_args() -> tuple[int | None, str | None]:
+    """
+    The limit and cursor asked for a list of the user's ideas.
+    Raises ValueError if the limit is below 1.
+    """
+
+    limit = request.args.get("limit", None, type=int)
+    if limit is not None and limit < 1:
+        raise ValueError("The limit must be at least 1")
+
+    return (
+        min(limit, 100) if limit is not None else None,
+        request.args.get("cursor", None),
+    )
+
+
+def cached_idea_response(
+    idea_id: str, variant: tuple | None, render: Callable[[], dict | None], missing: str
+):
+    """
+    Answer with the payload render gives for an idea, from this worker's
+    cache while the idea's reaction version is unchanged, with a strong ETag
+    of its body. A request whose If-None-Match holds that ETag gets 304
+    instead, without a query while the version is remembered. A variant of
+    None is rendered every time.
+    """
+
+    cache = current_app.idea_responses
+    version = cache.version(idea_id)
+
+    # Read before rendering, so a response made from data newer than the
+    # version is only stored under the older one
+    if version is None:
+        read_at = time.monotonic()
+        version = idea_version(current_app.driver, idea_id)
+        if version is None:
+            return (jsonify(msg=missing), 404)
+        cache.remember(idea_id, version, read_at)
+
+    entry = cache.get(idea_id, version, variant) if variant is not None else None
+
+    if entry is None:
+        payload = render()
+        if payload is None:
+            return (jsonify(msg=missing), 404)
+
+        body = jsonify(payload).get_data()
+        entry = (hashlib.sha256(body).hexdigest(), body)
+        if variant is not None:
+            cache.set(idea_id, version, variant, entry)
+
+    etag, body = entry
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(body, mimetype="application/json")
+
+    response.set_etag(etag)
+    return response
+
+
+def ndjson(ideas: Iterable[dict]) -> Response:
+    """Stream ideas as newline-delimited JSON, one idea a line, as they are read"""
+    return Response(
+        stream_with_context(current_app.json.dumps(idea) + "\n" for idea in ideas),
+        mimetype="application/x-ndjson",
+    )
@@ -4,8 +4,9 @@ from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt
 from flask_expects_json import expects_json
 
-from app.models.user import register, authenticate, find_user, edit_user
+from app.models.user import register, authenticate, get_profile, edit_user
 from app.exceptions.validation_exception import ValidationException
+from app.hashing import HashingBusy
 
 users = Blueprint("users", __name__, url_prefix="/api/users")
 
@@ -40,6 +41,14 @@ update_user_schema = {
 }
 
 
+@users.errorhandler(HashingBusy)
+def hashing_busy(err):
+    """Turn people away while the password hashing pool is full"""
+    response = jsonify(msg="Too many people are logging in. Please try again shortly.")
+    response.headers["Retry-After"] = "1"
+    return (response, 503)
+
+
 ##############################################################################
 # Authentication
 #
@@ -95,10 +104,16 @@ def get_user(user_id):
     if current_user != user_id:
         return (jsonify(msg="You are not authorized to view this resource"), 403)
 
-    user = find_user(current_app.driver, user_id)
-    without_pass = {key: value for key, value in user.items() if key != "password"}
+    profile = get_profile(
+        current_app.driver, user_id, claims.get("profileVersion", 0)
+    )
+
+    if profile is None:
+        return (jsonify(msg="User not found."), 404)
 
-    return (jsonify(user=without_pass), 200)
+    user = {key: value for key, value in profile.items() if key != "profileVersion"}
+
+    return (jsonify(user=user), 200)
 
 
 ##############################################################################
@@ -1,12 +1,13 @@
 """Setup database"""
 
-from functools import partial
 import random
 
-from .types import RegistrationData, IdeaData
-from .models.user import register
-from .models.source import add_source
-from .models.idea import add_idea, like_idea, dislike_idea
+from flask import current_app
+
+from .loader import load_rows, rebuild_derived, with_id
+from .migrations import migrate
+from .models.reaction import rebuild_idea_counters, trending_decay
+from .snapshot import export_snapshot, restore_snapshot
 
 try:
     from faker import Faker
@@ -19,110 +20,177 @@ except ImportError:
 
 
 def clear_db(tx):
-    """Delete all from db"""
-    tx.run("MATCH (n) DETACH DELETE n")
+    """Delete all from db but the record of its schema"""
+    tx.run("MATCH (n) WHERE NOT n:Migration DETACH DELETE n")
 
 
 def set_db_properties(driver):
-    def constraints(tx):
-        tx.run(
-            "CREATE CONSTRAINT unique_email IF NOT EXISTS FOR (user:User) REQUIRE user.email IS UNIQUE"
-        )
-        tx.run(
-            "CREATE CONSTRAINT unique_username IF NOT EXISTS FOR (user:User) REQUIRE user.username IS UNIQUE"
-        )
-        tx.run(
-            "CREATE CONSTRAINT unique_source_name IF NOT EXISTS FOR (source:Source) REQUIRE source.name IS UNIQUE"
-        )
+    """Bring the schema up to date and fill in properties older data lacks"""
+
+    def missing_counters(tx):
+        return tx.run(
+            """
+            MATCH (i:Idea)
+            WHERE i.likeCount IS NULL OR i.agreementCounts IS NULL
+            RETURN count(i) > 0 AS missing
+            """
+        ).single()["missing"]
+
+    def random_keys(tx, batch_size):
+        return tx.run(
+            """
+            MATCH (i:Idea)
+            WHERE i.randomKey IS NULL
+            WITH i LIMIT $batch_size
+            SET i.randomKey = rand()
+            RETURN count(i) AS updated
+            """,
+            batch_size=batch_size,
+        ).single()["updated"]
+
+    def ordinals(tx, batch_size):
+        return tx.run(
+            """
+            MATCH (i:Idea)
+            WHERE i.ordinal IS NULL
+            WITH i LIMIT $batch_size
+            WITH collect(i) AS ideas
+            WHERE size(ideas) > 0
+            MERGE (s:Sequence {name: "ideaOrdinal"})
+            SET s.value = coalesce(s.value, 0) + size(ideas)
+            WITH ideas, s.value - size(ideas) AS base
+            UNWIND range(0, size(ideas) - 1) AS n
+            WITH ideas[n] AS i, base + n + 1 AS ordinal
+            SET i.ordinal = ordinal
+            RETURN count(i) AS updated
+            """,
+            batch_size=batch_size,
+        ).single()["updated"]
+
+    def trending(tx, batch_size):
+        # Likes have no timestamps, so count them as arriving with the idea
+        return tx.run(
+            """
+            MATCH (i:Idea)
+            WHERE i.trending IS NULL
+            WITH i LIMIT $batch_size
+            SET i.trending = i.createdAt.epochMillis / 1000.0 * $decay
+                + log(1 + coalesce(i.likeCount, 0))
+            RETURN count(i) AS updated
+            """,
+            batch_size=batch_size,
+            decay=trending_decay(),
+        ).single()["updated"]
+
+    migrate(driver, current_app.config.get("SCHEMA_AWAIT_SECONDS"))
 
-    def indices(tx):
-        tx.run(
-            "CREATE FULLTEXT INDEX urlsAndDescriptions IF NOT EXISTS FOR (i:Idea) ON EACH [i.url, i.description]"
-        )
+    with driver.session() as session:
+        while session.execute_write(random_keys, 10000):
+            pass
+        while session.execute_write(ordinals, 10000):
+            pass
+        missing = session.execute_read(missing_counters)
+
+    if missing:
+        rebuild_idea_counters(driver)
 
     with driver.session() as session:
-        session.execute_write(constraints)
-        session.execute_write(indices)
+        while session.execute_write(trending, 10000):
+            pass
 
 
 def seed_db(driver):
     """Set initial values for db"""
     random.seed(0)
-    user1 = register(
-        driver,
+    user1 = with_id(
         {"email": "user1@user1.com", "password": "password1", "username": "user1"},
+        "userId",
     )
-    user2 = register(
-        driver,
+    user2 = with_id(
         {"email": "user2@user2.com", "password": "password2", "username": "user2"},
+        "userId",
     )
-    source1 = add_source(driver, {"name": "Scott Alexander"})
-    source2 = add_source(driver, {"name": "Ross Douthat"})
-    idea1 = add_idea(
-        driver,
+    source1 = with_id({"name": "Scott Alexander"}, "sourceId")
+    source2 = with_id({"name": "Ross Douthat"}, "sourceId")
+    idea1 = with_id(
         {
             "url": "https://slatestarcodex.com/2014/04/22/right-is-the-new-left/",
-            "user_id": user1["userId"],
-            "source_id": source1["sourceId"],
+            "userId": user1["userId"],
+            "sourceId": source1["sourceId"],
             "description": "A theory of social change using cellular automata",
         },
+        "ideaId",
     )
-    idea2 = add_idea(
-        driver,
+    idea2 = with_id(
         {
             "url": "https://www.nytimes.com/2020/02/07/opinion/sunday/western-society-decadence.html",
-            "user_id": user2["userId"],
-            "source_id": source2["sourceId"],
+            "userId": user2["userId"],
+            "sourceId": source2["sourceId"],
             "description": "Western society is more decadent than you think",
         },
+        "ideaId",
     )
-    registered = list(map(partial(register, driver), users))
-    db_sources = list(map(partial(add_source, driver), sources))
-
-    def add_rand_user_and_source(idea: dict) -> IdeaData:
-        return {
-            **idea,
-            "user_id": random.choice(registered)["userId"],
-            "source_id": random.choice(db_sources)["sourceId"],
-        }
+    registered = [with_id(user, "userId") for user in users]
+    db_sources = [with_id(source, "sourceId") for source in sources]
+
+    def add_rand_user_and_source(idea: dict) -> dict:
+        return with_id(
+            {
+                **idea,
+                "userId": random.choice(registered)["userId"],
+                "sourceId": random.choice(db_sources)["sourceId"],
+            },
+            "ideaId",
+        )
 
-    db_ready_ideas = map(add_rand_user_and_source, ideas)
-    db_ideas = list(map(partial(add_idea, driver), db_ready_ideas))
+    db_ideas = [add_rand_user_and_source(idea) for idea in ideas]
 
-    # This will overwrite some stuff, but that's fine for now.
+    # Later reactions to the same idea replace earlier ones
+    reactions = []
     for user in registered:
         for _ in range(10):
             if random.choice([True, False]):
-                like_idea(
-                    driver,
-                    user["userId"],
-                    random.choice(db_ideas)["ideaId"],
-                    random.randint(-3, 3),
+                reactions.append(
+                    {
+                        "userId": user["userId"],
+                        "ideaId": random.choice(db_ideas)["ideaId"],
+                        "type": "like",
+                        "agreement": random.randint(-3, 3),
+                    }
                 )
             else:
-                dislike_idea(driver, user["userId"], random.choice(db_ideas)["ideaId"])
+                reactions.append(
+                    {
+                        "userId": user["userId"],
+                        "ideaId": random.choice(db_ideas)["ideaId"],
+                        "type": "dislike",
+                    }
+                )
+
+    load_rows(driver, "users", [user1, user2, *registered])
+    load_rows(driver, "sources", [source1, source2, *db_sources])
+    load_rows(driver, "ideas", [idea1, idea2, *db_ideas])
+    load_rows(driver, "reactions", reactions)
+    rebuild_derived(driver)
 
 
 def dump_db(driver):
-    extractor = Extractor(
-        project_dir="dev_data",
-        driver=driver,
-        database="neo4j",
-        input_yes=True,
-        compress=True,
-    )
-    extractor.extract_data()
+    """Snapshot the db to dev_data"""
+    export_snapshot(driver, "dev_data")
 
 
 def import_dev_data(driver):
-    importer = Importer(
-        project_dir="dev_data", driver=driver, database="neo4j", input_yes=True
-    )
-    importer.import_data()
+    """Replace the db with the snapshot in dev_data"""
+    restore_snapshot(driver, "dev_data")
 
 
 def reset_db(driver):
-    """Clear and seed db"""
+    """Clear and seed db, or restore it from SEED_SNAPSHOT if that is set"""
+    snapshot = current_app.config.get("SEED_SNAPSHOT")
+    if snapshot:
+        restore_snapshot(driver, snapshot)
+        return
+
     with driver.session() as session:
         session.execute_write(clear_db)
         seed_db(driver)
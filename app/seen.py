@@ -0,0 +1,128 @@
+"""
+Per-user seen sets
+The ideas a user has posted or reacted to, held in each worker as a bitmap of
+idea ordinals. Queries take the ordinals as a parameter, or get filtered in
+Python, instead of expanding the user's relationships for every candidate.
+
+Each user has a seenVersion that every write to their seen set increments.
+A cached set is checked against it before use, and a worker that made the
+write itself patches its cached set instead of reloading it.
+"""
+
+from flask import current_app
+
+try:
+    from pyroaring import BitMap
+except ImportError:
+    BitMap = set
+
+from app.queries import register
+from app.types import SeenUpdate
+
+SEEN_ORDINALS = register(
+    "seen.ordinals",
+    """
+    MATCH (u:User {userId: $user_id})
+    OPTIONAL MATCH (u)-[]->(i:Idea)
+    RETURN coalesce(u.seenVersion, 0) AS version, collect(i.ordinal) AS ordinals
+    """,
+    {"user_id": ""},
+)
+
+SEEN_VERSION = register(
+    "seen.version",
+    """
+    MATCH (u:User {userId: $user_id})
+    RETURN coalesce(u.seenVersion, 0) AS version
+    """,
+    {"user_id": ""},
+)
+
+BUMP_SEEN = register(
+    "seen.bump",
+    """
+    MATCH (u:User {userId: $user_id})
+    SET u.seenVersion = coalesce(u.seenVersion, 0) + 1
+    WITH u
+    OPTIONAL MATCH (i:Idea)
+    WHERE i.ideaId IN $idea_ids
+    RETURN u.seenVersion AS version, collect(i.ordinal) AS ordinals
+    """,
+    {"user_id": "", "idea_ids": [""]},
+    write=True,
+)
+
+
+##############################################################################
+# Transaction functions
+#
+
+
+def seen_ordinals(tx, user_id: str) -> tuple[int, list[int]]:
+    """Transaction function for getting a user's seen version and seen idea ordinals"""
+    result = tx.run(SEEN_ORDINALS, user_id=user_id).single()
+
+    if result is None:
+        return 0, []
+
+    return result["version"], result["ordinals"]
+
+
+def seen_version(tx, user_id: str) -> int:
+    """Transaction function for getting a user's seen version"""
+    result = tx.run(SEEN_VERSION, user_id=user_id).single()
+    return result["version"] if result else 0
+
+
+def bump_seen(tx, user_id: str, idea_ids: list[str]) -> SeenUpdate:
+    """
+    Transaction function for recording that a user has now seen some ideas.
+    Returns what a worker needs to patch its cached seen set.
+    """
+    result = tx.run(BUMP_SEEN, user_id=user_id, idea_ids=idea_ids).single()
+    return {
+        "userId": user_id,
+        "version": result["version"],
+        "ordinals": result["ordinals"],
+    }
+
+
+##############################################################################
+# Main functions
+#
+
+
+def get_seen(driver, user_id: str) -> BitMap:
+    """Get the ordinals of every idea a user has seen"""
+
+    cached = current_app.seen_sets.get(user_id)
+
+    with driver.session() as session:
+        if cached is not None:
+            version, seen = cached
+            if session.execute_read(seen_version, user_id) == version:
+                return seen
+
+        version, ordinals = session.execute_read(seen_ordinals, user_id)
+
+    seen = BitMap(ordinals)
+    current_app.seen_sets.set(user_id, (version, seen))
+    return seen
+
+
+def update_seen(update: SeenUpdate) -> None:
+    """Patch this worker's cached seen set after a write it made"""
+
+    cached = current_app.seen_sets.get(update["userId"])
+    if cached is None:
+        return
+
+    version, seen = cached
+    if version != update["version"] - 1:
+        # Another worker wrote in between; reload on next use
+        current_app.seen_sets.delete(update["userId"])
+        return
+
+    for ordinal in update["ordinals"]:
+        seen.add(ordinal)
+    current_app.seen_sets.set(update["userId"], (update["version"], seen))
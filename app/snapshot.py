@@ -0,0 +1,345 @@
+"""
+Database snapshots
+A snapshot is a directory of gzipped NDJSON files, one or more chunks per
+node label and relationship type, and a manifest.json listing every file
+with its row count and SHA-256 checksum.
+
+Exports stream each label and type in key order, so memory use does not grow
+with the graph and the same graph always gives the same files. Restores
+check every checksum first, then load the chunks in parallel batches: all
+nodes, then all relationships.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+from neo4j.time import Date, DateTime
+
+from app.loader import batched
+
+SNAPSHOT_VERSION = 1
+
+MANIFEST = "manifest.json"
+
+# Every node label with the property that identifies its nodes
+NODES = {
+    "User": "userId",
+    "Source": "sourceId",
+    "Idea": "ideaId",
+    "Sequence": "name",
+    "ReactionEvent": "seq",
+}
+
+# Every relationship type with the labels of its start and end nodes
+RELATIONSHIPS = {
+    "POSTED": ("User", "Idea"),
+    "AUTHORED": ("Source", "Idea"),
+    "LIKES": ("User", "Idea"),
+    "DISLIKES": ("User", "Idea"),
+    "CORATES": ("User", "User"),
+    "SIMILAR": ("User", "User"),
+}
+
+
+class SnapshotError(Exception):
+    """A snapshot is missing files, or a file does not match its checksum"""
+
+
+class ChunkWriter:
+    """Writes rows to numbered gzipped NDJSON files of up to chunk_size rows"""
+
+    def __init__(self, directory: str, prefix: str, chunk_size: int):
+        self.directory = directory
+        self.prefix = prefix
+        self.chunk_size = chunk_size
+        self.entries = []
+        self.file = None
+        self.rows = 0
+
+    def reset(self) -> None:
+        """Start over, for when a transaction is retried"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        for entry in self.entries:
+            os.remove(os.path.join(self.directory, entry["name"]))
+        self.entries = []
+
+    def write(self, row: dict) -> None:
+        if self.file is None or self.rows == self.chunk_size:
+            self.next_chunk()
+        self.file.write(json.dumps(row, sort_keys=True, separators=(",", ":")))
+        self.file.write("\n")
+        self.rows += 1
+
+    def next_chunk(self) -> None:
+        self.finish_chunk()
+        name = f"{self.prefix}-{len(self.entries):04d}.ndjson.gz"
+        self.entries.append({"name": name})
+        # A fixed mtime keeps the same rows giving the same bytes
+        raw = gzip.GzipFile(os.path.join(self.directory, name), "wb", mtime=0)
+        self.file = io.TextIOWrapper(raw, encoding="utf8")
+        self.rows = 0
+
+    def finish_chunk(self) -> None:
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        entry = self.entries[-1]
+        entry["rows"] = self.rows
+        entry["sha256"] = file_checksum(os.path.join(self.directory, entry["name"]))
+
+    def close(self) -> list[dict]:
+        """Finish the last chunk and describe every chunk written"""
+        self.finish_chunk()
+        return self.entries
+
+
+##############################################################################
+# Transaction functions
+#
+
+
+def write_nodes(tx, label: str, chunks: ChunkWriter) -> None:
+    """Transaction function for streaming every node with a label to chunks"""
+    result = tx.run(
+        f"""
+        MATCH (n:{label})
+        WHERE n.{NODES[label]} IS NOT NULL
+        RETURN properties(n) AS props
+        ORDER BY n.{NODES[label]}
+        """
+    )
+    chunks.reset()
+    for row in result:
+        chunks.write(encode(row["props"]))
+
+
+def write_relationships(tx, type: str, chunks: ChunkWriter) -> None:
+    """Transaction function for streaming every relationship of a type to chunks"""
+    start, end = RELATIONSHIPS[type]
+    result = tx.run(
+        f"""
+        MATCH (a:{start})-[r:{type}]->(b:{end})
+        RETURN a.{NODES[start]} AS startKey, b.{NODES[end]} AS endKey,
+            properties(r) AS props
+        ORDER BY startKey, endKey
+        """
+    )
+    chunks.reset()
+    for row in result:
+        chunks.write(
+            {
+                "start": row["startKey"],
+                "end": row["endKey"],
+                "props": encode(row["props"]),
+            }
+        )
+
+
+def create_nodes(tx, label: str, rows: list[dict]) -> None:
+    """Transaction function for restoring a batch of nodes"""
+    tx.run(
+        f"""
+        UNWIND $rows AS props
+        CREATE (n:{label})
+        SET n = props
+        """,
+        rows=rows,
+    )
+
+
+def create_relationships(tx, type: str, rows: list[dict]) -> None:
+    """Transaction function for restoring a batch of relationships"""
+    start, end = RELATIONSHIPS[type]
+    tx.run(
+        f"""
+        UNWIND $rows AS row
+        MATCH (a:{start} {{{NODES[start]}: row.start}})
+        MATCH (b:{end} {{{NODES[end]}: row.end}})
+        CREATE (a)-[r:{type}]->(b)
+        SET r = row.props
+        """,
+        rows=rows,
+    )
+
+
+def delete_batch(tx, batch_size: int) -> int:
+    """
+    Transaction function for deleting a batch of nodes and their relationships,
+    keeping the record of the schema
+    """
+    return tx.run(
+        """
+        MATCH (n)
+        WHERE NOT n:Migration
+        WITH n LIMIT $batch_size
+        DETACH DELETE n
+        RETURN count(*) AS deleted
+        """,
+        batch_size=batch_size,
+    ).single()["deleted"]
+
+
+##############################################################################
+# Main functions
+#
+
+
+def export_snapshot(driver, directory: str, chunk_size=100000) -> dict:
+    """Write the whole graph to a snapshot in directory. Returns its manifest."""
+
+    os.makedirs(directory, exist_ok=True)
+    files = []
+
+    with driver.session() as session:
+        for label in NODES:
+            chunks = ChunkWriter(directory, f"nodes-{label}", chunk_size)
+            session.execute_read(write_nodes, label, chunks)
+            files += [{**entry, "label": label} for entry in chunks.close()]
+
+        for type in RELATIONSHIPS:
+            chunks = ChunkWriter(directory, f"relationships-{type}", chunk_size)
+            session.execute_read(write_relationships, type, chunks)
+            files += [{**entry, "type": type} for entry in chunks.close()]
+
+    manifest = {"version": SNAPSHOT_VERSION, "files": files}
+    with open(os.path.join(directory, MANIFEST), "w", encoding="utf8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+    return manifest
+
+
+def restore_snapshot(driver, directory: str, batch_size=5000, workers=4) -> dict:
+    """
+    Replace everything in the database with a snapshot. Raises SnapshotError,
+    before touching the database, if any file is missing or altered.
+    Returns the number of nodes and relationships restored.
+    """
+
+    manifest = read_manifest(directory)
+    started = time.perf_counter()
+
+    clear(driver, batch_size)
+
+    def restore(entry: dict) -> int:
+        path = os.path.join(directory, entry["name"])
+        with driver.session() as session:
+            for rows in batched(read_chunk(path), batch_size):
+                if "label" in entry:
+                    session.execute_write(create_nodes, entry["label"], rows)
+                else:
+                    session.execute_write(create_relationships, entry["type"], rows)
+        return entry["rows"]
+
+    # Relationships need both their nodes, so every node goes in first
+    nodes = [entry for entry in manifest["files"] if "label" in entry]
+    relationships = [entry for entry in manifest["files"] if "type" in entry]
+
+    with ThreadPoolExecutor(workers) as executor:
+        restored_nodes = sum(executor.map(restore, nodes))
+        restored_relationships = sum(executor.map(restore, relationships))
+
+    return {
+        "nodes": restored_nodes,
+        "relationships": restored_relationships,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def read_manifest(directory: str) -> dict:
+    """Read a snapshot's manifest and check every file against it"""
+
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf8") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        raise SnapshotError(f"{directory} has no {MANIFEST}")
+
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unknown snapshot version {manifest.get('version')}")
+
+    for entry in manifest["files"]:
+        if entry.get("label") not in NODES and entry.get("type") not in RELATIONSHIPS:
+            raise SnapshotError(f"{entry['name']} holds nothing this app stores")
+
+        path = os.path.join(directory, entry["name"])
+        try:
+            checksum = file_checksum(path)
+        except FileNotFoundError:
+            raise SnapshotError(f"{entry['name']} is missing")
+
+        if checksum != entry["sha256"]:
+            raise SnapshotError(f"{entry['name']} does not match its checksum")
+
+    return manifest
+
+
+def clear(driver, batch_size=5000) -> None:
+    """Delete everything in the database but its schema, a batch at a time"""
+
+    with driver.session() as session:
+        while session.execute_write(delete_batch, batch_size):
+            pass
+
+
+##############################################################################
+# Helper functions
+#
+
+
+def read_chunk(path: str) -> Iterator[dict]:
+    """Stream the rows of a chunk, decoding temporal values"""
+    with gzip.open(path, "rt", encoding="utf8") as file:
+        for line in file:
+            row = json.loads(line)
+            if "props" in row:
+                yield {**row, "props": decode(row["props"])}
+            else:
+                yield decode(row)
+
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while block := file.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def encode(props: dict) -> dict:
+    """Make property values JSON-safe, tagging dates and datetimes"""
+    return {key: encode_value(value) for key, value in props.items()}
+
+
+def encode_value(value):
+    if isinstance(value, DateTime):
+        return {"$datetime": value.iso_format()}
+    if isinstance(value, Date):
+        return {"$date": value.iso_format()}
+    if isinstance(value, list):
+        return [encode_value(item) for item in value]
+    return value
+
+
+def decode(props: dict) -> dict:
+    """Turn tagged property values back into dates and datetimes"""
+    return {key: decode_value(value) for key, value in props.items()}
+
+
+def decode_value(value):
+    if isinstance(value, dict) and "$datetime" in value:
+        return DateTime.from_iso_format(value["$datetime"])
+    if isinstance(value, dict) and "$date" in value:
+        return Date.from_iso_format(value["$date"])
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    return value
@@ -35,6 +35,11 @@ class IdeaWithScore(TypedDict):
     ideaId: str
 
 
+class RankedIdea(TypedDict):
+    ordinal: int
+    idea: IdeaWithScore
+
+
 class IdeaWithAnonReactions(TypedDict):
     createdAt: str
     description: str
@@ -57,6 +62,22 @@ class IdeaWithAllReactions(TypedDict):
     postedBy: str
 
 
+class ReactionHistogram(TypedDict):
+    likes: int
+    dislikes: int
+    agreement: dict[int, int]
+
+
+class IdeaWithHistogram(TypedDict):
+    createdAt: str
+    description: str
+    url: str
+    ideaId: str
+    userReaction: str
+    userAgreement: int | None
+    histogram: ReactionHistogram
+
+
 class User(TypedDict):
     userId: str
     email: str
@@ -64,6 +85,13 @@ class User(TypedDict):
     password: str
 
 
+class Profile(TypedDict):
+    userId: str
+    email: str
+    username: str
+    profileVersion: int
+
+
 class UserData(TypedDict):
     userId: str
     email: str
@@ -74,8 +102,77 @@ class UserToken(TypedDict):
     userId: str
     email: str
     username: str
+    profileVersion: int
     sub: str
     iat: str
     nbf: str
     exp: str
     token: str
+
+
+class Reaction(TypedDict):
+    type: str
+    agreement: int | None
+
+
+class ReactionRequest(TypedDict):
+    ideaId: str
+    type: str
+    agreement: int | None
+
+
+class ReactionResult(TypedDict):
+    ideaId: str
+    type: str
+    agreement: int | None
+    status: str
+
+
+class LoadReport(TypedDict):
+    kind: str
+    read: int
+    written: int
+    seconds: float
+    rowsPerSecond: float
+
+
+class ReactionChange(TypedDict):
+    ideaId: str
+    previousType: str | None
+    previousAgreement: int | None
+    type: str | None
+    agreement: int | None
+
+
+class ReactionEvent(TypedDict):
+    seq: int
+    userId: str
+    ideaId: str
+    type: str
+    agreement: int | None
+
+
+class SeenUpdate(TypedDict):
+    userId: str
+    version: int
+    ordinals: list[int]
+
+
+class Migration(TypedDict):
+    version: int
+    name: str
+    statements: tuple[str, ...]
+
+
+class RegisteredQuery(TypedDict):
+    name: str
+    text: str
+    write: bool
+    hot: bool
+    allow: tuple[str, ...]
+    sample: dict
+
+
+class PlanProblem(TypedDict):
+    query: str
+    operators: list[str]
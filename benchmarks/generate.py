@@ -0,0 +1,185 @@
+"""
+Generate a synthetic graph for `flask load-data`, with the skew of real use:
+a few users react far more than most, a few ideas draw most reactions, and
+each user leans towards agreeing or disagreeing.
+
+    python -m benchmarks.generate --reactions 1000000 --out data/1m
+    flask load-data --users data/1m/users.jsonl.gz --sources data/1m/sources.jsonl.gz \
+        --ideas data/1m/ideas.jsonl.gz --reactions data/1m/reactions.jsonl.gz --cheap-hash
+
+Users are user<n>@bench.example with password password<n>. The same arguments
+always give the same graph.
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+WORDS = (
+    "liberty equality markets climate virtue progress tradition science faith "
+    "democracy decadence automation education housing cities borders growth "
+    "inequality privacy speech history religion family technology nature "
+    "labour capital empire reform revolution culture media trust health"
+).split()
+
+# Zipf exponent for idea popularity and description words
+IDEA_SKEW = 1.1
+
+# Pareto shape for how many reactions each user makes
+USER_SKEW = 1.5
+
+KINDS = ("users", "sources", "ideas", "reactions")
+
+
+def scale(reactions: int) -> dict:
+    """Users, sources and ideas in proportion to a number of reactions"""
+    ideas = max(10, reactions // 20)
+    return {
+        "users": max(10, reactions // 100),
+        "sources": max(5, ideas // 50),
+        "ideas": ideas,
+        "reactions": reactions,
+    }
+
+
+def generate(
+    out: str, users: int, sources: int, ideas: int, reactions: int, seed=0
+) -> dict[str, dict]:
+    """
+    Write users, sources, ideas and reactions files to out.
+    Returns the path of each and how many rows it holds.
+    """
+
+    os.makedirs(out, exist_ok=True)
+    rng = random.Random(seed)
+    paths = {kind: os.path.join(out, f"{kind}.jsonl.gz") for kind in KINDS}
+    rows = {}
+
+    user_ids = [f"bench-user-{n}" for n in range(users)]
+    source_ids = [f"bench-source-{n}" for n in range(sources)]
+    idea_ids = [f"bench-idea-{n}" for n in range(ideas)]
+
+    rows["users"] = write(
+        paths["users"],
+        (
+            {
+                "userId": user_id,
+                "email": f"user{n}@bench.example",
+                "username": f"user{n}",
+                "password": f"password{n}",
+            }
+            for n, user_id in enumerate(user_ids)
+        ),
+    )
+
+    rows["sources"] = write(
+        paths["sources"],
+        (
+            {"sourceId": source_id, "name": f"Source {n}"}
+            for n, source_id in enumerate(source_ids)
+        ),
+    )
+
+    # A few users post most ideas, just as they react the most
+    posters = zipf_weights(users, IDEA_SKEW)
+    word_weights = zipf_weights(len(WORDS), IDEA_SKEW)
+    start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    span = timedelta(days=365).total_seconds()
+    rows["ideas"] = write(
+        paths["ideas"],
+        (
+            {
+                "ideaId": idea_id,
+                "userId": rng.choices(user_ids, cum_weights=posters)[0],
+                "sourceId": rng.choice(source_ids),
+                "url": f"https://example.com/ideas/{n}",
+                "description": " ".join(
+                    rng.choices(WORDS, cum_weights=word_weights, k=rng.randint(5, 20))
+                ),
+                "createdAt": (
+                    start + timedelta(seconds=span * n / ideas)
+                ).isoformat(),
+            }
+            for n, idea_id in enumerate(idea_ids)
+        ),
+    )
+
+    popularity = zipf_weights(ideas, IDEA_SKEW)
+    activity = [rng.paretovariate(USER_SKEW) for _ in user_ids]
+    total = sum(activity)
+
+    def user_reactions():
+        for user_id, weight in zip(user_ids, activity):
+            count = min(ideas // 2, max(1, round(reactions * weight / total)))
+            # Some users agree with most of what they like, some with little
+            lean = rng.gauss(0, 1.5)
+            chosen = set()
+            for _ in range(3):
+                chosen.update(
+                    rng.choices(idea_ids, cum_weights=popularity, k=count - len(chosen))
+                )
+            if len(chosen) < count:
+                # Heavy users run out of popular ideas; fill up from the rest
+                rest = [idea_id for idea_id in idea_ids if idea_id not in chosen]
+                chosen.update(rng.sample(rest, count - len(chosen)))
+            for idea_id in sorted(chosen):
+                if rng.random() < 0.7:
+                    agreement = max(-3, min(3, round(rng.gauss(lean, 1.5))))
+                    yield {
+                        "userId": user_id,
+                        "ideaId": idea_id,
+                        "type": "like",
+                        "agreement": agreement,
+                    }
+                else:
+                    yield {"userId": user_id, "ideaId": idea_id, "type": "dislike"}
+
+    rows["reactions"] = write(paths["reactions"], user_reactions())
+
+    return {kind: {"path": paths[kind], "rows": rows[kind]} for kind in KINDS}
+
+
+def zipf_weights(n: int, skew: float) -> list[float]:
+    """Cumulative weights of a Zipf distribution over n ranks, for random.choices"""
+    return list(itertools.accumulate(1 / rank**skew for rank in range(1, n + 1)))
+
+
+def write(path: str, rows) -> int:
+    """Write rows to a gzipped JSONL file. Returns how many there were."""
+    count = 0
+    # A fixed mtime keeps the same rows giving the same bytes
+    with gzip.GzipFile(path, "wb", mtime=0) as file:
+        for row in rows:
+            file.write((json.dumps(row, separators=(",", ":")) + "\n").encode("utf8"))
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--reactions", type=int, default=100000)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--sources", type=int)
+    parser.add_argument("--ideas", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    sizes = scale(args.reactions)
+    for kind in ("users", "sources", "ideas"):
+        if getattr(args, kind):
+            sizes[kind] = getattr(args, kind)
+
+    files = generate(args.out, seed=args.seed, **sizes)
+    for kind, file in files.items():
+        print(f"{file['rows']:>9} {kind:<10} {file['path']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+"""
+Load test every API route with a mix of traffic like real use, and report
+throughput and latency percentiles per route.
+
+Each simulated user logs in as one of the users made by benchmarks.generate,
+then keeps picking actions by weight (see MIX): fetching unseen ideas and
+reacting to them most of the time, asking for recommendations, browsing
+listings and their history, and now and then posting, deleting, signing up
+or editing their profile.
+
+Against a server that is already running:
+
+    python -m benchmarks.load --url http://localhost:5000 --users 1000
+
+To size gunicorn workers, let it start gunicorn.config.py for each worker
+count in turn, against NEO4J_URI:
+
+    python -m benchmarks.load --workers 2,4,8,16 --users 1000
+
+Pass --populate with a number of reactions to first replace the database
+with a generated graph of that size. That deletes everything in it, so it
+also needs --scratch.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import tempfile
+import time
+import urllib.request
+import uuid
+from urllib.parse import urlsplit
+
+from flask import current_app
+
+from app import create_app
+from benchmarks import models
+from benchmarks.generate import scale
+from benchmarks.serving import send
+
+# How often each action is picked, relative to the others
+MIX = {
+    "random_unseen": 20,
+    "react": 15,
+    "agreeable": 8,
+    "disagreeable": 8,
+    "list_ideas": 6,
+    "viewed_with_relationships": 6,
+    "idea_details": 5,
+    "recommendations": 4,
+    "popular": 4,
+    "trending": 4,
+    "random": 3,
+    "viewed": 3,
+    "idea_reactions": 3,
+    "get_user": 3,
+    "login": 3,
+    "posted": 2,
+    "react_batch": 2,
+    "post_idea": 1,
+    "delete_idea": 1,
+    "signup": 0.5,
+    "edit_user": 0.5,
+}
+
+PERCENTILES = (50, 95, 99)
+
+
+class Session:
+    """One simulated user, with its own connection and what it has seen"""
+
+    def __init__(self, url: str, users: int, rng: random.Random):
+        self.parts = urlsplit(url)
+        self.rng = rng
+        self.n = rng.randrange(users)
+        self.connection = None
+        self.token = None
+        self.user_id = None
+        self.ideas = []
+        self.own_ideas = []
+        self.samples = []
+
+    async def call(
+        self, route: str, method: str, path: str, body: dict | None = None
+    ) -> dict | None:
+        """Make a request, recording its latency under route. Returns its JSON."""
+
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = await asyncio.open_connection(
+                    self.parts.hostname, self.parts.port
+                )
+            status, keep_alive, payload = await send(
+                *self.connection, self.parts.netloc, method, path, self.token, body
+            )
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.samples.append((route, None, time.perf_counter() - started))
+            self.connection = None
+            return None
+
+        self.samples.append((route, status, time.perf_counter() - started))
+
+        if not keep_alive:
+            self.connection[1].close()
+            self.connection = None
+
+        try:
+            return json.loads(payload) if status < 400 else None
+        except ValueError:
+            return None
+
+    def idea(self) -> str | None:
+        return self.rng.choice(self.ideas) if self.ideas else None
+
+    def remember(self, response: dict | None, key="idea") -> None:
+        if response and response.get(key):
+            self.ideas = (self.ideas + [response[key]["ideaId"]])[-50:]
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection[1].close()
+
+    async def login(self):
+        response = await self.call(
+            "POST /api/users/login",
+            "POST",
+            "/api/users/login",
+            {"email": f"user{self.n}@bench.example", "password": f"password{self.n}"},
+        )
+        if response:
+            self.token = response["user"]["token"]
+            self.user_id = response["user"]["userId"]
+
+    async def random_unseen(self):
+        self.remember(
+            await self.call(
+                "GET /api/ideas/random-unseen", "GET", "/api/ideas/random-unseen"
+            )
+        )
+
+    async def react(self):
+        idea_id = self.idea()
+        if idea_id is None:
+            return await self.random_unseen()
+
+        if self.rng.random() < 0.7:
+            body = {"type": "like", "agreement": self.rng.randint(-3, 3)}
+        else:
+            body = {"type": "dislike"}
+        await self.call(
+            "POST /api/ideas/<id>/react", "POST", f"/api/ideas/{idea_id}/react", body
+        )
+
+    async def react_batch(self):
+        if not self.ideas:
+            return await self.list_ideas()
+
+        reactions = [
+            {"ideaId": idea_id, "type": "like", "agreement": self.rng.randint(-3, 3)}
+            for idea_id in self.rng.sample(self.ideas, min(5, len(self.ideas)))
+        ]
+        await self.call(
+            "POST /api/ideas/reactions",
+            "POST",
+            "/api/ideas/reactions",
+            {"reactions": reactions},
+        )
+
+    async def agreeable(self):
+        self.remember(
+            await self.call("GET /api/ideas/agreeable", "GET", "/api/ideas/agreeable")
+        )
+
+    async def disagreeable(self):
+        self.remember(
+            await self.call(
+                "GET /api/ideas/disagreeable", "GET", "/api/ideas/disagreeable"
+            )
+        )
+
+    async def recommendations(self):
+        await self.call(
+            "GET /api/ideas/recommendations", "GET", "/api/ideas/recommendations"
+        )
+
+    async def popular(self):
+        self.remember(
+            await self.call("GET /api/ideas/popular", "GET", "/api/ideas/popular")
+        )
+
+    async def trending(self):
+        self.remember(
+            await self.call("GET /api/ideas/trending", "GET", "/api/ideas/trending")
+        )
+
+    async def list_ideas(self):
+        sort = self.rng.choice(["createdAt", "likeCount", "trending"])
+        response = await self.call(
+            "GET /api/ideas/", "GET", f"/api/ideas/?sort={sort}&limit=20"
+        )
+        if response:
+            for idea in response["ideas"][:5]:
+                self.remember({"idea": idea})
+
+    async def random(self):
+        self.remember(
+            await self.call("GET /api/ideas/random", "GET", "/api/ideas/random")
+        )
+
+    async def viewed(self):
+        await self.call("GET /api/ideas/viewed", "GET", "/api/ideas/viewed")
+
+    async def viewed_with_relationships(self):
+        await self.call(
+            "GET /api/ideas/viewed-with-relationships",
+            "GET",
+            "/api/ideas/viewed-with-relationships",
+        )
+
+    async def idea_details(self):
+        idea_id = self.idea()
+        if idea_id is None:
+            return await self.random()
+        await self.call(
+            "GET /api/ideas/<id>",
+            "GET",
+            f"/api/ideas/{idea_id}?with-reactions=true&with-user-reaction=true",
+        )
+
+    async def idea_reactions(self):
+        idea_id = self.idea()
+        if idea_id is None:
+            return await self.random()
+        await self.call(
+            "GET /api/ideas/<id>/reactions", "GET", f"/api/ideas/{idea_id}/reactions"
+        )
+
+    async def posted(self):
+        await self.call(
+            "GET /api/ideas/user/<id>", "GET", f"/api/ideas/user/{self.user_id}"
+        )
+
+    async def get_user(self):
+        await self.call("GET /api/users/<id>", "GET", f"/api/users/{self.user_id}")
+
+    async def post_idea(self):
+        response = await self.call(
+            "POST /api/ideas/",
+            "POST",
+            "/api/ideas/",
+            {
+                "url": f"https://example.com/load/{uuid.uuid4()}",
+                "description": "Posted by the load test",
+            },
+        )
+        if response:
+            self.own_ideas.append(response["idea"]["ideaId"])
+
+    async def delete_idea(self):
+        if not self.own_ideas:
+            return await self.post_idea()
+        await self.call(
+            "DELETE /api/ideas/<id>", "DELETE", f"/api/ideas/{self.own_ideas.pop()}"
+        )
+
+    async def signup(self):
+        name = f"load-{uuid.uuid4().hex[:12]}"
+        await self.call(
+            "POST /api/users/signup",
+            "POST",
+            "/api/users/signup",
+            {"email": f"{name}@load.example", "username": name, "password": name},
+        )
+
+    async def edit_user(self):
+        response = await self.call(
+            "PATCH /api/users/<id>",
+            "PATCH",
+            f"/api/users/{self.user_id}",
+            {"currentPassword": f"password{self.n}", "newUsername": f"user{self.n}"},
+        )
+        if response:
+            self.token = response["user"]["token"]
+
+
+async def simulate(session: Session, until: float) -> None:
+    """Log in, then act until the deadline"""
+
+    actions, weights = zip(*MIX.items())
+
+    while session.token is None and time.perf_counter() < until:
+        await session.login()
+
+    while time.perf_counter() < until:
+        action = session.rng.choices(actions, weights)[0]
+        await getattr(session, action)()
+
+    session.close()
+
+
+async def run(
+    url: str, users: int, concurrency: int, duration: float, seed: int
+) -> tuple[list, float]:
+    """Run concurrency simulated users for duration seconds"""
+
+    rng = random.Random(seed)
+    sessions = [
+        Session(url, users, random.Random(rng.random())) for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(s, started + duration) for s in sessions))
+    elapsed = time.perf_counter() - started
+
+    return [sample for session in sessions for sample in session.samples], elapsed
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    """Throughput, errors and latency percentiles per route, and over all routes"""
+
+    by_route = {}
+    for route, status, latency in samples:
+        by_route.setdefault(route, []).append((status, latency))
+    by_route["all"] = [(status, latency) for _, status, latency in samples]
+
+    summary = {}
+    for route, results in by_route.items():
+        latencies = sorted(latency * 1000 for _, latency in results)
+        if not latencies:
+            continue
+        summary[route] = {
+            "requests": len(results),
+            "rps": len(results) / elapsed,
+            "errors": sum(status is None or status >= 500 for status, _ in results),
+            "rejected": sum(
+                status is not None and 400 <= status < 500 for status, _ in results
+            ),
+            **{
+                f"p{p}": latencies[int(p / 100 * (len(latencies) - 1))]
+                for p in PERCENTILES
+            },
+            "max": latencies[-1],
+        }
+    return summary
+
+
+def report(label: str, summary: dict) -> None:
+    print(f"\n{label}")
+    print(
+        f"{'route':<44} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'errors':>7} {'4xx':>6}"
+    )
+    routes = sorted(route for route in summary if route != "all") + ["all"]
+    for route in routes:
+        row = summary[route]
+        print(
+            f"{route:<44} {row['rps']:>8.1f} {row['p50']:>8.1f} {row['p95']:>8.1f} "
+            f"{row['p99']:>8.1f} {row['errors']:>7} {row['rejected']:>6}"
+        )
+
+
+def serve(workers: int, port: int) -> subprocess.Popen:
+    """Start gunicorn with a number of workers, and wait until it answers"""
+
+    server = subprocess.Popen(
+        [
+            "gunicorn",
+            "-c",
+            "gunicorn.config.py",
+            "--bind",
+            f"127.0.0.1:{port}",
+            "wsgi:app",
+        ],
+        env={**os.environ, "GUNICORN_WORKERS": str(workers)},
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited before it was ready")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/ideas/random"):
+                return server
+        except OSError:
+            time.sleep(0.5)
+
+    stop(server)
+    raise RuntimeError("gunicorn did not answer within 60 seconds")
+
+
+def stop(server: subprocess.Popen) -> None:
+    server.send_signal(signal.SIGTERM)
+    server.wait()
+
+
+def populate(reactions: int) -> int:
+    """Replace the database with a generated graph. Returns how many users it has."""
+
+    sizes = scale(reactions)
+    with create_app().app_context(), tempfile.TemporaryDirectory() as directory:
+        seconds = models.populate(current_app.driver, sizes, directory)
+        current_app.driver.close()
+
+    print(f"Loaded {reactions} reactions for {sizes['users']} users in {seconds:.0f}s")
+    return sizes["users"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Load a server that is already running")
+    target.add_argument("--workers", help="Comma separated gunicorn worker counts")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--warmup", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--populate", type=int, metavar="REACTIONS")
+    parser.add_argument("--scratch", action="store_true")
+    parser.add_argument("--out", help="Write the summaries to this JSON file")
+    args = parser.parse_args()
+
+    if args.populate and not args.scratch:
+        parser.error("--populate deletes the whole database; pass --scratch to confirm")
+
+    # Serve NEO4J_URI as it is, rather than reseeding it like a debug app
+    os.environ.setdefault("FLASK_DEBUG", "false")
+    os.environ.setdefault("NEO4J_URI", "neo4j://localhost:7687")
+    os.environ.setdefault("NEO4J_USERNAME", "neo4j")
+    os.environ.setdefault("NEO4J_PASSWORD", "test")
+
+    users = populate(args.populate) if args.populate else args.users
+
+    def measure(url: str) -> dict:
+        asyncio.run(run(url, users, args.concurrency, args.warmup, args.seed))
+        samples, elapsed = asyncio.run(
+            run(url, users, args.concurrency, args.duration, args.seed + 1)
+        )
+        return summarize(samples, elapsed)
+
+    summaries = {}
+    if args.url:
+        summaries[args.url] = measure(args.url)
+        report(f"{args.url}, {args.concurrency} clients", summaries[args.url])
+    else:
+        for workers in (int(n) for n in args.workers.split(",")):
+            server = serve(workers, args.port)
+            try:
+                summary = measure(f"http://127.0.0.1:{args.port}")
+            finally:
+                stop(server)
+            summaries[f"{workers} workers"] = summary
+            report(f"{workers} workers, {args.concurrency} clients", summary)
+
+        print(f"\n{'workers':<10} {'req/s':>8} {'p95 ms':>8} {'errors':>7}")
+        for label, summary in summaries.items():
+            total = summary["all"]
+            print(
+                f"{label.split()[0]:<10} {total['rps']:>8.1f} "
+                f"{total['p95']:>8.1f} {total['errors']:>7}"
+            )
+
+    if args.out:
+        with open(args.out, "w", encoding="utf8") as file:
+            json.dump(summaries, file, indent=2)
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Time every public model function against generated graphs of several sizes,
+and compare the results with an earlier run to catch regressions.
+
+This deletes everything in the target database. Point it at a scratch
+database and pass --scratch to confirm:
+
+    NEO4J_URI=neo4j://localhost:7687 python -m benchmarks.models --scratch \
+        --sizes 10000,100000,1000000 --out bench.json
+    git checkout my-branch
+    python -m benchmarks.models --scratch --out new.json --compare bench.json
+
+Sizes are numbers of reactions; users, sources and ideas scale with them (see
+benchmarks.generate). Each call picks a random user or idea, so a run mixes
+users whose seen sets are cached with users whose are not.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from flask import current_app
+
+from app import create_app
+from app.loader import load_files
+from app.models.idea import (
+    all_ideas,
+    find_ideas,
+    random_idea,
+    random_unseen_idea,
+    popular_unseen_idea,
+    trending_unseen_idea,
+    get_disagreeable_idea,
+    get_agreeable_idea,
+    get_idea_rankings,
+    search_ideas,
+    get_liked_ideas,
+    get_disliked_ideas,
+    get_seen_ideas,
+    stream_seen_ideas,
+    get_all_seen_ideas_with_user_and_aggregate_reactions,
+    get_idea_details,
+    get_posted_ideas,
+    like_idea,
+    dislike_idea,
+    react_to_ideas,
+)
+from app.models.similarity import update_stale_similarities
+from app.models.source import all_sources, find_source
+from app.models.user import get_profile
+from app.snapshot import clear
+from benchmarks.generate import WORDS, generate, scale
+from benchmarks.random_sampling import timed
+
+
+class Picker:
+    """Random arguments for the model functions, the same on every run"""
+
+    def __init__(self, sizes: dict, seed=0):
+        self.rng = random.Random(seed)
+        self.sizes = sizes
+
+    def user(self) -> str:
+        return f"bench-user-{self.rng.randrange(self.sizes['users'])}"
+
+    def idea(self) -> str:
+        return f"bench-idea-{self.rng.randrange(self.sizes['ideas'])}"
+
+    def source(self) -> str:
+        return f"Source {self.rng.randrange(self.sizes['sources'])}"
+
+    def word(self) -> str:
+        return self.rng.choice(WORDS)
+
+    def reactions(self, n: int) -> list[dict]:
+        return [
+            {
+                "ideaId": self.idea(),
+                "type": "LIKES",
+                "agreement": self.rng.randint(-3, 3),
+            }
+            for _ in range(n)
+        ]
+
+
+# Reads first: the writes at the end change the graph
+CASES = {
+    "all_ideas(createdAt)": lambda d, p: all_ideas(d),
+    "all_ideas(likeCount)": lambda d, p: all_ideas(d, "likeCount"),
+    "all_ideas(trending)": lambda d, p: all_ideas(d, "trending"),
+    "find_ideas": lambda d, p: find_ideas(d, [p.idea() for _ in range(20)]),
+    "random_idea": lambda d, p: random_idea(d),
+    "random_unseen_idea": lambda d, p: random_unseen_idea(d, p.user()),
+    "popular_unseen_idea": lambda d, p: popular_unseen_idea(d, p.user()),
+    "trending_unseen_idea": lambda d, p: trending_unseen_idea(d, p.user()),
+    "get_disagreeable_idea": lambda d, p: get_disagreeable_idea(d, p.user()),
+    "get_agreeable_idea": lambda d, p: get_agreeable_idea(d, p.user()),
+    "get_idea_rankings": lambda d, p: get_idea_rankings(d, p.user()),
+    "search_ideas": lambda d, p: search_ideas(d, p.word()),
+    "get_liked_ideas": lambda d, p: get_liked_ideas(d, p.user()),
+    "get_disliked_ideas": lambda d, p: get_disliked_ideas(d, p.user()),
+    "get_seen_ideas": lambda d, p: get_seen_ideas(d, p.user()),
+    "stream_seen_ideas": lambda d, p: sum(1 for _ in stream_seen_ideas(d, p.user())),
+    "get_all_seen_ideas_with_user_and_aggregate_reactions": lambda d, p: (
+        get_all_seen_ideas_with_user_and_aggregate_reactions(d, p.user())
+    ),
+    "get_idea_details": lambda d, p: get_idea_details(d, p.idea()),
+    "get_idea_details(reactions)": lambda d, p: get_idea_details(
+        d, p.idea(), True, p.user()
+    ),
+    "get_posted_ideas": lambda d, p: get_posted_ideas(d, p.user()),
+    "get_profile": lambda d, p: get_profile(d, p.user()),
+    "all_sources": lambda d, p: all_sources(d),
+    "find_source": lambda d, p: find_source(d, p.source()),
+    "like_idea": lambda d, p: like_idea(d, p.user(), p.idea(), 2),
+    "dislike_idea": lambda d, p: dislike_idea(d, p.user(), p.idea()),
+    "react_to_ideas(20)": lambda d, p: react_to_ideas(d, p.user(), p.reactions(20)),
+}
+
+
+def populate(driver, sizes: dict, directory: str) -> float:
+    """Replace the database with a generated graph. Returns the seconds it took."""
+
+    started = time.perf_counter()
+    files = generate(directory, **sizes)
+
+    clear(driver)
+    load_files(
+        driver, {kind: file["path"] for kind, file in files.items()}, cheap_hash=True
+    )
+    update_stale_similarities(
+        driver,
+        k=current_app.config.get("SIMILARITY_NEIGHBOURS"),
+        min_overlap=current_app.config.get("SIMILARITY_MIN_OVERLAP"),
+    )
+
+    for cache in (current_app.seen_sets, current_app.profiles, current_app.rankings):
+        cache.clear()
+
+    return time.perf_counter() - started
+
+
+def compare(results: list[dict], baseline: dict, threshold: float) -> bool:
+    """Print how each median moved against a baseline. Returns whether any regressed."""
+
+    before = {
+        (result["reactions"], result["function"]): result
+        for result in baseline["results"]
+    }
+    regressed = False
+
+    print(f"\nAgainst {baseline.get('commit', 'baseline')}:")
+    for result in results:
+        old = before.get((result["reactions"], result["function"]))
+        if old is None or not old["median"]:
+            continue
+        ratio = result["median"] / old["median"]
+        flag = ""
+        if ratio > threshold:
+            flag, regressed = "  REGRESSED", True
+        print(
+            f"{result['reactions']:>9} {result['function']:<52} "
+            f"{old['median']:>9.2f} -> {result['median']:>9.2f} ms "
+            f"({ratio:.2f}x){flag}"
+        )
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--only", help="Comma separated functions to time")
+    parser.add_argument("--out", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Earlier results to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="Fail if a median grows by more than this factor",
+    )
+    parser.add_argument("--scratch", action="store_true")
+    args = parser.parse_args()
+
+    if not args.scratch:
+        parser.error("this deletes the whole database; pass --scratch to confirm")
+
+    # Connect to NEO4J_URI without seeding it, like a production app
+    os.environ.setdefault("FLASK_DEBUG", "false")
+    os.environ.setdefault("NEO4J_URI", "neo4j://localhost:7687")
+    os.environ.setdefault("NEO4J_USERNAME", "neo4j")
+    os.environ.setdefault("NEO4J_PASSWORD", "test")
+
+    cases = CASES
+    if args.only:
+        cases = {name: CASES[name] for name in args.only.split(",")}
+
+    app = create_app()
+    results = []
+
+    with app.app_context(), tempfile.TemporaryDirectory() as directory:
+        driver = current_app.driver
+
+        for reactions in (int(size) for size in args.sizes.split(",")):
+            sizes = scale(reactions)
+            seconds = populate(driver, sizes, os.path.join(directory, str(reactions)))
+            print(
+                f"\n{sizes['users']} users, {sizes['ideas']} ideas, "
+                f"{reactions} reactions, loaded in {seconds:.1f}s"
+            )
+            print(f"{'function':<52} {'median ms':>10} {'p95 ms':>10}")
+
+            picker = Picker(sizes)
+            for name, fn in cases.items():
+                timing = timed(lambda: fn(driver, picker), args.repeat)
+                results.append(
+                    {**sizes, "function": name, "repeat": args.repeat, **timing}
+                )
+                print(f"{name:<52} {timing['median']:>10.2f} {timing['p95']:>10.2f}")
+
+        driver.close()
+
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    ).stdout.strip()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf8") as file:
+            json.dump({"commit": commit, "results": results}, file, indent=2)
+            file.write("\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf8") as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Compare ORDER BY rand() with randomKey index sampling for random_idea and
+random_unseen_idea at several catalogue sizes.
+
+This deletes everything in the target database. Point it at a scratch
+database and pass --scratch to confirm:
+
+    NEO4J_URI=neo4j://localhost:7687 python -m benchmarks.random_sampling --scratch
+"""
+
+import argparse
+import os
+import random
+import statistics
+import time
+
+from neo4j import GraphDatabase
+
+from app.models.idea import random_idea, random_unseen_idea
+
+LEGACY_RANDOM = """
+    MATCH (i:Idea)
+    RETURN i {
+        .*,
+        createdAt: toString(i.createdAt)
+    }
+    ORDER BY rand()
+    LIMIT 1
+"""
+
+LEGACY_RANDOM_UNSEEN = """
+    MATCH (u:User {userId: $user_id})
+    MATCH (i:Idea)
+    WHERE NOT (u)-[]->(i)
+    RETURN i {
+        .*,
+        createdAt: toString(i.createdAt),
+        popularity: null,
+        score: null
+    }
+    ORDER BY rand()
+    LIMIT 1
+"""
+
+
+def populate(driver, size: int, seen: float, batch_size=10000) -> str:
+    """Replace the database contents with one user and size ideas"""
+
+    with driver.session() as session:
+        while session.run(
+            "MATCH (n) WITH n LIMIT 10000 DETACH DELETE n RETURN count(*) AS n"
+        ).single()["n"]:
+            pass
+
+        session.run(
+            "CREATE RANGE INDEX idea_random_key IF NOT EXISTS FOR (i:Idea) ON (i.randomKey)"
+        )
+        session.run("CALL db.awaitIndexes()")
+
+        user_id = session.run(
+            "CREATE (u:User {userId: randomUuid(), username: 'bench'}) RETURN u.userId AS id"
+        ).single()["id"]
+
+        for start in range(0, size, batch_size):
+            count = min(batch_size, size - start)
+            session.run(
+                """
+                MATCH (u:User {userId: $user_id})
+                UNWIND range(1, $count) AS n
+                CREATE (i:Idea {
+                    ideaId: randomUuid(),
+                    url: 'https://example.com/' + toString($start + n),
+                    description: 'Benchmark idea',
+                    createdAt: datetime(),
+                    randomKey: rand()
+                })
+                WITH u, i
+                WHERE rand() < $seen
+                CREATE (u)-[:DISLIKES]->(i)
+                """,
+                user_id=user_id,
+                count=count,
+                start=start,
+                seen=seen,
+            )
+
+    return user_id
+
+
+def timed(fn, repeat: int) -> dict:
+    """Run fn repeat times and summarize its latency in milliseconds"""
+
+    fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    samples.sort()
+    return {
+        "median": statistics.median(samples),
+        "p95": samples[int(0.95 * (len(samples) - 1))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--seen", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--scratch", action="store_true")
+    args = parser.parse_args()
+
+    if not args.scratch:
+        parser.error("this deletes the whole database; pass --scratch to confirm")
+
+    driver = GraphDatabase.driver(
+        os.getenv("NEO4J_URI", "neo4j://localhost:7687"),
+        auth=(
+            os.getenv("NEO4J_USERNAME", "neo4j"),
+            os.getenv("NEO4J_PASSWORD", "test"),
+        ),
+    )
+    random.seed(0)
+
+    print(f"{'ideas':>9} {'query':<22} {'median ms':>10} {'p95 ms':>10}")
+
+    for size in (int(size) for size in args.sizes.split(",")):
+        user_id = populate(driver, size, args.seen)
+
+        def legacy_random():
+            with driver.session() as session:
+                session.run(LEGACY_RANDOM).single()
+
+        def legacy_random_unseen():
+            with driver.session() as session:
+                session.run(LEGACY_RANDOM_UNSEEN, user_id=user_id).single()
+
+        cases = {
+            "random (rand)": legacy_random,
+            "random (randomKey)": lambda: random_idea(driver),
+            "unseen (rand)": legacy_random_unseen,
+            "unseen (randomKey)": lambda: random_unseen_idea(driver, user_id),
+        }
+
+        for name, fn in cases.items():
+            result = timed(fn, args.repeat)
+            print(
+                f"{size:>9} {name:<22} "
+                f"{result['median']:>10.2f} {result['p95']:>10.2f}"
+            )
+
+    driver.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Compare the sync (gunicorn) and async (uvicorn) servers under concurrent
+load. Start both against the same database first, for example
+
+    gunicorn -c gunicorn.config.py wsgi:app
+    uvicorn asgi:app --port 8000 --workers 2
+
+then point this at them:
+
+    python -m benchmarks.serving --url http://localhost:5000 --url http://localhost:8000
+
+Each of --concurrency clients sends requests back to back for --duration
+seconds. Pass --email and --password to log in and load routes that need a
+user, such as /api/ideas/random-unseen.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+
+def login(url: str, email: str, password: str) -> str:
+    """Get an access token from the server"""
+
+    request = urllib.request.Request(
+        url + "/api/users/login",
+        data=json.dumps({"email": email, "password": password}).encode("utf8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)["user"]["token"]
+
+
+async def send(
+    reader,
+    writer,
+    host: str,
+    method: str,
+    path: str,
+    token: str | None,
+    body: dict | None = None,
+) -> tuple[int, bool, bytes]:
+    """
+    Send one request on an open connection.
+    Returns its status, whether the connection stays open, and the response body.
+    """
+
+    payload = json.dumps(body).encode("utf8") if body is not None else b""
+    headers = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+    if token:
+        headers += f"Authorization: Bearer {token}\r\n"
+    if body is not None:
+        headers += "Content-Type: application/json\r\n"
+        headers += f"Content-Length: {len(payload)}\r\n"
+    writer.write((headers + "\r\n").encode("latin-1") + payload)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("server closed the connection")
+    status = int(status_line.split()[1])
+
+    length, keep_alive = 0, True
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+        elif name.lower() == "connection" and value.strip().lower() == "close":
+            keep_alive = False
+
+    return status, keep_alive, await reader.readexactly(length)
+
+
+async def get(
+    reader, writer, host: str, path: str, token: str | None
+) -> tuple[int, bool]:
+    """Send one GET on an open connection. Returns its status and if it stays open."""
+
+    status, keep_alive, _ = await send(reader, writer, host, "GET", path, token)
+    return status, keep_alive
+
+
+async def client(
+    url: str, path: str, token: str | None, until: float
+) -> tuple[list, int]:
+    """Send requests one after another until the deadline"""
+
+    parts = urlsplit(url)
+    latencies, errors = [], 0
+    connection = None
+
+    while time.perf_counter() < until:
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(parts.hostname, parts.port)
+            status, keep_alive = await get(*connection, parts.netloc, path, token)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            errors += 1
+            connection = None
+            continue
+
+        if status >= 500:
+            errors += 1
+        else:
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        if not keep_alive:
+            connection[1].close()
+            connection = None
+
+    if connection is not None:
+        connection[1].close()
+
+    return latencies, errors
+
+
+async def load(
+    url: str, path: str, token: str | None, concurrency: int, duration: float
+) -> dict:
+    """Run concurrency clients against one server and summarize them"""
+
+    until = time.perf_counter() + duration
+    results = await asyncio.gather(
+        *(client(url, path, token, until) for _ in range(concurrency))
+    )
+
+    latencies = sorted(latency for result, _ in results for latency in result)
+    errors = sum(errors for _, errors in results)
+
+    if not latencies:
+        return {"rps": 0.0, "median": 0.0, "p95": 0.0, "errors": errors}
+
+    return {
+        "rps": len(latencies) / duration,
+        "median": statistics.median(latencies),
+        "p95": latencies[int(0.95 * (len(latencies) - 1))],
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", action="append", required=True)
+    parser.add_argument("--path", default="/api/ideas/random")
+    parser.add_argument("--concurrency", default="10,100,300")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--email")
+    parser.add_argument("--password")
+    args = parser.parse_args()
+
+    print(
+        f"{'server':<24} {'clients':>7} {'req/s':>9} "
+        f"{'median ms':>10} {'p95 ms':>10} {'errors':>7}"
+    )
+
+    for url in args.url:
+        token = login(url, args.email, args.password) if args.email else None
+
+        for concurrency in (int(n) for n in args.concurrency.split(",")):
+            result = asyncio.run(
+                load(url, args.path, token, concurrency, args.duration)
+            )
+            print(
+                f"{url:<24} {concurrency:>7} {result['rps']:>9.1f} "
+                f"{result['median']:>10.2f} {result['p95']:>10.2f} "
+                f"{result['errors']:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,84 @@
 import multiprocessing
+import os
+import subprocess
+import sys
 
 bind = "0.0.0.0:5000"
 
-workers = multiprocessing.cpu_count() * 2 + 1
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
 max_requests = 1000
-timout = 45
+timeout = 45
+
+# Load the app once in the master, then give every worker its own driver.
+# Connections opened before the fork would be shared by all the workers.
+preload_app = True
+
+# Seconds between similarity refreshes, or 0 to leave them to another host
+similarity_interval = int(os.getenv("SIMILARITY_REFRESH_INTERVAL", 60))
+similarity_refresher = None
+
+
+def when_ready(server):
+    global similarity_refresher
+    from app.db import close_driver
+    from app.metrics import clear_totals
+
+    with server.app.wsgi().app_context():
+        close_driver()
+
+    # Query totals left by an earlier server would be added to this one's
+    clear_totals(server.app.wsgi().config.get("QUERY_METRICS_DIR"))
+
+    # One refresher for the whole server, beside the workers, with its own
+    # driver. It only loads the config, so it never resets or seeds the
+    # database, and on_exit stops it with the server.
+    if similarity_interval:
+        similarity_refresher = start_similarity_refresher()
+        server.log.info("Started similarity refresher %s", similarity_refresher.pid)
+
+
+def on_exit(server):
+    stop_similarity_refresher()
+
+
+def start_similarity_refresher():
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "app.refresher",
+            "--interval",
+            str(similarity_interval),
+        ]
+    )
+
+
+def stop_similarity_refresher():
+    if similarity_refresher is not None and similarity_refresher.poll() is None:
+        similarity_refresher.terminate()
+        try:
+            similarity_refresher.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            similarity_refresher.kill()
+            similarity_refresher.wait()
+
+
+def post_fork(server, worker):
+    from app.db import connect_driver
+
+    with worker.app.wsgi().app_context():
+        connect_driver()
+
+
+def worker_exit(server, worker):
+    from flask import current_app
+    from app.buffer import close_buffer
+    from app.db import close_driver
+
+    with worker.app.wsgi().app_context():
+        # Write out buffered reactions while the driver is still open
+        close_buffer()
+        if current_app.driver is not None:
+            server.log.info("Worker pool stats: %s", current_app.pool_monitor.stats())
+            current_app.query_metrics.retire()
+        close_driver()
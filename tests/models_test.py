@@ -1,8 +1,29 @@
-import pytest
-from flask import Flask
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
-from app.db import get_driver
-from app.models.user import register, authenticate, find_user, edit_user
+import pytest
+from flask import Flask, current_app
+
+from app import create_minimal_app
+from app.commands import refresh_similarity
+from app.db import get_driver, close_driver
+from app.aio.db import connect_async_driver, close_async_driver
+from app.aio import idea as async_idea
+from app.models.user import (
+    register,
+    authenticate,
+    find_user,
+    edit_user,
+    get_profile,
+)
 from app.models.source import add_source, find_source, all_sources
 from app.models.idea import (
     add_idea,
@@ -15,8 +36,38 @@ from app.models.idea import (
     get_liked_ideas,
     get_disliked_ideas,
     get_seen_ideas,
+    stream_seen_ideas,
     get_idea_details,
+    idea_version,
+    random_idea,
+    random_unseen_idea,
+    popular_unseen_idea,
+    trending_unseen_idea,
+    all_ideas,
+    react_to_ideas,
+    get_all_seen_ideas_with_user_and_aggregate_reactions,
+    get_idea_rankings,
+    ideas_by_id,
+    LISTINGS,
+    listing_cursor,
+    listing_position,
+    RANDOM_IDEA,
 )
+from app.models.similarity import update_user_similarity, stale_users
+from app.engine import RecommendationEngine
+from app.seen import get_seen
+from app.hashing import PasswordHasher, HashingBusy, hash_rounds
+from app.cache import VersionedCache
+from app.cursors import encode_cursor
+from app.ranking import top_idea, drop_idea, page_ranking, ranking_offset
+from app import buffer as buffer_module
+from app.buffer import ReactionBuffer, MAX_FLUSH_ATTEMPTS, read_log
+from app.loader import load_files, read_rows, prepare_reactions
+from app.models.reaction import with_pending_reaction
+from app.snapshot import export_snapshot, restore_snapshot, SnapshotError, clear
+from app.migrations import migrate, schema_status, LATEST_VERSION
+from app.metrics import QueryMetrics, clear_totals
+from app.queries import explain, operators, check_queries, plan_problems
 
 
 from .fixtures import app
@@ -103,6 +154,226 @@ def test_can_edit_user(app):
         assert authenticate(driver, "updated@updated.com", "updatedpass") is not None
 
 
+def test_profile_cache_follows_edits(app):
+    """Does a cached profile give way to a newer one after an edit?"""
+
+    with app.app_context():
+        with get_driver() as driver:
+            user = authenticate(driver, "user1@user1.com", "password1")
+            before = get_profile(driver, user["userId"], user["profileVersion"])
+            edited = edit_user(driver, user["userId"], "password1", "renamed")
+            after = get_profile(driver, user["userId"], edited["profileVersion"])
+
+        assert before["username"] == "user1"
+        assert after["username"] == "renamed"
+        assert after["profileVersion"] > before["profileVersion"]
+
+
+def test_login_rehashes_password_when_cost_changes(app):
+    """Is a password rehashed at the configured cost when its user logs in?"""
+
+    with app.app_context():
+        with get_driver() as driver:
+            user = authenticate(driver, "user1@user1.com", "password1")
+            app.config["BCRYPT_ROUNDS"] = 5
+            assert authenticate(driver, "user1@user1.com", "password1")
+            stored = find_user(driver, user["userId"])["password"]
+
+        assert hash_rounds(stored) == 5
+
+
+def test_hasher_turns_calls_away_when_full():
+    """Does the hasher fail fast instead of queueing without limit?"""
+
+    hasher = PasswordHasher(workers=1, queue_depth=0)
+
+    with ThreadPoolExecutor(1) as threads:
+        busy = threads.submit(hasher.run, time.sleep, 2)
+        while hasher.pending == 0:
+            time.sleep(0.01)
+
+        with pytest.raises(HashingBusy):
+            hasher.run(os.getpid)
+
+        busy.result()
+
+    assert hasher.run(os.getpid)
+
+
+def test_hasher_recovers_from_a_killed_hash_process():
+    """Does a slot come back when the process hashing in it is killed?"""
+
+    hasher = PasswordHasher(workers=1, queue_depth=0)
+    holder = hasher.run(os.getpid)
+
+    with ThreadPoolExecutor(1) as threads:
+        busy = threads.submit(hasher.run, time.sleep, 60)
+        while hasher.pending == 0:
+            time.sleep(0.01)
+
+        os.kill(holder, signal.SIGKILL)
+
+        with pytest.raises(HashingBusy):
+            busy.result(timeout=30)
+
+    assert hasher.pending == 0
+    assert hasher.run(os.getpid) not in (holder, os.getpid())
+
+
+def test_versioned_cache_only_serves_values_of_the_version_asked_for():
+    cache = VersionedCache(maxsize=2)
+    cache.set("idea", 1, ("details",), "old")
+
+    assert cache.get("idea", 1, ("details",)) == "old"
+    assert cache.get("idea", 2, ("details",)) is None
+    assert cache.get("idea", 1, ("reactions",)) is None
+
+
+def test_versioned_cache_forgets_versions_read_before_a_write():
+    cache = VersionedCache(maxsize=2)
+    read_at = time.monotonic()
+    cache.forget("idea")
+    cache.remember("idea", 1, read_at)
+    assert cache.version("idea") is None
+
+    cache.remember("idea", 2, time.monotonic())
+    assert cache.version("idea") == 2
+    cache.forget("idea")
+    assert cache.version("idea") is None
+
+
+def test_idea_version_follows_reactions(app: Flask):
+    """Does every reaction change the version cached responses are kept under?"""
+
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            idea_id = random_unseen_idea(driver, user_id)["ideaId"]
+            before = idea_version(driver, idea_id)
+            like_idea(driver, user_id, idea_id, 1)
+            liked = idea_version(driver, idea_id)
+            dislike_idea(driver, user_id, idea_id)
+
+            assert before < liked < idea_version(driver, idea_id)
+            assert idea_version(driver, "no-such-idea") is None
+
+
+def test_listing_cursor_only_pages_its_own_sort():
+    """Does a listing cursor start the first page only when it is missing?"""
+
+    cursor = listing_cursor(
+        "likeCount", "desc", 1, [{"likeCount": 3, "ideaId": "idea"}]
+    )
+
+    assert listing_position("likeCount", "desc", None) is None
+    assert listing_position("likeCount", "desc", cursor)["id"] == "idea"
+    with pytest.raises(ValueError):
+        listing_position("likeCount", "asc", cursor)
+    with pytest.raises(ValueError):
+        listing_position("trending", "desc", cursor)
+
+
+def test_ranking_cursor_only_pages_its_own_polarity():
+    """Does a ranking cursor page on in its polarity and no other?"""
+
+    rankings = {
+        "agreeable": [{"ordinal": n, "idea": {"ideaId": str(n)}} for n in range(5)],
+        "disagreeable": [],
+        "seen": {"1"},
+    }
+
+    page, cursor = page_ranking(rankings, {2}, "agreeable", 2, 0)
+    assert [idea["ideaId"] for idea in page] == ["0", "3"]
+
+    offset = ranking_offset("agreeable", 2, cursor)
+    page, cursor = page_ranking(rankings, {2}, "agreeable", 2, offset)
+    assert [idea["ideaId"] for idea in page] == ["4"]
+    assert cursor is None
+
+    with pytest.raises(ValueError):
+        ranking_offset(
+            "disagreeable", 2, encode_cursor({"polarity": "agreeable", "offset": 4})
+        )
+    with pytest.raises(ValueError):
+        ranking_offset("agreeable", 2, "garbage")
+    with pytest.raises(ValueError):
+        ranking_offset("agreeable", 0, None)
+
+
+def test_reaction_buffer_recovers_crashed_worker_log(app, tmp_path):
+    """Are reactions left in a dead worker's log written by the next worker?"""
+
+    dead_pid = int(
+        subprocess.run(
+            [sys.executable, "-c", "import os; print(os.getpid())"],
+            capture_output=True,
+            text=True,
+        ).stdout
+    )
+
+    with app.app_context():
+        with get_driver() as driver:
+            user = authenticate(driver, "user1@user1.com", "password1")
+            idea_id = all_ideas(driver, limit=1)[0][0]["ideaId"]
+
+            entry = {"userId": user["userId"], "ideaId": idea_id, "type": "DISLIKES"}
+            (tmp_path / f"reactions-{dead_pid}.log").write_text(
+                json.dumps(entry) + "\n" + '{"userId": "cut sho'
+            )
+
+            buffer = ReactionBuffer(app, str(tmp_path), interval=60)
+            buffer.start()
+            assert buffer.pending_for(user["userId"])[idea_id]["type"] == "DISLIKES"
+
+            buffer.close()
+            idea = get_idea_details(driver, idea_id, True, user["userId"])
+
+        assert idea["userReaction"] == "DISLIKES"
+        assert list(tmp_path.iterdir()) == []
+
+
+def test_reaction_buffer_keeps_only_failed_users_and_dead_letters_poison(
+    tmp_path, monkeypatch
+):
+    """Is only what failed to flush kept, and a reaction that keeps failing set aside?"""
+
+    written = []
+
+    def react(driver, user_id, reactions):
+        if any(reaction["ideaId"] == "poison" for reaction in reactions):
+            raise ValueError("Cannot write this one")
+        written.append((user_id, [reaction["ideaId"] for reaction in reactions]))
+
+    monkeypatch.setattr(buffer_module, "react_to_ideas", react)
+    worker = Flask("worker")
+    worker.driver = None
+
+    buffer = ReactionBuffer(worker, str(tmp_path), interval=60)
+    buffer.start()
+    buffer.add("a", {"ideaId": "x", "type": "LIKES", "agreement": 1})
+    buffer.add("b", {"ideaId": "poison", "type": "DISLIKES", "agreement": None})
+    buffer.add("b", {"ideaId": "y", "type": "LIKES", "agreement": None})
+
+    assert buffer.flush() == 1
+    assert written == [("a", ["x"])]
+    assert buffer.pending_for("a") == {}
+    assert list(buffer.pending_for("b")) == ["poison", "y"]
+    with open(buffer.log_path, encoding="utf8") as log:
+        assert [entry["userId"] for entry in read_log(log)] == ["b", "b"]
+
+    for _ in range(MAX_FLUSH_ATTEMPTS - 1):
+        buffer.flush()
+
+    assert written[-1] == ("b", ["y"])
+    assert buffer.pending_for("b") == {}
+    with open(buffer.dead_letter_path, encoding="utf8") as log:
+        assert [entry["ideaId"] for entry in read_log(log)] == ["poison"]
+
+    buffer.close()
+
+
 def test_cannot_edit_user_without_correct_password(app):
     """Will a bad password prevent user edits?"""
 
@@ -169,6 +440,108 @@ def test_can_find_source(app):
         assert source["name"] == "Ross Douthat"
 
 
+def test_can_bulk_load_files(app, tmp_path):
+    """Are users, ideas and reactions loaded from files and counted on ideas?"""
+
+    users = tmp_path / "users.jsonl"
+    users.write_text(
+        json.dumps(
+            {
+                "userId": "bulk-user",
+                "email": "bulk@bulk.com",
+                "username": "bulk",
+                "password": "bulkpass",
+            }
+        )
+        + "\n"
+    )
+    ideas = tmp_path / "ideas.csv"
+    ideas.write_text(
+        "ideaId,userId,sourceId,url,description\n"
+        "bulk-idea-1,bulk-user,,https://example.com/1,First\n"
+        "bulk-idea-2,bulk-user,,https://example.com/2,Second\n"
+    )
+    reactions = tmp_path / "reactions.jsonl"
+    reactions.write_text(
+        "\n".join(
+            json.dumps(row)
+            for row in [
+                {"userId": "bulk-user", "ideaId": "bulk-idea-1", "type": "dislike"},
+                {
+                    "userId": "bulk-user",
+                    "ideaId": "bulk-idea-1",
+                    "type": "like",
+                    "agreement": 2,
+                },
+                {"userId": "bulk-user", "ideaId": "bulk-idea-2", "type": "dislike"},
+            ]
+        )
+    )
+
+    with app.app_context():
+        with get_driver() as driver:
+            reports = load_files(
+                driver,
+                {"users": str(users), "ideas": str(ideas), "reactions": str(reactions)},
+                batch_size=2,
+                cheap_hash=True,
+            )
+            user = authenticate(driver, "bulk@bulk.com", "bulkpass")
+            liked = get_idea_details(driver, "bulk-idea-1")
+            disliked = get_idea_details(driver, "bulk-idea-2")
+
+        assert [report["written"] for report in reports] == [1, 2, 2]
+        assert user["userId"] == "bulk-user"
+        assert (liked["likeCount"], liked["agreementSum"]) == (1, 2)
+        assert (disliked["likeCount"], disliked["dislikeCount"]) == (0, 1)
+
+
+def test_loader_reads_csv_and_keeps_last_reaction(tmp_path):
+    """Are CSV rows typed, and only the last of repeated reactions kept?"""
+
+    path = tmp_path / "reactions.csv"
+    path.write_text(
+        "userId,ideaId,type,agreement\nu,i,like,3\nu,i,like,-1\nu,j,dislike,\n"
+    )
+
+    likes, dislikes = prepare_reactions(list(read_rows(str(path))))
+
+    assert likes == [{"userId": "u", "ideaId": "i", "agreement": -1}]
+    assert dislikes == [{"userId": "u", "ideaId": "j"}]
+
+
+def test_snapshot_restores_the_same_graph(app, tmp_path):
+    """Does exporting a restored snapshot give the very same files?"""
+
+    with app.app_context():
+        with get_driver() as driver:
+            exported = export_snapshot(driver, str(tmp_path / "a"), chunk_size=5)
+            restored = restore_snapshot(driver, str(tmp_path / "a"), batch_size=3)
+            again = export_snapshot(driver, str(tmp_path / "b"), chunk_size=5)
+            user = authenticate(driver, "user1@user1.com", "password1")
+
+        assert exported == again
+        assert restored["nodes"] + restored["relationships"] == sum(
+            entry["rows"] for entry in exported["files"]
+        )
+        assert user
+
+
+def test_snapshot_with_altered_file_is_not_restored(app, tmp_path):
+    """Is a snapshot that fails its checksums rejected before anything is deleted?"""
+
+    with app.app_context():
+        with get_driver() as driver:
+            manifest = export_snapshot(driver, str(tmp_path))
+            with open(tmp_path / manifest["files"][0]["name"], "ab") as file:
+                file.write(b"\0")
+
+            with pytest.raises(SnapshotError):
+                restore_snapshot(driver, str(tmp_path))
+
+            assert authenticate(driver, "user1@user1.com", "password1")
+
+
 @pytest.mark.skip
 def test_can_add_idea(app):
     with app.app_context():
@@ -241,6 +614,385 @@ def test_can_get_agreeable_idea(app: Flask):
         assert idea[1] == 12
 
 
+def test_can_precompute_similar_users(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            neighbours = update_user_similarity(driver, user_id, k=3)
+
+        assert 0 < neighbours <= 3
+
+
+def test_refresher_leaves_the_database_as_it_is(app: Flask):
+    """Does the refresher start without resetting the reactions it refreshes from?"""
+
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "user1@user1.com", "password1")["userId"]
+            idea_id = random_unseen_idea(driver, user_id)["ideaId"]
+            like_idea(driver, user_id, idea_id, 1)
+
+    refresher = create_minimal_app()
+    with refresher.app_context():
+        refresh_similarity(0, threading.Event())
+        idea = get_idea_details(current_app.driver, idea_id, True, user_id)
+        close_driver()
+
+    assert idea["userReaction"] == "LIKES"
+
+
+def test_neighbour_reactions_make_similarity_stale(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            update_user_similarity(driver, user_id, k=3)
+            with driver.session() as session:
+                neighbour = session.execute_read(
+                    lambda tx: tx.run(
+                        """
+                        MATCH (:User {userId: $user_id})-[:SIMILAR]->(v:User)
+                        RETURN v.userId AS id LIMIT 1
+                        """,
+                        user_id=user_id,
+                    ).single()["id"]
+                )
+            like_idea(
+                driver, neighbour, random_unseen_idea(driver, neighbour)["ideaId"], 1
+            )
+            with driver.session() as session:
+                stale = session.execute_read(stale_users, timedelta(hours=1), 100000)
+
+        assert user_id in stale
+
+
+def test_cached_rankings_skip_ideas_seen_elsewhere(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            first = top_idea(driver, user_id, agreeable=True)
+            # As if another worker saved the reaction, which marks nothing here
+            like_idea(driver, user_id, first["ideaId"], 1)
+            second = top_idea(driver, user_id, agreeable=True)
+            drop_idea(second["ideaId"])
+            third = top_idea(driver, user_id, agreeable=True)
+
+        assert second["ideaId"] != first["ideaId"]
+        assert third["ideaId"] not in (first["ideaId"], second["ideaId"])
+
+
+def test_rating_stats_follow_reactions(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            idea_id = search_ideas(driver, "cellular")[0][0]
+
+            def stats(tx):
+                return tx.run(
+                    """
+                    MATCH (u:User {userId: $user_id})
+                    RETURN u.ratingCount AS n, u.ratingSum AS total
+                    """,
+                    user_id=user_id,
+                ).single()
+
+            with driver.session() as session:
+                dislike_idea(driver, user_id, idea_id)
+                before = session.execute_read(stats)
+                like_idea(driver, user_id, idea_id, 3)
+                liked = session.execute_read(stats)
+                like_idea(driver, user_id, idea_id, -1)
+                changed = session.execute_read(stats)
+                dislike_idea(driver, user_id, idea_id)
+                after = session.execute_read(stats)
+
+        assert liked["n"] == before["n"] + 1
+        assert liked["total"] == before["total"] + 3
+        assert changed["total"] == before["total"] - 1
+        assert after["n"] == before["n"]
+        assert after["total"] == before["total"]
+
+
+def test_engine_recommends_unseen_ideas(app: Flask):
+    pytest.importorskip("numpy")
+
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            engine = RecommendationEngine()
+            engine.load(driver)
+            agreeable = engine.best(user_id, agreeable=True)
+            disagreeable = engine.best(user_id, agreeable=False)
+            seen = [idea["ideaId"] for idea in get_seen_ideas(driver, user_id)[0]]
+
+        assert agreeable[1] >= disagreeable[1]
+        assert agreeable[0] not in seen
+        assert disagreeable[0] not in seen
+
+
+def test_random_ideas_are_sampled_by_key(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            idea = random_idea(driver)
+            unseen = random_unseen_idea(driver, user_id)
+            seen = [idea["ideaId"] for idea in get_seen_ideas(driver, user_id)[0]]
+
+        assert "randomKey" not in idea
+        assert unseen["ideaId"] not in seen
+
+
+def test_seen_set_follows_reactions(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            unseen = random_unseen_idea(driver, user_id)
+            with driver.session() as session:
+                [(ordinal, _)] = session.execute_read(ideas_by_id, [unseen["ideaId"]])
+            before = set(get_seen(driver, user_id))
+            dislike_idea(driver, user_id, unseen["ideaId"])
+            after = set(get_seen(driver, user_id))
+
+        assert after - before == {ordinal}
+
+
+def test_can_react_to_many_ideas(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            first = random_unseen_idea(driver, user_id)
+            dislike_idea(driver, user_id, first["ideaId"])
+            second = random_unseen_idea(driver, user_id)
+            results = react_to_ideas(
+                driver,
+                user_id,
+                [
+                    {"ideaId": first["ideaId"], "type": "LIKES", "agreement": -2},
+                    {"ideaId": first["ideaId"], "type": "LIKES", "agreement": 3},
+                    {"ideaId": second["ideaId"], "type": "DISLIKES", "agreement": None},
+                    {"ideaId": "missing", "type": "DISLIKES", "agreement": None},
+                ],
+            )
+            liked = get_idea_details(
+                driver, first["ideaId"], with_reactions=True, user_id=user_id
+            )
+            seen = get_seen(driver, user_id)
+            with driver.session() as session:
+                [(ordinal, _)] = session.execute_read(ideas_by_id, [second["ideaId"]])
+
+        assert [result["status"] for result in results] == [
+            "superseded",
+            "saved",
+            "saved",
+            "not found",
+        ]
+        assert liked["userReaction"] == "LIKES"
+        assert liked["userAgreement"] == 3
+        assert liked["dislikeCount"] == first["dislikeCount"]
+        assert liked["likeCount"] == first["likeCount"] + 1
+        assert ordinal in seen
+
+
+def test_like_counters_follow_reactions(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            popular = popular_unseen_idea(driver, user_id)
+            like_idea(driver, user_id, popular["ideaId"], 2)
+            liked = get_idea_details(driver, popular["ideaId"])
+            dislike_idea(driver, user_id, popular["ideaId"])
+            disliked = get_idea_details(driver, popular["ideaId"])
+
+        assert liked["likeCount"] == popular["likeCount"] + 1
+        assert liked["agreementSum"] == popular["agreementSum"] + 2
+        assert disliked["likeCount"] == popular["likeCount"]
+        assert disliked["dislikeCount"] == popular["dislikeCount"] + 1
+        assert disliked["agreementSum"] == popular["agreementSum"]
+
+
+def test_reaction_histograms_follow_reactions(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            idea = random_unseen_idea(driver, user_id)
+            like_idea(driver, user_id, idea["ideaId"], -2)
+            seen, _ = get_all_seen_ideas_with_user_and_aggregate_reactions(
+                driver, user_id, raw=True
+            )
+            liked = next(i for i in seen if i["ideaId"] == idea["ideaId"])
+            like_idea(driver, user_id, idea["ideaId"], 3)
+            seen, _ = get_all_seen_ideas_with_user_and_aggregate_reactions(
+                driver, user_id
+            )
+            moved = next(i for i in seen if i["ideaId"] == idea["ideaId"])
+
+        assert liked["histogram"]["likes"] == liked["allReactions"].count("LIKES")
+        assert liked["histogram"]["dislikes"] == liked["allReactions"].count("DISLIKES")
+        assert liked["histogram"]["agreement"] == {
+            point: liked["allAgreement"].count(point) for point in range(-3, 4)
+        }
+        assert "allAgreement" not in moved
+        assert moved["histogram"]["likes"] == liked["histogram"]["likes"]
+        assert moved["histogram"]["agreement"][-2] == (
+            liked["histogram"]["agreement"][-2] - 1
+        )
+        assert moved["histogram"]["agreement"][3] == (
+            liked["histogram"]["agreement"][3] + 1
+        )
+
+
+def test_pending_reaction_replaces_the_users_reaction():
+    idea = {
+        "ideaId": "idea",
+        "userReaction": "LIKES",
+        "userAgreement": -1,
+        "allReactions": ["LIKES", "DISLIKES", "LIKES"],
+        "allAgreement": [3, -1],
+        "likeCount": 2,
+        "dislikeCount": 1,
+        "agreementSum": 2,
+        "agreementCounts": [0, 0, 1, 0, 0, 0, 1],
+    }
+
+    disliked = with_pending_reaction(idea, {"type": "DISLIKES", "agreement": None})
+    liked = with_pending_reaction(
+        {
+            "ideaId": "idea",
+            "allReactions": [],
+            "allAgreement": [],
+            "agreementCounts": None,
+        },
+        {"type": "LIKES", "agreement": 2},
+    )
+
+    assert disliked["userReaction"] == "DISLIKES"
+    assert sorted(disliked["allReactions"]) == ["DISLIKES", "DISLIKES", "LIKES"]
+    assert disliked["allAgreement"] == [3]
+    assert disliked["likeCount"] == 1
+    assert disliked["dislikeCount"] == 2
+    assert disliked["agreementSum"] == 3
+    assert disliked["agreementCounts"] == [0, 0, 0, 0, 0, 0, 1]
+    assert liked["allReactions"] == ["LIKES"]
+    assert liked["allAgreement"] == [2]
+    assert liked["likeCount"] == 1
+    assert liked["agreementCounts"] == [0, 0, 0, 0, 0, 1, 0]
+    assert "agreementCounts" not in with_pending_reaction(
+        {"ideaId": "idea"}, {"type": "LIKES", "agreement": 2}
+    )
+
+
+def test_can_page_through_seen_ideas(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            everything, cursor = get_all_seen_ideas_with_user_and_aggregate_reactions(
+                driver, user_id
+            )
+            ideas, cursor = get_all_seen_ideas_with_user_and_aggregate_reactions(
+                driver, user_id, limit=2
+            )
+            pages = [ideas]
+            while cursor:
+                ideas, cursor = get_all_seen_ideas_with_user_and_aggregate_reactions(
+                    driver, user_id, limit=2, cursor=cursor
+                )
+                pages.append(ideas)
+
+    listed = [idea["ideaId"] for page in pages for idea in page]
+    assert listed == [idea["ideaId"] for idea in everything]
+
+
+def test_seen_ideas_stream_in_page_order(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            streamed = [idea["ideaId"] for idea in stream_seen_ideas(driver, user_id)]
+            first, cursor = get_seen_ideas(driver, user_id, limit=3)
+            rest, _ = get_seen_ideas(driver, user_id, cursor=cursor)
+
+    assert streamed == [idea["ideaId"] for idea in first + rest]
+    assert len(set(streamed)) == len(streamed)
+
+
+def test_new_likes_move_ideas_up_trending(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            trending = trending_unseen_idea(driver, user_id)
+            idea = random_unseen_idea(driver, user_id)
+            like_idea(driver, user_id, idea["ideaId"], 1)
+            liked = get_idea_details(driver, idea["ideaId"])
+
+        assert trending is not None
+        assert liked["trending"] > idea["trending"]
+
+
+def test_popular_unseen_idea_seeks_past_each_batch(app: Flask):
+    """Does walking one idea at a time find what one large batch does?"""
+
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            top = [popular_unseen_idea(driver, user_id, batch_size=50)]
+            for _ in range(3):
+                exclude = {idea["ideaId"] for idea in top}
+                one_by_one = popular_unseen_idea(
+                    driver, user_id, batch_size=1, exclude=exclude
+                )
+                batched = popular_unseen_idea(
+                    driver, user_id, batch_size=50, exclude=exclude
+                )
+                assert one_by_one == batched
+                top.append(batched)
+
+        likes = [idea["likeCount"] for idea in top]
+        assert likes == sorted(likes, reverse=True)
+
+
+def test_can_page_through_ideas(app: Flask):
+    with app.app_context():
+        with get_driver() as driver:
+            ideas, cursor = all_ideas(driver, limit=10)
+            pages = [ideas]
+            while cursor:
+                ideas, cursor = all_ideas(driver, limit=10, cursor=cursor)
+                pages.append(ideas)
+
+    listed = [idea for page in pages for idea in page]
+    assert len(pages) > 1
+    assert len({idea["ideaId"] for idea in listed}) == len(listed)
+    assert [idea["createdAt"] for idea in listed] == sorted(
+        (idea["createdAt"] for idea in listed), reverse=True
+    )
+
+
 @pytest.mark.skip
 def test_can_delete_idea(app: Flask):
     with app.app_context():
@@ -276,7 +1028,7 @@ def test_can_get_seen_ideas(app: Flask):
     with app.app_context():
         with get_driver() as driver:
             user_id = find_user(driver, "ostewart@example.org")["userId"]
-            ideas = get_seen_ideas(driver, user_id)
+            ideas, _ = get_seen_ideas(driver, user_id)
 
         assert len(ideas) == 7
 
@@ -325,3 +1077,213 @@ def test_idea_details_returns_none_if_not_found(app: Flask) -> None:
             idea = get_idea_details(driver, "bob")
 
         assert idea is None
+
+
+def test_pool_monitor_counts_acquisitions(app: Flask):
+    with app.app_context():
+        before = current_app.pool_monitor.stats()
+        with get_driver() as driver:
+            random_idea(driver)
+        after = current_app.pool_monitor.stats()
+
+    assert after["acquisitions"] > before["acquisitions"]
+    assert after["inUse"] == 0
+    assert after["maxSize"] == app.config["NEO4J_MAX_POOL_SIZE"]
+
+
+def plan_operators(driver, query: str, **params) -> set[str]:
+    """Every operator in the plan of a query"""
+
+    with driver.session() as session:
+        return set(operators(session.execute_read(explain, query, params)))
+
+
+def test_migrations_are_applied_once_and_survive_clearing(app: Flask):
+    """Is the schema at the latest version, with nothing left to apply?"""
+
+    with app.app_context():
+        with get_driver() as driver:
+            clear(driver)
+            applied = migrate(driver)
+            status = schema_status(driver)
+
+    assert applied == []
+    assert status["version"] == LATEST_VERSION
+    assert all(index["state"] == "ONLINE" for index in status["indexes"])
+
+
+def test_lookups_use_index_seeks(app: Flask):
+    """Do the queries anchored on ids, urls and sort keys seek indexes?"""
+
+    anchored = {
+        "MATCH (u:User {userId: $id}) RETURN u": "NodeUniqueIndexSeek",
+        "MATCH (i:Idea {ideaId: $id}) RETURN i": "NodeUniqueIndexSeek",
+        "MATCH (s:Source {sourceId: $id}) RETURN s": "NodeUniqueIndexSeek",
+        "MATCH (i:Idea {url: $id}) RETURN i": "NodeIndexSeek",
+        RANDOM_IDEA: "NodeIndexSeekByRange",
+    }
+
+    with app.app_context():
+        with get_driver() as driver:
+            for query, seek in anchored.items():
+                operators = plan_operators(driver, query, id="x", start=0.5)
+                assert seek in operators, query
+                assert "NodeByLabelScan" not in operators, query
+
+            first, rest = LISTINGS[("createdAt", "desc")]
+            operators = plan_operators(driver, first, limit=20)
+            assert "NodeByLabelScan" not in operators
+            assert "AllNodesScan" not in operators
+
+
+def test_registered_hot_queries_plan_without_scans(app: Flask):
+    """Does every hot query seek its way in, with no scans or cartesian products?"""
+
+    with app.app_context():
+        with get_driver() as driver:
+            assert check_queries(driver) == []
+
+
+def test_plan_check_allows_products_of_unique_seeks():
+    """Is a cartesian product only reported when a side can give many rows?"""
+
+    def step(operator, *children):
+        return {"operatorType": f"{operator}@neo4j", "children": list(children)}
+
+    one_by_one = step(
+        "ProduceResults",
+        step(
+            "CartesianProduct",
+            step("NodeUniqueIndexSeek(Locking)"),
+            step("NodeUniqueIndexSeek"),
+        ),
+    )
+    many = step(
+        "CartesianProduct", step("NodeUniqueIndexSeek"), step("NodeByLabelScan")
+    )
+
+    assert plan_problems(one_by_one) == []
+    assert plan_problems(many) == ["CartesianProduct", "NodeByLabelScan"]
+
+
+def test_query_metrics_name_each_registered_query(app: Flask, tmp_path):
+    """Are calls, records and sampled db hits recorded per registered query?"""
+
+    with app.app_context():
+        current_app.query_metrics.profile_rate = 1.0
+        current_app.query_metrics.directory = str(tmp_path)
+        with get_driver() as driver:
+            ideas, cursor = all_ideas(driver)
+            random_idea(driver)
+        queries = current_app.query_metrics.stats()["queries"]
+        stats = {query["query"]: query for query in queries}
+        text = current_app.query_metrics.prometheus()
+
+    assert stats["idea.random"]["calls"] == 1
+    assert stats["idea.random"]["records"] == 1
+    assert stats["idea.random"]["dbHits"] > 0
+    assert stats["idea.listing.createdAt.desc"]["records"] == len(ideas)
+    assert 'agnosis_query_seconds_count{query="idea.random",access="read"}' in text
+
+
+def test_query_metrics_add_up_every_workers_totals(tmp_path):
+    """Do the totals of exited and running workers add up, without a pid label?"""
+
+    exited = QueryMetrics(directory=str(tmp_path))
+    exited.record_call("idea.random", "read", 0.01, False)
+    exited.retire()
+
+    running = QueryMetrics(directory=str(tmp_path))
+    running.record_call("idea.random", "read", 0.02, False)
+    running.record_call("idea.random", "read", 0.5, True)
+    stats = {query["query"]: query for query in running.stats()["queries"]}
+    text = running.prometheus()
+
+    assert stats["idea.random"]["calls"] == 3
+    assert stats["idea.random"]["errors"] == 1
+    assert stats["idea.random"]["maxSeconds"] == 0.5
+    assert 'agnosis_query_seconds_count{query="idea.random",access="read"} 3' in text
+    assert "pid" not in text
+
+    clear_totals(str(tmp_path))
+    assert QueryMetrics(directory=str(tmp_path)).stats()["queries"] == []
+
+
+def test_async_models_match_sync(app: Flask):
+    async def listing(user_id):
+        driver = await connect_async_driver()
+        try:
+            ideas = await async_idea.all_ideas(driver, sort="likeCount", limit=10)
+            popular = await async_idea.popular_unseen_idea(driver, user_id)
+            return ideas, popular
+        finally:
+            await close_async_driver()
+
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            expected = all_ideas(driver, sort="likeCount", limit=10)
+            expected_popular = popular_unseen_idea(driver, user_id)
+        ideas, popular = asyncio.run(listing(user_id))
+
+    assert ideas == expected
+    assert popular == expected_popular
+
+
+def test_async_user_reads_match_sync(app: Flask):
+    """Do the ported viewed and ranking reads give what the sync ones do?"""
+
+    async def reads(user_id):
+        driver = await connect_async_driver()
+        try:
+            seen = await async_idea.get_seen_ideas(driver, user_id, limit=5)
+            reacted = (
+                await async_idea.get_all_seen_ideas_with_user_and_aggregate_reactions(
+                    driver, user_id, limit=5
+                )
+            )
+            rankings = await async_idea.get_idea_rankings(driver, user_id, depth=10)
+            return seen, reacted, rankings
+        finally:
+            await close_async_driver()
+
+    with app.app_context():
+        with get_driver() as driver:
+            user_id = authenticate(driver, "ostewart@example.org", "7(S7fOnb!q")[
+                "userId"
+            ]
+            expected_seen = get_seen_ideas(driver, user_id, limit=5)
+            expected_reacted = get_all_seen_ideas_with_user_and_aggregate_reactions(
+                driver, user_id, limit=5
+            )
+            expected_rankings = get_idea_rankings(driver, user_id, depth=10)
+        seen, reacted, rankings = asyncio.run(reads(user_id))
+
+    assert seen == expected_seen
+    assert reacted == expected_reacted
+    assert rankings == expected_rankings
+
+
+def test_async_query_metrics_name_each_registered_query(app: Flask, tmp_path):
+    """Does the async driver record its transactions beside the sync ones?"""
+
+    async def listing():
+        driver = await connect_async_driver()
+        try:
+            return await async_idea.all_ideas(driver, limit=10)
+        finally:
+            await close_async_driver()
+
+    with app.app_context():
+        current_app.query_metrics.profile_rate = 1.0
+        current_app.query_metrics.directory = str(tmp_path)
+        ideas, cursor = asyncio.run(listing())
+        queries = current_app.query_metrics.stats()["queries"]
+        stats = {query["query"]: query for query in queries}
+
+    listing_stats = stats["aio.idea.listing.createdAt.desc"]
+    assert listing_stats["calls"] == 1
+    assert listing_stats["records"] == len(ideas)
+    assert listing_stats["dbHits"] > 0
@@ -1,10 +1,13 @@
 """Test API routes"""
 
+import json
+
 from flask import request, session
 from flask.testing import FlaskClient
 import pytest
 
 from .fixtures import app
+from app.cursors import encode_cursor
 from app.routes.ideas import get_idea
 
 
@@ -140,6 +143,32 @@ def test_can_view_user_info(client: FlaskClient) -> None:
         assert res.json["user"].get("password", None) is None
 
 
+def test_viewed_user_info_follows_edits(client: FlaskClient) -> None:
+    """Does a user see their own edits when viewing their details?"""
+    with client:
+        user = client.post(
+            "/api/users/login",
+            json={
+                "email": "user1@user1.com",
+                "password": "password1",
+            },
+        ).json
+        user_id = user["user"]["sub"]
+        headers = {"Authorization": f"Bearer {user['user']['token']}"}
+        before = client.get(f"/api/users/{user_id}", headers=headers)
+
+        edited = client.patch(
+            f"/api/users/{user_id}",
+            headers=headers,
+            json={"currentPassword": "password1", "newUsername": "renamed"},
+        ).json
+        headers = {"Authorization": f"Bearer {edited['user']['token']}"}
+        after = client.get(f"/api/users/{user_id}", headers=headers)
+
+        assert before.json["user"]["username"] == "user1"
+        assert after.json["user"]["username"] == "renamed"
+
+
 def test_cannot_view_user_info_without_proper_token(client: FlaskClient) -> None:
     """Can only the user view user details?"""
 
@@ -210,6 +239,65 @@ def test_can_edit_user_info(client: FlaskClient) -> None:
 #
 
 
+def test_list_ideas(client: FlaskClient) -> None:
+    """Can one page through all ideas?"""
+
+    with client:
+
+        first = client.get("/api/ideas/?sort=likeCount&limit=5")
+        second = client.get(
+            f"/api/ideas/?sort=likeCount&limit=5&cursor={first.json['cursor']}"
+        )
+        invalid = client.get("/api/ideas/?sort=description")
+
+        assert first.status_code == 200
+        assert len(first.json["ideas"]) == 5
+        counts = [idea["likeCount"] for idea in first.json["ideas"]]
+        counts += [idea["likeCount"] for idea in second.json["ideas"]]
+        assert counts == sorted(counts, reverse=True)
+        assert not {idea["ideaId"] for idea in first.json["ideas"]} & {
+            idea["ideaId"] for idea in second.json["ideas"]
+        }
+        assert invalid.status_code == 400
+
+
+def test_list_ideas_rejects_bad_limits_and_cursors(client: FlaskClient) -> None:
+    """Are empty or negative pages and tampered cursors turned away?"""
+
+    with client:
+        tampered = encode_cursor({"sort": ["likeCount", "desc"], "id": "x"})
+        recent = client.get("/api/ideas/?limit=5").json["cursor"]
+
+        for query in (
+            "limit=0",
+            "limit=-5",
+            "cursor=%21%21",
+            f"cursor={tampered}",
+            f"cursor={recent}",
+        ):
+            res = client.get(f"/api/ideas/?sort=likeCount&{query}")
+            assert res.status_code == 400
+
+
+def test_user_idea_pages_reject_bad_limits_and_cursors(
+    client: FlaskClient, logged_in_user, auth_headers
+) -> None:
+    """Do the viewed and posted pages turn away what /api/ideas/ does?"""
+
+    with client:
+        user_id = logged_in_user["user"]["sub"]
+        tampered = encode_cursor({"before": "x"})
+
+        for path in (
+            "/api/ideas/viewed",
+            "/api/ideas/viewed-with-relationships",
+            f"/api/ideas/user/{user_id}",
+        ):
+            for query in ("limit=0", "cursor=%21%21", f"cursor={tampered}"):
+                res = client.get(f"{path}?{query}", headers=auth_headers)
+                assert res.status_code == 400
+
+
 def test_get_random_idea(client: FlaskClient) -> None:
     """Can one get a random idea?"""
 
@@ -243,6 +331,60 @@ def test_get_agreeable_idea(client: FlaskClient, auth_headers) -> None:
         assert res.json["idea"]["url"] is not None
 
 
+def test_get_trending_idea(client: FlaskClient, auth_headers) -> None:
+    """Can one get a trending idea?"""
+
+    with client:
+
+        res = client.get("/api/ideas/trending", headers=auth_headers)
+
+        assert res.status_code == 200
+        assert res.json["idea"]["url"] is not None
+
+
+def test_get_recommendations(client: FlaskClient, auth_headers) -> None:
+    """Can one page through agreeable and disagreeable ideas?"""
+
+    with client:
+
+        res = client.get("/api/ideas/recommendations?limit=2", headers=auth_headers)
+
+        assert res.status_code == 200
+        assert 0 < len(res.json["agreeable"]["ideas"]) <= 2
+        assert 0 < len(res.json["disagreeable"]["ideas"]) <= 2
+
+        cursor = res.json["agreeable"]["cursor"]
+        if cursor:
+            next_page = client.get(
+                f"/api/ideas/recommendations?limit=2&agreeableCursor={cursor}",
+                headers=auth_headers,
+            )
+            first_ids = {idea["ideaId"] for idea in res.json["agreeable"]["ideas"]}
+            next_ids = {idea["ideaId"] for idea in next_page.json["agreeable"]["ideas"]}
+            assert not first_ids & next_ids
+
+
+def test_recommendations_reject_bad_cursors_and_limits(
+    client: FlaskClient, auth_headers
+) -> None:
+    """Are a bad cursor, another polarity's cursor and a zero limit refused?"""
+
+    with client:
+        res = client.get("/api/ideas/recommendations?limit=2", headers=auth_headers)
+        cursor = res.json["disagreeable"]["cursor"]
+
+        for query in (
+            "limit=0",
+            "agreeableCursor=garbage",
+            f"agreeableCursor={encode_cursor({'before': 3})}",
+            f"agreeableCursor={cursor}",
+        ):
+            res = client.get(
+                f"/api/ideas/recommendations?{query}", headers=auth_headers
+            )
+            assert res.status_code == 400, query
+
+
 def test_like_idea(client: FlaskClient, auth_headers) -> None:
     """Can one like an idea?"""
 
@@ -275,6 +417,80 @@ def test_dislike_idea(client: FlaskClient, auth_headers) -> None:
         assert res.json["reaction"]["type"] == "DISLIKES"
 
 
+def test_buffered_reaction_is_read_back(
+    app, client: FlaskClient, auth_headers, tmp_path
+) -> None:
+    """Is a buffered reaction acknowledged at once and seen by its user's reads?"""
+
+    app.config["REACTION_BUFFER"] = True
+    app.config["REACTION_BUFFER_DIR"] = str(tmp_path)
+    app.config["REACTION_BUFFER_INTERVAL"] = 60
+
+    with client:
+        idea_id = client.get("/api/ideas/random-unseen", headers=auth_headers).json[
+            "idea"
+        ]["ideaId"]
+        res = client.post(
+            f"/api/ideas/{idea_id}/react",
+            json={"type": "like", "agreement": 2},
+            headers=auth_headers,
+        )
+        reactions = client.get(
+            f"/api/ideas/{idea_id}/reactions", headers=auth_headers
+        ).json["reactions"]
+        viewed = client.get("/api/ideas/viewed", headers=auth_headers).json["ideas"]
+        related = client.get(
+            "/api/ideas/viewed-with-relationships", headers=auth_headers
+        ).json["ideas"]
+        streamed = client.get(
+            "/api/ideas/viewed-with-relationships?stream=true", headers=auth_headers
+        ).get_data(as_text=True)
+
+        assert res.status_code == 202
+        assert reactions["userReaction"] == "LIKES"
+        assert reactions["userAgreement"] == 2
+        assert "LIKES" in reactions["allReactions"]
+        assert 2 in reactions["allAgreement"]
+        assert idea_id in [idea["ideaId"] for idea in viewed]
+        assert related[0]["ideaId"] == idea_id
+        assert related[0]["userReaction"] == "LIKES"
+        assert related[0]["histogram"]["agreement"]["2"] >= 1
+        assert json.loads(streamed.splitlines()[0])["ideaId"] == idea_id
+
+        app.reaction_buffer.close()
+        reactions = client.get(
+            f"/api/ideas/{idea_id}/reactions", headers=auth_headers
+        ).json["reactions"]
+        assert reactions["userAgreement"] == 2
+
+
+def test_react_to_many_ideas(client: FlaskClient, auth_headers) -> None:
+    """Can one react to several ideas at once?"""
+
+    with client:
+        ideas = client.get("/api/ideas/?limit=2").json["ideas"]
+        res = client.post(
+            "/api/ideas/reactions",
+            json={
+                "reactions": [
+                    {"ideaId": ideas[0]["ideaId"], "type": "like", "agreement": 1},
+                    {"ideaId": ideas[1]["ideaId"], "type": "dislike"},
+                ]
+            },
+            headers=auth_headers,
+        )
+        missing_agreement = client.post(
+            "/api/ideas/reactions",
+            json={"reactions": [{"ideaId": ideas[0]["ideaId"], "type": "like"}]},
+            headers=auth_headers,
+        )
+
+        assert res.status_code == 200
+        assert [r["type"] for r in res.json["reactions"]] == ["LIKES", "DISLIKES"]
+        assert all(r["status"] == "saved" for r in res.json["reactions"])
+        assert missing_agreement.status_code == 400
+
+
 def test_get_viewed_ideas(client: FlaskClient, auth_headers) -> None:
     """Can one get all previously seen ideas?"""
 
@@ -284,6 +500,43 @@ def test_get_viewed_ideas(client: FlaskClient, auth_headers) -> None:
         assert res.json["ideas"] is not None
 
 
+def test_viewed_ideas_have_histograms_and_raw_reactions_on_request(
+    client: FlaskClient, auth_headers
+) -> None:
+    """Are viewed ideas paged, with every reaction only when asked for?"""
+
+    with client:
+        url = "/api/ideas/viewed-with-relationships"
+        compact = client.get(f"{url}?limit=1", headers=auth_headers)
+        raw = client.get(f"{url}?raw-reactions=true", headers=auth_headers)
+        assert compact.status_code == 200
+        assert len(compact.json["ideas"]) <= 1
+        assert "histogram" in compact.json["ideas"][0]
+        assert "allAgreement" not in compact.json["ideas"][0]
+        assert raw.json["cursor"] is None
+        assert all("allAgreement" in idea for idea in raw.json["ideas"])
+
+
+def test_viewed_ideas_page_and_stream(client: FlaskClient, auth_headers) -> None:
+    """Can one page through seen ideas, or stream them all as NDJSON?"""
+
+    with client:
+        everything = client.get("/api/ideas/viewed", headers=auth_headers).json
+        page = client.get("/api/ideas/viewed?limit=2", headers=auth_headers).json
+        rest = client.get(
+            f"/api/ideas/viewed?cursor={page['cursor']}", headers=auth_headers
+        ).json
+        stream = client.get("/api/ideas/viewed?stream=true", headers=auth_headers)
+        streamed = [json.loads(line) for line in stream.data.splitlines()]
+
+        assert everything["cursor"] is None
+        assert page["cursor"] is not None
+        ids = [idea["ideaId"] for idea in everything["ideas"]]
+        assert [idea["ideaId"] for idea in page["ideas"] + rest["ideas"]] == ids
+        assert stream.mimetype == "application/x-ndjson"
+        assert [idea["ideaId"] for idea in streamed] == ids
+
+
 def test_delete_idea(client: FlaskClient, logged_in_user, auth_headers) -> None:
     """Can a user delete an idea?"""
 
@@ -358,3 +611,52 @@ def test_get_idea_details_with_all_reactions(
         )
         print(res.json)
         assert res.status_code == 200
+
+
+def test_conditional_idea_get_answers_304_without_a_session(
+    app, client: FlaskClient, auth_headers, monkeypatch
+) -> None:
+    """Is a matching If-None-Match answered before the database is touched?"""
+
+    with client:
+        idea_id = client.get("/api/ideas/random", headers=auth_headers).json["idea"][
+            "ideaId"
+        ]
+        etag = client.get(f"/api/ideas/{idea_id}", headers=auth_headers).headers["ETag"]
+        sessions = []
+        monkeypatch.setattr(app.driver, "session", lambda **config: sessions.append(1))
+
+        res = client.get(
+            f"/api/ideas/{idea_id}", headers={**auth_headers, "If-None-Match": etag}
+        )
+
+        assert res.status_code == 304
+        assert sessions == []
+
+
+def test_idea_reactions_are_cached_until_reacted_to(
+    client: FlaskClient, logged_in_user, auth_headers
+) -> None:
+    """Do unchanged reactions answer 304, and new ones a new ETag?"""
+
+    with client:
+        user_id = logged_in_user["user"]["sub"]
+        idea_id = client.get(f"/api/ideas/user/{user_id}", headers=auth_headers).json[
+            "ideas"
+        ][0]["ideaId"]
+        url = f"/api/ideas/{idea_id}/reactions"
+        first = client.get(url, headers=auth_headers)
+        etag = first.headers["ETag"]
+        unchanged = client.get(url, headers={**auth_headers, "If-None-Match": etag})
+        client.post(
+            f"/api/ideas/{idea_id}/react",
+            json={"type": "dislike"},
+            headers=auth_headers,
+        )
+        changed = client.get(url, headers={**auth_headers, "If-None-Match": etag})
+
+        assert first.status_code == 200
+        assert unchanged.status_code == 304
+        assert changed.status_code == 200
+        assert changed.headers["ETag"] != etag
+        assert changed.json["reactions"]["userReaction"] == "DISLIKES"